@@ -99,6 +99,122 @@ CHANNEL_LAYERS = {
     },
 }
 
+# The in-memory layer only reaches consumers of the same process. To serve
+# rooms from several ASGI workers on one host, run `python manage.py runbroker`
+# and point every worker at the same socket:
+# CHANNEL_LAYERS = {
+#     'default': {
+#         'BACKEND': 'realtime.layers.BrokerChannelLayer',
+#         'CONFIG': {'path': '/tmp/whiteboard-broker.sock'},
+#     },
+# }
+
+# Write-behind buffer for drawing elements received over WebSockets.
+# Changes are flushed every FLUSH_INTERVAL seconds or once MAX_BATCH
+# elements are pending, whichever comes first.
+WHITEBOARD_WRITE_BUFFER = {
+    'FLUSH_INTERVAL': 0.5,
+    'MAX_BATCH': 200,
+}
+
+# Each open WebSocket counts towards its room's connected users until TTL
+# seconds after its last heartbeat (sent every TTL / 3 seconds). Counts are
+# kept in the default cache, which must be shared (e.g. Redis) when more than
+# one server process runs; the default local-memory cache is per process.
+WHITEBOARD_PRESENCE = {
+    'TTL': 60,
+}
+
+# Cursor positions are broadcast TICK_RATE times per second as one combined
+# frame per room and saved to RoomParticipant every PERSIST_INTERVAL seconds
+# (None disables saving).
+WHITEBOARD_CURSORS = {
+    'TICK_RATE': 20,
+    'PERSIST_INTERVAL': 10,
+}
+
+# Initial whiteboard state is streamed to joining clients in chunks of
+# CHUNK_SIZE elements, starting with the ones inside their viewport.
+WHITEBOARD_INITIAL_STATE = {
+    'CHUNK_SIZE': 500,
+}
+
+# Every element change is appended to the room's operation log; a compressed
+# checkpoint of the scene is stored every CHECKPOINT_INTERVAL operations.
+WHITEBOARD_OPLOG = {
+    'CHECKPOINT_INTERVAL': 1000,
+}
+
+# Deleted elements older than MIN_AGE seconds are removed BATCH_SIZE rows
+# per transaction with PAUSE seconds in between. ARCHIVE keeps a compressed
+# copy in ElementArchive. `python manage.py compact_elements` runs it once;
+# with --forever it repeats every INTERVAL seconds (run a single one per
+# deployment, next to the server processes).
+WHITEBOARD_COMPACTION = {
+    'INTERVAL': 3600,
+    'MIN_AGE': 3600,
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.05,
+    'ARCHIVE': False,
+}
+
+# Board previews are rendered by POOL_SIZE worker processes, each render
+# stopping after TIME_BUDGET seconds. Requests never wait for one: missing
+# or outdated thumbnails are queued and a placeholder or the old one is
+# answered with Retry-After. `manage.py refresh_thumbnails` (one per
+# deployment) re-renders room thumbnails DELAY seconds after the last change.
+WHITEBOARD_THUMBNAILS = {
+    'POOL_SIZE': 2,
+    'TIME_BUDGET': 5.0,
+    'SIZE': (320, 180),
+    'DELAY': 10.0,
+}
+
+# Broadcasts to each client are queued and sent as fast as it reads them.
+# Superseded updates (cursors, the same element) are merged in the queue.
+# A client more than MAX_SIZE broadcasts or MAX_LAG seconds behind is
+# handled by LAG_POLICY: 'resync' resends the board, 'disconnect' closes
+# the connection so the client reconnects.
+WHITEBOARD_OUTBOUND_QUEUE = {
+    'MAX_SIZE': 256,
+    'MAX_LAG': 5.0,
+    'LAG_POLICY': 'resync',
+}
+
+# Users without a Permission row in a public room, or in a room they
+# joined, get the DEFAULT level. Resolved levels are cached per process for
+# CACHE_TTL seconds, for up to CACHE_SIZE (room, user) pairs.
+WHITEBOARD_PERMISSIONS = {
+    'DEFAULT': 'edit',
+    'CACHE_TTL': 60,
+    'CACHE_SIZE': 10000,
+}
+
+# With ENABLED, consumer writes go through one writer thread per process,
+# which commits up to MAX_BATCH of them together after waiting at most
+# MAX_DELAY seconds for more, and consumer reads run on READERS threads.
+# SQLite connections then use WAL with the given synchronous mode and wait
+# up to BUSY_TIMEOUT seconds for a lock held by another process.
+WHITEBOARD_DB_WRITER = {
+    'ENABLED': False,
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.002,
+    'READERS': 4,
+    'WAL': True,
+    'SYNCHRONOUS': 'NORMAL',
+    'BUSY_TIMEOUT': 5.0,
+}
+
+# Element imports (`python manage.py import_elements` or POST
+# /api/rooms/<id>/import/) insert BATCH_SIZE elements per transaction and
+# record the first MAX_ERRORS invalid rows. Uploaded files are imported by
+# WORKERS background threads per process.
+WHITEBOARD_IMPORTS = {
+    'BATCH_SIZE': 1000,
+    'MAX_ERRORS': 100,
+    'WORKERS': 1,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class RealtimeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'realtime'
+
+    def ready(self):
+        from whiteboard.broadcast import elements_replacing
+        from whiteboard.models import Permission, Room
+        from .buffers import flush_room
+        from .context import permission_updated, room_updated
+        from .writer import configure_connection, enabled
+        if enabled():
+            connection_created.connect(configure_connection, dispatch_uid='realtime-db-writer')
+
+        # Buffered element changes are written before a room is cleared or restored
+        elements_replacing.connect(flush_room, dispatch_uid='realtime-flush-room')
+
+        # Connected consumers reload their RoomContext
+        for signal in (post_save, post_delete):
+            signal.connect(room_updated, sender=Room)
+            signal.connect(permission_updated, sender=Permission)
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import struct
+
+try:
+    import msgpack
+except ImportError:  # Only needed when the broker channel layer is used
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# Every frame is a 4-byte big-endian length followed by a MessagePack array
+HEADER = struct.Struct('>I')
+MAX_FRAME = 64 * 1024 * 1024
+
+# Frames queued for one slow peer before further ones are dropped
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+
+
+def pack_frame(*items):
+    body = msgpack.packb(list(items), use_bin_type=True)
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader):
+    """Read one frame; raises asyncio.IncompleteReadError on EOF"""
+    header = await reader.readexactly(HEADER.size)
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f'Frame of {length} bytes exceeds the limit')
+    body = await reader.readexactly(length)
+    return msgpack.unpackb(body, raw=False)
+
+
+class FrameWriter:
+    """Coalesces frames queued in the same loop iteration into one write.
+
+    A group_send to many local channels, or a burst of stroke deltas, ends
+    up as a single syscall instead of one per frame.
+    """
+
+    def __init__(self, writer, name):
+        self.writer = writer
+        self.name = name
+        self.pending = []
+        self.pending_bytes = 0
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def send(self, frame):
+        if self.pending_bytes + len(frame) > MAX_PENDING_BYTES:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning('Dropped %d frames for slow peer %s', self.dropped, self.name)
+            return
+        self.pending.append(frame)
+        self.pending_bytes += len(frame)
+        self._wakeup.set()
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                data = b''.join(self.pending)
+                self.pending = []
+                self.pending_bytes = 0
+                self.writer.write(data)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def drain(self):
+        """Write queued frames now instead of on the next loop iteration"""
+        data = b''.join(self.pending)
+        self.pending = []
+        self.pending_bytes = 0
+        if data:
+            self.writer.write(data)
+        await self.writer.drain()
+
+    def close(self):
+        self._task.cancel()
+
+
+class Broker:
+    """Routes channel layer traffic between worker processes on one host.
+
+    Each worker holds one connection, identified by the client id embedded
+    in its channel names. Group membership is tracked per worker, so a
+    group_send reaches every worker with members in a single frame listing
+    the local channels to deliver to; the message body is forwarded as the
+    bytes the sender packed and is never decoded here.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        # client id -> FrameWriter
+        self.clients = {}
+        # group -> {client id: set of channel names}
+        self.groups = {}
+        self.frames_in = 0
+        self.frames_out = 0
+
+    async def serve(self):
+        if msgpack is None:
+            raise RuntimeError('The channel layer broker requires msgpack')
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        os.chmod(self.path, 0o600)
+        logger.info('Channel layer broker listening on %s', self.path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def handle_client(self, reader, writer):
+        client_id = None
+        try:
+            frame = await read_frame(reader)
+            if frame[0] != 'hello':
+                return
+            client_id = frame[1]
+            previous = self.clients.pop(client_id, None)
+            if previous is not None:
+                previous.close()
+                self.forget(client_id)
+            self.clients[client_id] = FrameWriter(writer, client_id)
+            logger.info('Worker %s connected', client_id)
+
+            while True:
+                frame = await read_frame(reader)
+                self.frames_in += 1
+                self.dispatch(client_id, frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            logger.exception('Closing connection to worker %s', client_id)
+        finally:
+            current = self.clients.get(client_id)
+            if current is not None and current.writer is writer:
+                del self.clients[client_id]
+                current.close()
+                self.forget(client_id)
+                logger.info('Worker %s disconnected', client_id)
+            else:
+                writer.close()
+
+    def dispatch(self, client_id, frame):
+        command = frame[0]
+        if command == 'send':
+            _, channel, body = frame
+            self.deliver(owner(channel), [channel], body)
+        elif command == 'group_send':
+            _, group, body = frame
+            for member, channels in self.groups.get(group, {}).items():
+                self.deliver(member, list(channels), body)
+        elif command == 'group_add':
+            _, group, channel, ack = frame
+            self.groups.setdefault(group, {}).setdefault(client_id, set()).add(channel)
+            if ack is not None:
+                # Confirm so the worker knows later group_sends from any
+                # process will include this channel
+                self.clients[client_id].send(pack_frame('ack', ack))
+        elif command == 'group_discard':
+            _, group, channel = frame
+            self.discard(group, client_id, channel)
+        elif command == 'flush':
+            self.forget(client_id)
+        else:
+            logger.warning('Unknown broker command %r from %s', command, client_id)
+
+    def deliver(self, client_id, channels, body):
+        client = self.clients.get(client_id)
+        if client is not None:
+            client.send(pack_frame('deliver', channels, body))
+            self.frames_out += 1
+
+    def discard(self, group, client_id, channel):
+        members = self.groups.get(group)
+        if not members:
+            return
+        channels = members.get(client_id)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del members[client_id]
+        if not members:
+            del self.groups[group]
+
+    def forget(self, client_id):
+        """Drop every group membership held by a worker"""
+        for group in list(self.groups):
+            members = self.groups[group]
+            members.pop(client_id, None)
+            if not members:
+                del self.groups[group]
+
+
+def owner(channel):
+    """Client id of the worker a channel name belongs to.
+
+    Channel names look like 'prefix.<client id>!<suffix>'.
+    """
+    name = channel.split('!', 1)[0]
+    return name.rsplit('.', 1)[-1]
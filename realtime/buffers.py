@@ -0,0 +1,384 @@
+import asyncio
+import atexit
+import logging
+import math
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from whiteboard.geometry import BOUND_FIELDS, GEOMETRY_FIELDS, path_points
+from whiteboard.models import DrawingElement
+from whiteboard.oplog import Operation, append, element_data, op_data
+from .writer import database_read, database_write
+
+logger = logging.getLogger(__name__)
+
+# Ids of a room's elements remembered to skip the query that checks them;
+# the set starts over once it holds this many
+MAX_KNOWN_IDS = 10000
+
+
+def buffer_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_WRITE_BUFFER', {}).get(name, default)
+
+
+def clean_fields(fields):
+    """Element fields from a client message converted to their model
+    field's type; raises ValueError naming the first invalid one.
+
+    A value that cannot be saved would otherwise only fail once its batch
+    is flushed, after the change was broadcast.
+    """
+    cleaned = {}
+    for name, value in fields.items():
+        field = DrawingElement._meta.get_field(name)
+        try:
+            value = field.to_python(value)
+        except ValidationError:
+            raise ValueError(f'Invalid {name}')
+        if value is None and not field.null:
+            raise ValueError(f'{name} may not be null')
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f'{name} must be a finite number')
+        if isinstance(value, str) and field.max_length is not None and len(value) > field.max_length:
+            raise ValueError(f'{name} is longer than {field.max_length} characters')
+        if name == 'path_data' and not all(map(math.isfinite, path_points(value))):
+            raise ValueError('path_data must hold finite coordinates')
+        cleaned[name] = value
+    return cleaned
+
+
+class ElementWriteBuffer:
+    """Per-room write-behind buffer for drawing element mutations.
+
+    Consumers record creates and updates here instead of hitting the database
+    on every message. Pending changes are coalesced per element id and written
+    with bulk_create/bulk_update in one transaction when FLUSH_INTERVAL elapses
+    or MAX_BATCH elements are waiting, whichever comes first.
+
+    Only live elements of the buffer's room can be updated or deleted
+    through it. A batch that fails is written again one change at a time,
+    so only the changes that fail on their own are lost.
+    """
+
+    _buffers = {}
+
+    def __init__(self, room_id):
+        self.room_id = str(room_id)
+        self.flush_interval = buffer_setting('FLUSH_INTERVAL', 0.5)
+        self.max_batch = buffer_setting('MAX_BATCH', 200)
+        self.connections = 0
+
+        # element id -> unsaved DrawingElement instance
+        self.pending_creates = {}
+        # element id -> {field: value} for rows that already exist
+        self.pending_updates = {}
+        # element id -> id of the user behind the latest pending update
+        self.pending_users = {}
+        # Ids of live elements known to be in this room
+        self.known_ids = set()
+        # Ids of created elements taken by a flush that has not committed
+        self.writing_ids = set()
+        # Client-chosen ids of strokes still being drawn, which become the
+        # ids of their elements
+        self.reserved_ids = set()
+
+        # Flush metrics
+        self.last_flush_latency = 0.0
+        self.last_batch_size = 0
+        self.max_flush_latency = 0.0
+        self.flush_count = 0
+        self.total_flushed = 0
+
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._flush_task = None
+
+    @classmethod
+    def acquire(cls, room_id):
+        """Return the buffer for a room, registering one more connection"""
+        room_id = str(room_id)
+        buffer = cls._buffers.get(room_id)
+        if buffer is None:
+            buffer = cls._buffers[room_id] = cls(room_id)
+        buffer.connections += 1
+        return buffer
+
+    async def release(self):
+        """Drop a connection and flush; forget the buffer once nobody uses it"""
+        self.connections -= 1
+        await self.flush()
+        if self.connections <= 0 and not self.pending:
+            self._cancel_timer()
+            if self._buffers.get(self.room_id) is self:
+                del self._buffers[self.room_id]
+
+    @property
+    def pending(self):
+        return len(self.pending_creates) + len(self.pending_updates)
+
+    def create(self, **fields):
+        """Queue a new element and return its id"""
+        element = DrawingElement(room_id=self.room_id, **fields)
+        self.pending_creates[str(element.id)] = element
+        self.reserved_ids.discard(str(element.id))
+        self._schedule()
+        return element.id
+
+    async def reserve(self, element_id):
+        """Claim an id for an element created later; False if an element or
+        another reservation has it"""
+        key = str(element_id)
+        if key in self.reserved_ids or key in self.pending_creates or key in self.writing_ids:
+            return False
+        self.reserved_ids.add(key)
+        taken = await database_read(DrawingElement.objects.filter(id=key).exists)()
+        if taken:
+            self.reserved_ids.discard(key)
+        return not taken
+
+    def unreserve(self, element_id):
+        self.reserved_ids.discard(str(element_id))
+
+    async def contains(self, key):
+        """Whether an element id belongs to this room and is not deleted"""
+        if key in self.pending_creates:
+            return not self.pending_creates[key].is_deleted
+        if self.pending_updates.get(key, {}).get('is_deleted'):
+            return False
+        if key in self.writing_ids or key in self.known_ids:
+            return True
+        found = await database_read(
+            DrawingElement.objects.filter(room_id=self.room_id, id=key, is_deleted=False).exists
+        )()
+        if found:
+            self.remember([key])
+        return found
+
+    def remember(self, keys):
+        if len(self.known_ids) >= MAX_KNOWN_IDS:
+            self.known_ids.clear()
+        self.known_ids.update(keys)
+
+    def forget(self):
+        """Stop trusting the remembered ids, e.g. after the room was cleared"""
+        self.known_ids.clear()
+
+    async def update(self, element_id, user=None, **fields):
+        """Queue field changes for an element, merging with pending ones.
+
+        Returns False, queuing nothing, unless the element is in this room.
+        """
+        try:
+            key = str(uuid.UUID(str(element_id)))
+        except ValueError:
+            return False
+        if not await self.contains(key):
+            return False
+        if not fields:
+            return True
+
+        element = self.pending_creates.get(key)
+        if element is not None:
+            for name, value in fields.items():
+                setattr(element, name, value)
+        else:
+            self.pending_updates.setdefault(key, {}).update(
+                fields, updated_at=timezone.now()
+            )
+            self.pending_users[key] = getattr(user, 'pk', None)
+        self._schedule()
+        return True
+
+    async def delete(self, element_id, user=None):
+        return await self.update(element_id, user=user, is_deleted=True)
+
+    def stats(self):
+        return {
+            'room_id': self.room_id,
+            'pending': self.pending,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'last_batch_size': self.last_batch_size,
+            'flush_count': self.flush_count,
+            'total_flushed': self.total_flushed,
+        }
+
+    def _schedule(self):
+        if self.pending >= self.max_batch:
+            self._cancel_timer()
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.ensure_future(self.flush())
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _take_pending(self):
+        creates = list(self.pending_creates.values())
+        updates = self.pending_updates
+        users = self.pending_users
+        # Until their write commits, the database does not know them yet
+        self.writing_ids.update(str(element.id) for element in creates if not element.is_deleted)
+        self.pending_creates = {}
+        self.pending_updates = {}
+        self.pending_users = {}
+        return creates, updates, users
+
+    async def flush(self):
+        """Write every pending change to the database"""
+        async with self._lock:
+            self._cancel_timer()
+            creates, updates, users = self._take_pending()
+            if not creates and not updates:
+                return
+
+            started = time.perf_counter()
+            try:
+                await database_write(self.write)(creates, updates, users)
+            except Exception:
+                # One bad change must not cost everybody else theirs
+                logger.exception(
+                    'Failed to flush %d buffered element changes for room %s, writing them one by one',
+                    len(creates) + len(updates), self.room_id
+                )
+                await database_write(self.write_each)(creates, updates, users)
+            finally:
+                self.writing_ids.difference_update(str(element.id) for element in creates)
+            self._record_flush(time.perf_counter() - started, len(creates) + len(updates))
+
+    def flush_sync(self):
+        """Flush from synchronous code, e.g. at interpreter shutdown"""
+        creates, updates, users = self._take_pending()
+        if creates or updates:
+            started = time.perf_counter()
+            try:
+                self.write(creates, updates, users)
+            except Exception:
+                self.write_each(creates, updates, users)
+            finally:
+                self.writing_ids.difference_update(str(element.id) for element in creates)
+            self._record_flush(time.perf_counter() - started, len(creates) + len(updates))
+
+    def write_each(self, creates, updates, users=None):
+        """Write a batch that failed as a whole one change at a time,
+        dropping only the changes that fail on their own"""
+        for element in creates:
+            self._write_or_drop(str(element.id), [element], {}, users)
+        for element_id, fields in updates.items():
+            self._write_or_drop(element_id, [], {element_id: fields}, users)
+
+    def _write_or_drop(self, element_id, creates, updates, users):
+        try:
+            self.write(creates, updates, users)
+        except Exception:
+            logger.exception('Dropped buffered change to element %s of room %s', element_id, self.room_id)
+
+    def write(self, creates, updates, users=None):
+        """Apply a batch and append it to the room's operation log in one transaction"""
+        users = users or {}
+        with transaction.atomic():
+            if creates:
+                for element in creates:
+                    element.pack_path()
+                    element.update_bounds()
+                DrawingElement.objects.bulk_create(creates, batch_size=500)
+
+            # Only live elements of this room change through its buffer;
+            # changed geometry also needs the rest of the row to recompute bounds
+            current = {}
+            if updates:
+                current = (
+                    DrawingElement.objects.filter(room_id=self.room_id, is_deleted=False)
+                    .only(*GEOMETRY_FIELDS, 'path_blob').in_bulk(list(updates))
+                )
+            unknown = [element_id for element_id in updates if uuid.UUID(element_id) not in current]
+            if unknown:
+                logger.warning(
+                    'Dropped changes to %d elements deleted or not in room %s', len(unknown), self.room_id
+                )
+                updates = {
+                    element_id: fields for element_id, fields in updates.items()
+                    if uuid.UUID(element_id) in current
+                }
+            for element_id, fields in updates.items():
+                if not GEOMETRY_FIELDS.intersection(fields):
+                    continue
+                element = current[uuid.UUID(element_id)]
+                for name, value in fields.items():
+                    setattr(element, name, value)
+                element.pack_path()
+                element.update_bounds()
+                fields.update({name: getattr(element, name) for name in BOUND_FIELDS})
+                if 'path_data' in fields:
+                    fields.update(path_data=element.path_data, path_blob=element.path_blob)
+
+            # bulk_update needs one field list per call, so group by field set
+            by_fields = {}
+            for element_id, fields in updates.items():
+                by_fields.setdefault(tuple(sorted(fields)), []).append(
+                    DrawingElement(id=element_id, **fields)
+                )
+            for field_names, elements in by_fields.items():
+                DrawingElement.objects.bulk_update(elements, field_names, batch_size=500)
+
+            # Elements created and deleted within one batch leave no trace
+            operations = [
+                Operation('add', element.id, element_data(element), element.created_by_id)
+                for element in creates if not element.is_deleted
+            ]
+            for element_id, fields in updates.items():
+                if fields.get('is_deleted'):
+                    operations.append(Operation('delete', element_id, None, users.get(element_id)))
+                else:
+                    operations.append(Operation('update', element_id, op_data(fields), users.get(element_id)))
+            append(self.room_id, operations)
+        self.remember(str(element.id) for element in creates if not element.is_deleted)
+        self.known_ids.difference_update(
+            element_id for element_id, fields in updates.items() if fields.get('is_deleted')
+        )
+
+    def _record_flush(self, latency, batch_size):
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.last_batch_size = batch_size
+        self.flush_count += 1
+        self.total_flushed += batch_size
+        logger.debug(
+            'Flushed %d element changes for room %s in %.1f ms',
+            batch_size, self.room_id, latency * 1000
+        )
+
+
+def flush_room(sender, room_id, **kwargs):
+    """elements_replacing receiver writing what this process buffers for a
+    room before its elements are cleared or replaced"""
+    buffer = ElementWriteBuffer._buffers.get(str(room_id))
+    if buffer is None:
+        return
+    # Runs the flush on the server's event loop, which owns the buffer
+    async_to_sync(buffer.flush)()
+    buffer.forget()
+
+
+@atexit.register
+def flush_all_buffers():
+    """Persist whatever is still buffered when the server shuts down"""
+    for buffer in list(ElementWriteBuffer._buffers.values()):
+        try:
+            buffer.flush_sync()
+        except Exception:
+            logger.exception('Failed to flush element buffer for room %s', buffer.room_id)
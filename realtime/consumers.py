@@ -1,77 +1,167 @@
+import asyncio
 import json
+from dataclasses import replace
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
-from whiteboard.models import Room, RoomParticipant, DrawingElement, Permission
+from whiteboard.models import RoomParticipant, DrawingElement
+from whiteboard.geometry import element_bounds, intersects, parse_bbox
+from whiteboard.oplog import Operation, append
+from whiteboard import presence
+from whiteboard.broadcast import room_group
+from whiteboard.codecs import encode_once, select_codec
+from whiteboard.permissions import forget
+from django.db import transaction
 from django.utils import timezone
-from django.core.serializers.json import DjangoJSONEncoder
+from .buffers import ElementWriteBuffer, clean_fields
+from .context import load_context
+from .cursors import CursorAggregator, parse_position
+from .outbound import RESYNC_KEEP, OutboundQueue, merge_cursors, merge_element_update
+from .state import element_chunks
+from .strokes import MAX_OPEN_STROKES, Stroke, parse_points, parse_stroke_id
+from .writer import database_read, database_write
+
+# Fields a client may change through update_element
+UPDATABLE_FIELDS = [
+    'x', 'y', 'width', 'height', 'color', 'stroke_width', 'opacity',
+    'path_data', 'text_content', 'font_size', 'font_family', 'z_index'
+]
+
+# Style of a stroke, given in stroke_begin
+STROKE_STYLE_FIELDS = ['color', 'stroke_width', 'opacity']
+
+# Close code for clients dropped by the 'disconnect' lag policy
+LAGGING_CLOSE_CODE = 4008
+
+# Permission level each message type requires; others only need view
+MESSAGE_PERMISSIONS = {
+    'draw': 'draw',
+    'erase': 'draw',
+    'add_element': 'draw',
+    'stroke_begin': 'draw',
+    'stroke_points': 'draw',
+    'stroke_end': 'draw',
+    'update_element': 'edit',
+    'delete_element': 'edit',
+    'clear': 'admin',
+}
+
+# Messages that change an existing element when they name one, which
+# takes edit permission like update_element
+EXISTING_ELEMENT_MESSAGES = {'draw', 'erase'}
 
 
 class WhiteboardConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'whiteboard_{self.room_id}'
+        self.room_group_name = room_group(self.room_id)
         self.user = self.scope["user"]
+        # Pen strokes this connection is still drawing, keyed by stroke id
+        self.open_strokes = {}
+        # Area the client is looking at, announced as ?viewport=x0,y0,x1,y1
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.viewport = parse_bbox(query.get('viewport', [None])[0])
+        # ?paths=compact sends stroke paths in the binary encoding
+        self.compact_paths = query.get('paths', ['legacy'])[0] == 'compact'
+        # Strokes in progress whose start this client has been sent
+        self.visible_strokes = set()
         
         if not self.user.is_authenticated:
             await self.close()
             return
         
-        # Check if user has permission to join the room
-        room_exists = await self.check_room_exists()
-        if not room_exists:
+        # Room settings and the user's permission, kept for the connection
+        self.context = await load_context(self.room_id, self.user)
+        if self.context is None or not self.context.allows('view'):
             await self.close()
             return
         
+        # Element writes are buffered per room and flushed in batches
+        self.write_buffer = ElementWriteBuffer.acquire(self.room_id)
+        
+        # Cursor positions are collected per room and broadcast on a tick
+        self.cursor_aggregator = CursorAggregator.acquire(
+            self.room_id, self.channel_layer, self.room_group_name
+        )
+        
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
         
-        await self.accept()
+        # Use the binary subprotocol when the client offers it, JSON otherwise
+        self.codec, subprotocol = select_codec(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=subprotocol)
+        
+        # Everything sent from here on goes through a bounded per-client queue
+        self.outbound = OutboundQueue(self.send, self.codec, self.on_lag)
         
         # Add user as participant
-        await self.add_participant()
+        self.context = replace(self.context, participant_id=await self.add_participant())
+        await presence.connected(self.room_id, self.channel_name, self.user.id)
+        self.presence_task = asyncio.ensure_future(
+            presence.heartbeat(self.room_id, self.channel_name, self.user.id)
+        )
         
         # Send current whiteboard state to the new user
         await self.send_current_state()
         
         # Notify other users that someone joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_joined',
-                'user': self.user.username,
-                'message': f'{self.user.username} joined the room'
-            }
-        )
+        await self.broadcast({
+            'type': 'user_joined',
+            'user': self.user.username,
+            'message': f'{self.user.username} joined the room'
+        })
     
     async def disconnect(self, close_code):
+        # Keep strokes that were cut off by the disconnect
+        for stroke_id in list(self.open_strokes):
+            await self.handle_stroke_end({'stroke_id': stroke_id})
+        
+        if hasattr(self, 'cursor_aggregator'):
+            self.cursor_aggregator.remove(self.user.username)
+            await self.cursor_aggregator.release()
+        
         # Remove user from participants
-        await self.remove_participant()
+        context = getattr(self, 'context', None)
+        if context is not None and context.participant_id is not None:
+            self.presence_task.cancel()
+            await presence.disconnected(self.room_id, self.channel_name)
+            await self.remove_participant(context.participant_id)
         
         # Notify other users that someone left
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_left',
-                'user': self.user.username,
-                'message': f'{self.user.username} left the room'
-            }
-        )
+        await self.broadcast({
+            'type': 'user_left',
+            'user': self.user.username,
+            'message': f'{self.user.username} left the room'
+        })
         
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        
+        if hasattr(self, 'outbound'):
+            self.outbound.close()
+        
+        # Persist anything this connection left in the write buffer
+        if hasattr(self, 'write_buffer'):
+            await self.write_buffer.release()
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = self.codec.decode(text_data, bytes_data)
             message_type = data.get('type')
             
+            # Checked against the context, without a query
+            required = MESSAGE_PERMISSIONS.get(message_type)
+            if message_type in EXISTING_ELEMENT_MESSAGES and data.get('element_id'):
+                required = 'edit'
+            if required is not None and not self.context.allows(required):
+                await self.send_error(f'{message_type} requires {required} permission')
+                return
+            
             if message_type == 'draw':
                 await self.handle_draw(data)
             elif message_type == 'erase':
@@ -86,166 +176,391 @@ class WhiteboardConsumer(AsyncWebsocketConsumer):
                 await self.handle_update_element(data)
             elif message_type == 'delete_element':
                 await self.handle_delete_element(data)
+            elif message_type == 'stroke_begin':
+                await self.handle_stroke_begin(data)
+            elif message_type == 'stroke_points':
+                await self.handle_stroke_points(data)
+            elif message_type == 'stroke_end':
+                await self.handle_stroke_end(data)
+            elif message_type == 'viewport':
+                await self.handle_viewport(data)
                 
         except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
+            await self.send_error('Invalid JSON format')
+        except ValueError:
+            await self.send_error('Invalid message format')
+    
+    async def send_message(self, message):
+        await self.outbound.put(self.codec.encode(message))
+    
+    async def broadcast(self, message, **meta):
+        """Send a message to the room group, encoded once for all recipients.
+
+        Extra keyword arguments travel next to the encoded payload so that
+        handlers can filter recipients without decoding it.
+        """
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': message['type'],
+                'payload': encode_once(message),
+                **meta
+            }
+        )
+    
+    async def send_payload(self, event, key=None, merge=None):
+        """Queue a broadcast for this client; see OutboundQueue for key and merge"""
+        self.outbound.push(event['type'], event['payload'][self.codec.subprotocol], key, merge)
+    
+    async def on_lag(self):
+        # The client stayed too far behind its queue of broadcasts
+        if self.outbound.lag_policy == 'disconnect':
+            await self.close(code=LAGGING_CLOSE_CODE)
+            return
+        try:
+            await self.resync()
+        finally:
+            self.outbound.lagging = False
+    
+    async def resync(self):
+        # Replace queued broadcasts with a fresh copy of the board
+        self.outbound.reset(keep=RESYNC_KEEP)
+        self.visible_strokes.clear()
+        await self.send_current_state(resync=True)
+    
+    async def send_error(self, message):
+        await self.send_message({
+            'type': 'error',
+            'message': message
+        })
     
     async def handle_draw(self, data):
         # Save drawing data and broadcast to other users
+        try:
+            element_id, fields = await self.save_drawing_element(data)
+        except ValueError as exc:
+            await self.send_error(f'Invalid draw message: {exc}')
+            return
+        if element_id is None:
+            await self.send_error('No such element in this room')
+            return
         element_data = {
             'type': 'draw_update',
-            'element_id': data.get('element_id'),
-            'path_data': data.get('path_data'),
-            'color': data.get('color', '#000000'),
-            'stroke_width': data.get('stroke_width', 2),
+            'element_id': str(element_id),
+            'path_data': fields.get('path_data', data.get('path_data')),
+            'color': fields.get('color', data.get('color', '#000000')),
+            'stroke_width': fields.get('stroke_width', data.get('stroke_width', 2)),
             'user': self.user.username
         }
         
-        # Save to database
-        await self.save_drawing_element(data)
+        # Broadcast to room group
+        await self.broadcast(element_data, element_id=element_data['element_id'])
+    
+    async def handle_stroke_begin(self, data):
+        # Start a stroke; points then arrive as deltas through stroke_points
+        try:
+            stroke_id = parse_stroke_id(data.get('stroke_id'))
+            points = parse_points(data.get('points', []))
+            style = clean_fields({name: data[name] for name in STROKE_STYLE_FIELDS if name in data})
+        except (TypeError, ValueError):
+            await self.send_error('Invalid stroke_begin message')
+            return
         
-        # Broadcast to room group (excluding sender)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            element_data
-        )
+        if str(stroke_id) in self.open_strokes or len(self.open_strokes) >= MAX_OPEN_STROKES:
+            await self.send_error('Cannot begin stroke')
+            return
+        
+        # The stroke id becomes its element's id, so it must not be one
+        # already saved, queued or being drawn, e.g. by a retried message
+        if not await self.write_buffer.reserve(stroke_id):
+            await self.send_error('Stroke id is already in use')
+            return
+        
+        stroke = Stroke(stroke_id, self.user, {**data, **style})
+        self.open_strokes[str(stroke_id)] = stroke
+        
+        await self.broadcast({
+            'type': 'stroke_started',
+            'stroke_id': str(stroke_id),
+            'points': stroke.append(points),
+            'user': self.user.username,
+            **stroke.style
+        }, sender=self.channel_name, stroke_id=str(stroke_id), bbox=stroke.bounds)
+    
+    async def handle_stroke_points(self, data):
+        # Append new points to an open stroke and broadcast only the delta
+        stroke = self.open_strokes.get(str(data.get('stroke_id')))
+        if stroke is None:
+            return
+        try:
+            points = stroke.append(parse_points(data.get('points')))
+        except (TypeError, ValueError):
+            await self.send_error('Invalid stroke_points message')
+            return
+        if not points:
+            return
+        
+        await self.broadcast({
+            'type': 'stroke_extended',
+            'stroke_id': str(stroke.id),
+            'points': points,
+            'user': self.user.username
+        }, sender=self.channel_name, stroke_id=str(stroke.id))
+    
+    async def handle_stroke_end(self, data):
+        # Persist the finished stroke once, as a single element
+        stroke = self.open_strokes.pop(str(data.get('stroke_id')), None)
+        if stroke is None:
+            return
+        try:
+            stroke.append(parse_points(data.get('points', [])))
+        except (TypeError, ValueError):
+            pass
+        
+        # Clients that never saw the stroke start but can now see its
+        # bounding box get the whole stroke as a regular element instead
+        meta = {}
+        if not stroke.points:
+            self.write_buffer.unreserve(stroke.id)
+        else:
+            fields = stroke.element_fields()
+            self.write_buffer.create(**fields)
+            meta = {
+                'bbox': stroke.bounds,
+                'element': encode_once(stroke.element_message(fields))
+            }
+        
+        await self.broadcast({
+            'type': 'stroke_finished',
+            'stroke_id': str(stroke.id),
+            'element_id': str(stroke.id) if stroke.points else None,
+            'user': self.user.username
+        }, sender=self.channel_name, stroke_id=str(stroke.id), **meta)
+    
+    async def handle_viewport(self, data):
+        # The client moved its view; resend the elements it can now see
+        viewport = parse_bbox(data.get('viewport'))
+        if viewport is None:
+            await self.send_error('Invalid viewport')
+            return
+        self.viewport = viewport
+        await self.send_current_state()
+    
+    def bounds_of(self, data):
+        """Bounding box of an element described by a client message, if valid"""
+        try:
+            return element_bounds(
+                element_type=data.get('element_type'),
+                x=data.get('x'),
+                y=data.get('y'),
+                width=data.get('width', 0),
+                height=data.get('height', 0),
+                stroke_width=data.get('stroke_width', 0),
+                text_content=data.get('text_content', ''),
+                font_size=data.get('font_size', 16)
+            )
+        except (TypeError, ValueError):
+            return None
+    
+    def in_view(self, event):
+        """Whether a broadcast touches this client's viewport"""
+        bbox = event.get('bbox')
+        return self.viewport is None or bbox is None or intersects(self.viewport, bbox)
     
     async def handle_add_element(self, data):
         # Add new element (text, shape, etc.)
-        element_id = await self.create_element(data)
+        try:
+            element_id, fields = self.create_element(data)
+        except ValueError as exc:
+            await self.send_error(f'Invalid add_element message: {exc}')
+            return
         
         element_data = {
             'type': 'element_added',
             'element_id': str(element_id),
-            'element_type': data.get('element_type'),
-            'x': data.get('x'),
-            'y': data.get('y'),
-            'width': data.get('width', 0),
-            'height': data.get('height', 0),
-            'color': data.get('color', '#000000'),
-            'text_content': data.get('text_content', ''),
+            'element_type': fields['element_type'],
+            'x': fields['x'],
+            'y': fields['y'],
+            'width': fields['width'],
+            'height': fields['height'],
+            'color': fields['color'],
+            'stroke_width': fields['stroke_width'],
+            'text_content': fields['text_content'],
+            'font_size': fields['font_size'],
             'user': self.user.username
         }
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            element_data
-        )
+        await self.broadcast(element_data, bbox=self.bounds_of(fields))
     
     async def handle_cursor_move(self, data):
-        # Update cursor position
-        await self.update_cursor_position(data.get('x', 0), data.get('y', 0))
+        try:
+            x, y = parse_position(data.get('x', 0), data.get('y', 0))
+        except ValueError as exc:
+            await self.send_error(f'Invalid cursor_move message: {exc}')
+            return
         
-        # Broadcast cursor position to other users
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'cursor_update',
-                'user': self.user.username,
-                'x': data.get('x', 0),
-                'y': data.get('y', 0)
-            }
-        )
+        # Record the position; the aggregator broadcasts it on its next tick
+        self.cursor_aggregator.move(self.user.username, x, y, self.context.participant_id)
     
     async def handle_clear(self):
-        # Clear the whiteboard
+        # Clear the whiteboard, including elements still waiting in the buffer
+        await self.write_buffer.flush()
         await self.clear_whiteboard()
+        self.write_buffer.forget()
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'whiteboard_cleared',
-                'user': self.user.username
-            }
-        )
+        await self.broadcast({
+            'type': 'whiteboard_cleared',
+            'user': self.user.username
+        })
     
     async def handle_erase(self, data):
         # Handle eraser tool
-        await self.save_drawing_element({
-            **data,
-            'element_type': 'eraser'
-        })
+        try:
+            element_id, fields = await self.save_drawing_element({
+                **data,
+                'element_type': 'eraser'
+            })
+        except ValueError as exc:
+            await self.send_error(f'Invalid erase message: {exc}')
+            return
+        if element_id is None:
+            await self.send_error('No such element in this room')
+            return
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'erase_update',
-                'x': data.get('x'),
-                'y': data.get('y'),
-                'size': data.get('size', 10),
-                'user': self.user.username
-            }
-        )
+        await self.broadcast({
+            'type': 'erase_update',
+            'x': data.get('x'),
+            'y': data.get('y'),
+            'size': data.get('size', 10),
+            'user': self.user.username
+        }, bbox=self.bounds_of({
+            'element_type': 'circle',
+            'x': data.get('x'),
+            'y': data.get('y'),
+            'width': data.get('size', 10)
+        }))
     
     async def handle_update_element(self, data):
         # Update existing element
         element_id = data.get('element_id')
         if element_id:
-            await self.update_element(element_id, data)
+            try:
+                fields = await self.update_element(element_id, data)
+            except ValueError as exc:
+                await self.send_error(f'Invalid update_element message: {exc}')
+                return
+            if fields is None:
+                await self.send_error('No such element in this room')
+                return
             
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'element_updated',
-                    'element_id': element_id,
-                    'data': data,
-                    'user': self.user.username
-                }
-            )
+            await self.broadcast({
+                'type': 'element_updated',
+                'element_id': element_id,
+                'data': {**data, **fields},
+                'user': self.user.username
+            }, element_id=element_id)
     
     async def handle_delete_element(self, data):
         # Delete element
         element_id = data.get('element_id')
         if element_id:
-            await self.delete_element(element_id)
+            if not await self.delete_element(element_id):
+                await self.send_error('No such element in this room')
+                return
             
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'element_deleted',
-                    'element_id': element_id,
-                    'user': self.user.username
-                }
-            )
+            await self.broadcast({
+                'type': 'element_deleted',
+                'element_id': element_id,
+                'user': self.user.username
+            }, element_id=element_id)
     
     # WebSocket message handlers
     async def draw_update(self, event):
-        await self.send(text_data=json.dumps(event))
+        # Each draw_update carries the element's whole path so far
+        element_id = event.get('element_id')
+        await self.send_payload(event, key=('draw_update', element_id) if element_id else None)
     
     async def element_added(self, event):
-        await self.send(text_data=json.dumps(event))
+        if self.in_view(event):
+            await self.send_payload(event)
     
-    async def cursor_update(self, event):
-        # Don't send cursor updates back to the sender
-        if event['user'] != self.user.username:
-            await self.send(text_data=json.dumps(event))
+    async def cursors(self, event):
+        # Skip frames that only carry the user's own cursor; clients ignore
+        # their own entry in mixed frames
+        if event['users'] != [self.user.username]:
+            await self.send_payload(event, key='cursors', merge=merge_cursors)
     
     async def user_joined(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_payload(event)
     
     async def user_left(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_payload(event)
     
     async def whiteboard_cleared(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_payload(event)
     
-    # Database operations
-    @database_sync_to_async
-    def check_room_exists(self):
-        try:
-            room = Room.objects.get(id=self.room_id)
-            return True
-        except Room.DoesNotExist:
-            return False
+    # Stroke deltas are already drawn locally by the sender, and only go to
+    # clients that saw the stroke start inside their viewport
+    async def stroke_started(self, event):
+        if event.get('sender') != self.channel_name and self.in_view(event):
+            self.visible_strokes.add(event['stroke_id'])
+            await self.send_payload(event)
+    
+    async def stroke_extended(self, event):
+        if event['stroke_id'] in self.visible_strokes:
+            await self.send_payload(event)
+    
+    async def stroke_finished(self, event):
+        if event['stroke_id'] in self.visible_strokes:
+            self.visible_strokes.discard(event['stroke_id'])
+            await self.send_payload(event)
+        elif (event.get('sender') != self.channel_name and 'element' in event
+                and self.in_view(event)):
+            self.outbound.push('element_added', event['element'][self.codec.subprotocol])
     
-    @database_sync_to_async
+    async def erase_update(self, event):
+        if self.in_view(event):
+            await self.send_payload(event)
+    
+    async def element_updated(self, event):
+        await self.send_payload(
+            event, key=('element_updated', event['element_id']), merge=merge_element_update
+        )
+    
+    async def element_deleted(self, event):
+        # Pending changes to a deleted element are pointless
+        self.outbound.discard(('element_updated', event['element_id']))
+        self.outbound.discard(('draw_update', event['element_id']))
+        await self.send_payload(event)
+    
+    async def elements_batch(self, event):
+        # Queued changes to elements the batch replaced or deleted are stale
+        for element_id in event['element_ids']:
+            self.outbound.discard(('element_updated', element_id))
+            self.outbound.discard(('draw_update', element_id))
+        # Like element_added, additions alone only go to clients that see them
+        if event['element_ids'] or self.in_view(event):
+            await self.send_payload(event)
+    
+    async def room_context_changed(self, event):
+        # The room or a permission in it was saved or deleted, maybe by
+        # another process whose cache invalidation did not reach this one
+        forget(self.room_id)
+        context = await load_context(self.room_id, self.user, self.context.participant_id)
+        if context is None or not context.allows('view'):
+            await self.close()
+            return
+        self.context = context
+    
+    async def room_reload(self, event):
+        # The room's elements were replaced wholesale, e.g. by a snapshot restore
+        await self.resync()
+    
+    # Database operations
+    @database_write
     def add_participant(self):
-        room = Room.objects.get(id=self.room_id)
         participant, created = RoomParticipant.objects.get_or_create(
-            room=room,
+            room_id=self.room_id,
             user=self.user,
             defaults={'is_active': True, 'last_activity': timezone.now()}
         )
@@ -253,113 +568,97 @@ class WhiteboardConsumer(AsyncWebsocketConsumer):
             participant.is_active = True
             participant.last_activity = timezone.now()
             participant.save()
+        return participant.id
     
-    @database_sync_to_async
-    def remove_participant(self):
-        try:
-            participant = RoomParticipant.objects.get(
-                room_id=self.room_id,
-                user=self.user
-            )
-            participant.is_active = False
-            participant.save()
-        except RoomParticipant.DoesNotExist:
-            pass
+    @database_write
+    def remove_participant(self, participant_id):
+        RoomParticipant.objects.filter(id=participant_id).update(is_active=False)
     
-    @database_sync_to_async
-    def save_drawing_element(self, data):
-        room = Room.objects.get(id=self.room_id)
+    # Buffered element writes; client values are checked before they are
+    # queued and raise ValueError, so a bad one never reaches a flush
+    async def save_drawing_element(self, data):
+        """The element id and its cleaned fields; the id is None for an
+        element that is not in this room"""
         element_id = data.get('element_id')
         
         if element_id:
             # Update existing element
-            try:
-                element = DrawingElement.objects.get(id=element_id)
-                element.path_data = data.get('path_data', element.path_data)
-                element.updated_at = timezone.now()
-                element.save()
-            except DrawingElement.DoesNotExist:
-                pass
-        else:
-            # Create new element
-            DrawingElement.objects.create(
-                room=room,
-                created_by=self.user,
-                element_type='pen',
-                x=data.get('x', 0),
-                y=data.get('y', 0),
-                color=data.get('color', '#000000'),
-                stroke_width=data.get('stroke_width', 2),
-                path_data=data.get('path_data', '')
-            )
+            fields = clean_fields({'path_data': data['path_data']}) if 'path_data' in data else {}
+            if not await self.write_buffer.update(element_id, user=self.user, **fields):
+                return None, fields
+            return element_id, fields
+        
+        # Create new element
+        fields = clean_fields({
+            'element_type': data.get('element_type', 'pen'),
+            'x': data.get('x', 0),
+            'y': data.get('y', 0),
+            'color': data.get('color', '#000000'),
+            'stroke_width': data.get('stroke_width', 2),
+            'path_data': data.get('path_data', '')
+        })
+        return self.write_buffer.create(created_by=self.user, **fields), fields
     
-    @database_sync_to_async
     def create_element(self, data):
-        room = Room.objects.get(id=self.room_id)
-        element = DrawingElement.objects.create(
-            room=room,
-            created_by=self.user,
-            element_type=data.get('element_type', 'pen'),
-            x=data.get('x', 0),
-            y=data.get('y', 0),
-            width=data.get('width', 0),
-            height=data.get('height', 0),
-            color=data.get('color', '#000000'),
-            stroke_width=data.get('stroke_width', 2),
-            text_content=data.get('text_content', ''),
-            font_size=data.get('font_size', 16)
-        )
-        return element.id
+        """The new element's id and its cleaned fields"""
+        fields = clean_fields({
+            'element_type': data.get('element_type', 'pen'),
+            'x': data.get('x', 0),
+            'y': data.get('y', 0),
+            'width': data.get('width', 0),
+            'height': data.get('height', 0),
+            'color': data.get('color', '#000000'),
+            'stroke_width': data.get('stroke_width', 2),
+            'text_content': data.get('text_content', ''),
+            'font_size': data.get('font_size', 16)
+        })
+        return self.write_buffer.create(created_by=self.user, **fields), fields
     
-    @database_sync_to_async
-    def update_cursor_position(self, x, y):
-        try:
-            participant = RoomParticipant.objects.get(
-                room_id=self.room_id,
-                user=self.user
-            )
-            participant.cursor_x = x
-            participant.cursor_y = y
-            participant.last_activity = timezone.now()
-            participant.save()
-        except RoomParticipant.DoesNotExist:
-            pass
+    async def update_element(self, element_id, data):
+        """The cleaned fields that were queued, or None for an element that
+        is not in this room"""
+        fields = clean_fields({name: data[name] for name in UPDATABLE_FIELDS if name in data})
+        if not await self.write_buffer.update(element_id, user=self.user, **fields):
+            return None
+        return fields
+    
+    async def delete_element(self, element_id):
+        return await self.write_buffer.delete(element_id, user=self.user)
     
-    @database_sync_to_async
+    @database_write
     def clear_whiteboard(self):
-        DrawingElement.objects.filter(room_id=self.room_id).update(is_deleted=True)
+        with transaction.atomic():
+            DrawingElement.objects.filter(room_id=self.room_id, is_deleted=False).update(
+                is_deleted=True, updated_at=timezone.now()
+            )
+            append(self.room_id, [Operation('clear', user_id=self.user.id)])
     
-    @database_sync_to_async
-    def get_room_elements(self):
-        elements = DrawingElement.objects.filter(
-            room_id=self.room_id,
-            is_deleted=False
-        ).order_by('z_index', 'created_at')
+    async def send_current_state(self, resync=False):
+        """Stream current whiteboard state to newly connected user in chunks"""
+        # Make sure buffered elements are visible to the queries below
+        await self.write_buffer.flush()
         
-        return [
-            {
-                'id': str(element.id),
-                'type': element.element_type,
-                'x': element.x,
-                'y': element.y,
-                'width': element.width,
-                'height': element.height,
-                'color': element.color,
-                'stroke_width': element.stroke_width,
-                'path_data': element.path_data,
-                'text_content': element.text_content,
-                'font_size': element.font_size,
-                'created_by': element.created_by.username
-            }
-            for element in elements
-        ]
-    
-    async def send_current_state(self):
-        """Send current whiteboard state to newly connected user"""
-        elements = await self.get_room_elements()
+        await self.send_message({
+            'type': 'initial_state_begin',
+            'viewport': self.viewport,
+            'resync': resync
+        })
         
-        await self.send(text_data=json.dumps({
-            'type': 'initial_state',
-            'elements': elements
-        }))
+        # Each chunk is one bounded query; elements in the viewport come first
+        chunks = element_chunks(self.room_id, self.viewport, compact_paths=self.compact_paths)
+        count = 0
+        while True:
+            elements = await database_read(next)(chunks, None)
+            if elements is None:
+                break
+            count += len(elements)
+            await self.send_message({
+                'type': 'initial_state_chunk',
+                'elements': elements
+            })
+        
+        await self.send_message({
+            'type': 'initial_state_end',
+            'count': count
+        })
 
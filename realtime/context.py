@@ -0,0 +1,71 @@
+"""Room data a consumer needs on every message, loaded once per connection.
+
+WhiteboardConsumer reads its RoomContext at connect with the async ORM and
+keeps it for the lifetime of the connection instead of querying the room
+again. Saving or deleting a room or one of its permissions sends a
+room_context_changed event to the room's group once the transaction
+commits, and each consumer in it loads a fresh context.
+"""
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from whiteboard.broadcast import room_group
+from whiteboard.models import Room
+from whiteboard.permissions import allows, aroom_permission
+
+# Room columns a context is built from
+ROOM_FIELDS = ('name', 'created_by_id', 'is_public', 'max_users', 'background_color', 'grid_enabled')
+
+
+@dataclass(frozen=True)
+class RoomContext:
+    room_id: str
+    name: str
+    created_by_id: int
+    is_public: bool
+    max_users: int
+    background_color: str
+    grid_enabled: bool
+    # The user's level in the room, see whiteboard.permissions
+    permission: Optional[str] = None
+    participant_id: Optional[int] = None
+
+    def allows(self, required):
+        return allows(self.permission, required)
+
+
+async def load_context(room_id, user, participant_id=None):
+    """RoomContext of a room for a user, or None if the room does not exist"""
+    try:
+        room = await Room.objects.only(*ROOM_FIELDS).aget(id=room_id)
+    except Room.DoesNotExist:
+        return None
+    return RoomContext(
+        room_id=str(room_id),
+        permission=await aroom_permission(room, user),
+        participant_id=participant_id,
+        **{name: getattr(room, name) for name in ROOM_FIELDS}
+    )
+
+
+def notify_changed(room_id):
+    """Tell every consumer in the room to reload its context"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(room_group(room_id), {
+        'type': 'room_context_changed',
+    })
+
+
+def room_updated(sender, instance, **kwargs):
+    transaction.on_commit(partial(notify_changed, instance.id))
+
+
+def permission_updated(sender, instance, **kwargs):
+    transaction.on_commit(partial(notify_changed, instance.room_id))
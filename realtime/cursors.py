@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from whiteboard.codecs import encode_once
+from whiteboard.models import RoomParticipant
+from .writer import database_write
+
+logger = logging.getLogger(__name__)
+
+
+def cursor_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_CURSORS', {}).get(name, default)
+
+
+def parse_position(x, y):
+    """Validate a client's cursor position and return it as floats; one
+    invalid value would otherwise fail the write of every position"""
+    try:
+        position = float(x), float(y)
+    except (TypeError, ValueError):
+        raise ValueError('x and y must be numbers')
+    if not all(map(math.isfinite, position)):
+        raise ValueError('x and y must be finite numbers')
+    return position
+
+
+class CursorAggregator:
+    """Per-room cursor state broadcast at a fixed tick.
+
+    Consumers record the latest position of their user here on every
+    cursor_move. Once per tick the aggregator sends a single ``cursors``
+    event to the room group containing every cursor that moved since the
+    previous tick. Positions are written to RoomParticipant every
+    PERSIST_INTERVAL seconds, or never when it is None.
+    """
+
+    _aggregators = {}
+
+    def __init__(self, room_id, channel_layer, group_name):
+        self.room_id = str(room_id)
+        self.channel_layer = channel_layer
+        self.group_name = group_name
+        self.tick = 1.0 / cursor_setting('TICK_RATE', 20)
+        self.persist_interval = cursor_setting('PERSIST_INTERVAL', 10)
+        self.connections = 0
+
+        # username -> {'user', 'x', 'y'}
+        self.positions = {}
+        self.changed = set()
+        # participant id -> (x, y) not yet written to the database
+        self.unsaved = {}
+        self.last_persist = time.monotonic()
+
+        self._task = None
+
+    @classmethod
+    def acquire(cls, room_id, channel_layer, group_name):
+        """Return the aggregator for a room, starting its tick if needed"""
+        room_id = str(room_id)
+        aggregator = cls._aggregators.get(room_id)
+        if aggregator is None:
+            aggregator = cls._aggregators[room_id] = cls(room_id, channel_layer, group_name)
+        aggregator.connections += 1
+        if aggregator._task is None:
+            aggregator._task = asyncio.ensure_future(aggregator._run())
+        return aggregator
+
+    async def release(self):
+        """Drop a connection; stop ticking once the room is empty"""
+        self.connections -= 1
+        if self.connections > 0:
+            return
+        if self._aggregators.get(self.room_id) is self:
+            del self._aggregators[self.room_id]
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.persist()
+
+    def move(self, username, x, y, participant_id=None):
+        self.positions[username] = {'user': username, 'x': x, 'y': y}
+        self.changed.add(username)
+        if participant_id is not None and self.persist_interval is not None:
+            self.unsaved[participant_id] = (x, y)
+
+    def remove(self, username):
+        self.positions.pop(username, None)
+        self.changed.discard(username)
+
+    async def emit(self):
+        """Broadcast every cursor that changed since the last tick"""
+        if not self.changed:
+            return
+        users = sorted(self.changed)
+        self.changed = set()
+        await self.channel_layer.group_send(
+            self.group_name,
+            {
+                'type': 'cursors',
+                'users': users,
+                'payload': encode_once({
+                    'type': 'cursors',
+                    'cursors': [self.positions[username] for username in users]
+                })
+            }
+        )
+
+    async def persist(self):
+        if not self.unsaved:
+            return
+        unsaved, self.unsaved = self.unsaved, {}
+        self.last_persist = time.monotonic()
+        try:
+            await database_write(self.save_positions)(unsaved)
+        except Exception:
+            logger.exception('Failed to persist cursor positions for room %s', self.room_id)
+
+    @staticmethod
+    def save_positions(unsaved):
+        now = timezone.now()
+        participants = [
+            RoomParticipant(id=participant_id, cursor_x=x, cursor_y=y, last_activity=now)
+            for participant_id, (x, y) in unsaved.items()
+        ]
+        RoomParticipant.objects.bulk_update(
+            participants, ['cursor_x', 'cursor_y', 'last_activity']
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.emit()
+                if (self.persist_interval is not None
+                        and time.monotonic() - self.last_persist >= self.persist_interval):
+                    await self.persist()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Cursor tick failed for room %s', self.room_id)
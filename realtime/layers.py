@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .broker import FrameWriter, msgpack, owner, pack_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    """Channel layer shared by the ASGI workers of one host.
+
+    Every worker process connects to a broker (`manage.py runbroker`) over
+    a Unix domain socket. Channel names embed the worker's client id, so
+    messages for a consumer in this process never leave it, and a
+    group_send costs one frame to the broker plus one frame per worker with
+    members, whatever the number of recipients. Only process-specific
+    channels and groups are routed between workers.
+
+    The broker knows a worker by its client id, so each worker holds a
+    single link. Once an event loop receives through the layer (the
+    server's, where consumers run), it owns the link and the channel
+    queues, and calls from other event loops, such as async_to_sync in a
+    background thread, are run on it. Until then the calling loop uses the
+    link and writes what it sends before returning.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path='/tmp/whiteboard-broker.sock', expiry=60, capacity=100,
+                 channel_capacity=None, connect_timeout=5, reconnect_delay=0.5):
+        if msgpack is None:
+            raise ImportError('BrokerChannelLayer requires msgpack')
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = str(path)
+        self.connect_timeout = connect_timeout
+        self.reconnect_delay = reconnect_delay
+        self.client_id = uuid.uuid4().hex[:12]
+
+        # channel name -> asyncio.Queue of (expires, message)
+        self.channels = {}
+        # group -> set of local channel names, replayed after a reconnect
+        self.groups = {}
+        # The event loop owning the channel queues and the broker link, and
+        # whether it receives through them
+        self._loop = None
+        self._receiving = False
+        self._connection = None
+        self._loop_lock = threading.Lock()
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific'):
+        # Its queue must belong to the loop that will own the layer
+        loop = self._owner_loop()
+        if loop is not None:
+            return await self._run_on(loop, self.new_channel(prefix))
+        channel = f'{prefix}.{self.client_id}!{uuid.uuid4().hex}'
+        self._queue(channel)
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        loop = self._owner_loop()
+        if loop is not None:
+            return await self._run_on(loop, self.send(channel, message))
+        if self.is_local(channel):
+            try:
+                self._queue(channel).put_nowait((time.time() + self.expiry, message))
+            except asyncio.QueueFull:
+                raise ChannelFull(channel)
+            return
+        connection = await self.connection()
+        connection.send('send', channel, self.pack(message))
+        await self._written(connection)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        loop = self._owner_loop(receiving=True)
+        if loop is not None:
+            return await self._run_on(loop, self.receive(channel))
+        # Deliveries for this channel only arrive once we are connected
+        await self.connection()
+        queue = self._queue(channel)
+        while True:
+            try:
+                expires, message = await queue.get()
+            except asyncio.CancelledError:
+                if queue.empty() and not self._in_group(channel):
+                    self.channels.pop(channel, None)
+                raise
+            if expires >= time.time():
+                return message
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        loop = self._owner_loop(receiving=True)
+        if loop is not None:
+            return await self._run_on(loop, self.group_add(group, channel))
+        self.groups.setdefault(group, set()).add(channel)
+        connection = await self.connection()
+        await connection.request('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        loop = self._owner_loop()
+        if loop is not None:
+            return await self._run_on(loop, self.group_discard(group, channel))
+        channels = self.groups.get(group)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.groups[group]
+        connection = await self.connection()
+        connection.send('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        loop = self._owner_loop()
+        if loop is not None:
+            return await self._run_on(loop, self.group_send(group, message))
+        connection = await self.connection()
+        connection.send('group_send', group, self.pack(message))
+        await self._written(connection)
+
+    async def flush(self):
+        loop = self._owner_loop()
+        if loop is not None:
+            return await self._run_on(loop, self.flush())
+        self.channels = {}
+        self.groups = {}
+        if self._connection is not None and not self._connection.closed:
+            self._connection.send('flush')
+
+    async def close(self):
+        loop = self._owner_loop()
+        if loop is not None:
+            return await self._run_on(loop, self.close())
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    # Internals
+
+    def is_local(self, channel):
+        return '!' in channel and owner(channel) == self.client_id
+
+    def pack(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(
+                maxsize=self.get_capacity(channel)
+            )
+        return queue
+
+    def _in_group(self, channel):
+        return any(channel in channels for channels in self.groups.values())
+
+    def deliver(self, channels, body):
+        """Hand a message received from the broker to local channels"""
+        message = msgpack.unpackb(body, raw=False)
+        expires = time.time() + self.expiry
+        for channel in channels:
+            queue = self.channels.get(channel)
+            if queue is None:
+                continue
+            try:
+                # Consumers may mutate what they receive, so each gets a copy
+                queue.put_nowait((expires, dict(message)))
+            except asyncio.QueueFull:
+                # Same as the in-memory layer: full channels miss group messages
+                pass
+
+    def _owner_loop(self, receiving=False):
+        """The receiving loop owning the layer when it is not the running
+        one, else None after the running loop took the layer over"""
+        loop = asyncio.get_running_loop()
+        with self._loop_lock:
+            owner_loop = self._loop
+            if owner_loop is loop:
+                self._receiving = self._receiving or receiving
+                return None
+            if self._receiving and owner_loop.is_running() and not owner_loop.is_closed():
+                return owner_loop
+            # The previous owner only sent, or has stopped: its link and
+            # queues are of no use here
+            self._loop, self._receiving, self._connection = loop, receiving, None
+            self.channels = {}
+            return None
+
+    async def _run_on(self, loop, coroutine):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    async def _written(self, connection):
+        # Without a receiving loop, the caller's loop may stop right after
+        # this call returns, before queued frames are written
+        if not self._receiving:
+            await connection.drain()
+
+    async def connection(self):
+        """Connection to the broker; call from the owning loop"""
+        connection = self._connection
+        if connection is None or connection.closed:
+            connection = self._connection = BrokerConnection(self)
+        await connection.opened()
+        return connection
+
+
+class BrokerConnection:
+    """One worker's link to the broker, bound to a single event loop.
+
+    Groups joined through this process are re-registered whenever the link
+    is re-established, so a broker restart only loses in-flight messages.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.closed = False
+        self.writer = None
+        # ack id -> future resolved when the broker confirms a request
+        self.waiting = {}
+        self._acks = itertools.count()
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def opened(self):
+        if not self._ready.is_set():
+            try:
+                await asyncio.wait_for(self._ready.wait(), self.layer.connect_timeout)
+            except asyncio.TimeoutError:
+                raise ConnectionError(f'No channel layer broker at {self.layer.path}')
+
+    def send(self, *items):
+        if self.writer is not None:
+            self.writer.send(pack_frame(*items))
+
+    async def drain(self):
+        """Write the frames sent so far"""
+        if self.writer is not None:
+            await self.writer.drain()
+
+    async def request(self, *items):
+        """Send a frame and wait until the broker has applied it"""
+        ack = next(self._acks)
+        future = self.waiting[ack] = asyncio.get_running_loop().create_future()
+        try:
+            self.send(*items, ack)
+            await asyncio.wait_for(future, self.layer.connect_timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError('Channel layer broker did not respond')
+        finally:
+            self.waiting.pop(ack, None)
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.layer.path)
+                except OSError as e:
+                    logger.warning('Channel layer broker unavailable at %s: %s', self.layer.path, e)
+                    await asyncio.sleep(self.layer.reconnect_delay)
+                    continue
+
+                self.writer = FrameWriter(writer, 'broker')
+                self.send('hello', self.layer.client_id)
+                for group, channels in self.layer.groups.items():
+                    for channel in channels:
+                        self.send('group_add', group, channel, None)
+                self._ready.set()
+
+                try:
+                    while True:
+                        frame = await read_frame(reader)
+                        if frame[0] == 'deliver':
+                            self.layer.deliver(frame[1], frame[2])
+                        elif frame[0] == 'ack':
+                            future = self.waiting.get(frame[1])
+                            if future is not None and not future.done():
+                                future.set_result(None)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    logger.warning('Lost connection to channel layer broker, reconnecting')
+                finally:
+                    self._ready.clear()
+                    self.writer.close()
+                    self.writer = None
+                await asyncio.sleep(self.layer.reconnect_delay)
+        except asyncio.CancelledError:
+            pass
+
+    def close(self):
+        self.closed = True
+        self._task.cancel()
+        if self.writer is not None:
+            self.writer.close()
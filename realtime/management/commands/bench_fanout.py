@@ -0,0 +1,72 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from whiteboard.codecs import CODECS, encode_once
+
+
+def sample_events():
+    """Representative broadcasts: a stroke delta and a new shape"""
+    return {
+        'stroke_extended': {
+            'type': 'stroke_extended',
+            'stroke_id': str(uuid.uuid4()),
+            'points': [float(i) + 0.25 for i in range(64)],
+            'user': 'alice',
+        },
+        'element_added': {
+            'type': 'element_added',
+            'element_id': str(uuid.uuid4()),
+            'element_type': 'rectangle',
+            'x': 120.5, 'y': 80.25, 'width': 300, 'height': 200,
+            'color': '#1e90ff',
+            'text_content': '',
+            'user': 'alice',
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare per-recipient and encode-once broadcast serialization as room size grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1,10,50,100,500',
+            help='Comma separated room sizes to measure'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Broadcasts per measurement'
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+        # Alternate codecs across recipients, as in a room of mixed clients
+        codecs = list(CODECS)
+
+        self.stdout.write(
+            f'{"event":<18}{"room size":>10}{"per-recipient":>16}{"encode once":>14}{"speedup":>10}'
+        )
+        for name, event in sample_events().items():
+            for size in sizes:
+                recipients = [codecs[i % len(codecs)] for i in range(size)]
+
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    for codec in recipients:
+                        codec.encode(event)
+                per_recipient = (time.perf_counter() - started) / repeat
+
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    payload = encode_once(event)
+                    for codec in recipients:
+                        payload[codec.subprotocol]
+                once = (time.perf_counter() - started) / repeat
+
+                self.stdout.write(
+                    f'{name:<18}{size:>10}{per_recipient * 1e6:>13.1f} us'
+                    f'{once * 1e6:>11.1f} us{per_recipient / once:>9.1f}x'
+                )
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from realtime.broker import Broker
+from realtime.layers import BrokerChannelLayer
+from whiteboard.codecs import encode_once
+
+
+def sample_broadcast():
+    """A stroke delta as the consumer broadcasts it"""
+    message = {
+        'type': 'stroke_extended',
+        'stroke_id': '1b4e28ba-2fa1-11d2-883f-0016d3cca427',
+        'points': [float(i) + 0.25 for i in range(64)],
+        'user': 'alice',
+    }
+    return {
+        'type': 'stroke_extended',
+        'payload': encode_once(message),
+        'sender': 'specific.bench!sender',
+        'stroke_id': message['stroke_id'],
+        'bbox': [0.25, 1.25, 62.25, 63.25],
+    }
+
+
+async def measure(layers, size, repeat):
+    """Per-broadcast latency until every member of a group has received it"""
+    group = 'bench'
+    members = []
+    for i in range(size):
+        layer = layers[i % len(layers)]
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        members.append((layer, channel))
+
+    message = sample_broadcast()
+    sender = layers[0]
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        sent = time.perf_counter()
+        await sender.group_send(group, message)
+        await asyncio.gather(*(layer.receive(channel) for layer, channel in members))
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+
+    for layer, channel in members:
+        await layer.group_discard(group, channel)
+    return latencies, elapsed
+
+
+class Command(BaseCommand):
+    help = 'Compare group_send fan-out of the broker and in-memory channel layers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1,10,50,100,500',
+            help='Comma separated group sizes to measure'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Broadcasts per measurement'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Broker layer instances the group members are spread over'
+        )
+        parser.add_argument(
+            '--path', default=None,
+            help='Use a running broker instead of starting one in-process'
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        repeat = options['repeat']
+
+        broker_task = None
+        path = options['path']
+        if path is None:
+            path = os.path.join(tempfile.mkdtemp(), 'broker.sock')
+            broker_task = asyncio.ensure_future(Broker(path).serve())
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+
+        backends = {
+            'in-memory': [InMemoryChannelLayer(capacity=repeat + 1)],
+            'broker': [
+                BrokerChannelLayer(path=path, capacity=repeat + 1)
+                for _ in range(options['workers'])
+            ],
+        }
+
+        self.stdout.write(
+            f'{"layer":<12}{"group size":>11}{"p50":>11}{"p95":>11}{"msgs/s":>12}'
+        )
+        try:
+            for size in sizes:
+                for name, layers in backends.items():
+                    latencies, elapsed = await measure(layers, size, repeat)
+                    latencies.sort()
+                    p50 = statistics.median(latencies)
+                    p95 = latencies[int(len(latencies) * 0.95) - 1]
+                    self.stdout.write(
+                        f'{name:<12}{size:>11}{p50 * 1e6:>8.0f} us{p95 * 1e6:>8.0f} us'
+                        f'{size * repeat / elapsed:>12.0f}'
+                    )
+        finally:
+            for layer in backends['broker']:
+                await layer.close()
+            if broker_task is not None:
+                broker_task.cancel()
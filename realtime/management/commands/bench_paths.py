@@ -0,0 +1,113 @@
+import json
+import math
+import random
+import time
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from whiteboard import paths
+from whiteboard.geometry import path_points
+from whiteboard.models import DrawingElement
+
+
+def sample_strokes(count, seed):
+    """Hand-drawn looking strokes: smooth random walks sampled like pointer events"""
+    rng = random.Random(seed)
+    strokes = []
+    for _ in range(count):
+        length = int(math.exp(rng.uniform(math.log(20), math.log(1500))))
+        x, y = rng.uniform(0, 1920), rng.uniform(0, 1080)
+        heading = rng.uniform(0, 2 * math.pi)
+        points = []
+        for _ in range(length):
+            heading += rng.gauss(0, 0.15)
+            step = rng.uniform(0.5, 6)
+            # Pointer coordinates are fractional once the canvas is scaled
+            x += math.cos(heading) * step * 1.0833333
+            y += math.sin(heading) * step * 1.0833333
+            points.extend((x, y))
+        strokes.append(points)
+    return strokes
+
+
+def legacy_json(points):
+    """Legacy path_data, as the client sends it"""
+    return json.dumps([{'x': points[i], 'y': points[i + 1]} for i in range(0, len(points), 2)])
+
+
+def timed(function, items, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            function(item)
+    return (time.perf_counter() - started) / repeat
+
+
+class Command(BaseCommand):
+    help = 'Compare the size and speed of legacy JSON and compact stroke paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strokes', type=int, default=500, help='Synthetic strokes to generate')
+        parser.add_argument('--repeat', type=int, default=3, help='Passes per timing')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--from-db', type=int, default=0, metavar='N',
+            help='Also include up to N stroke paths stored in the database'
+        )
+
+    def handle(self, *args, **options):
+        strokes = sample_strokes(options['strokes'], options['seed'])
+        if options['from_db']:
+            stored = DrawingElement.objects.filter(element_type='pen').exclude(
+                path_data='', path_blob=None
+            )[:options['from_db']]
+            for element in stored:
+                points = element.points() or path_points(element.path_data)
+                if points:
+                    strokes.append(points)
+
+        legacy = [legacy_json(s) for s in strokes]
+        compact = [paths.encode_path(s) for s in strokes]
+        float32 = [array('f', s).tobytes() for s in strokes]
+        point_count = sum(len(s) for s in strokes) // 2
+
+        self.stdout.write(f'{len(strokes)} strokes, {point_count} points')
+        self.stdout.write(f'{"format":<16}{"bytes":>12}{"bytes/point":>13}{"ratio":>8}')
+        legacy_size = sum(len(p.encode()) for p in legacy)
+        for name, size in (
+            ('legacy json', legacy_size),
+            ('float32', sum(len(p) for p in float32)),
+            ('compact', sum(len(p) for p in compact)),
+        ):
+            self.stdout.write(
+                f'{name:<16}{size:>12}{size / point_count:>13.2f}{legacy_size / size:>7.1f}x'
+            )
+
+        repeat = options['repeat']
+        rows = [
+            ('legacy json', timed(legacy_json, strokes, repeat), timed(path_points, legacy, repeat)),
+        ]
+        numpy = paths.np
+        if numpy is not None:
+            rows.append((
+                'compact numpy',
+                timed(paths.encode_path, strokes, repeat),
+                timed(paths.decode_path, compact, repeat),
+            ))
+            rows.append(('compact ndarray', None, timed(paths.decode_path_array, compact, repeat)))
+        # Same functions with the pure Python fallback
+        paths.np = None
+        try:
+            rows.append((
+                'compact python',
+                timed(paths.encode_path, strokes, repeat),
+                timed(paths.decode_path, compact, repeat),
+            ))
+        finally:
+            paths.np = numpy
+
+        self.stdout.write(f'\n{"codec":<16}{"encode ms":>12}{"decode ms":>12}')
+        for name, encode, decode in rows:
+            encode = f'{encode * 1000:.1f}' if encode is not None else '-'
+            self.stdout.write(f'{name:<16}{encode:>12}{decode * 1000:>12.1f}')
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from realtime import consumers
+from realtime.routing import websocket_urlpatterns
+from whiteboard import permissions
+from whiteboard.models import Permission, Room
+
+REPLY_TIMEOUT = 10
+
+
+def per_call(func, repeat):
+    """Mean seconds per call of func"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+async def send_elements(application, room, user, count):
+    """Seconds until a client got its own broadcasts back for count add_element messages"""
+    communicator = WebsocketCommunicator(application, f'/ws/whiteboard/{room.id}/')
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect(timeout=REPLY_TIMEOUT)
+    if not connected:
+        raise RuntimeError('WebSocket connection was rejected')
+    while (await communicator.receive_json_from(REPLY_TIMEOUT))['type'] != 'initial_state_end':
+        pass
+
+    started = time.perf_counter()
+    for i in range(count):
+        await communicator.send_json_to({
+            'type': 'add_element', 'element_type': 'rectangle',
+            'x': i, 'y': i, 'width': 10, 'height': 10,
+        })
+    received = 0
+    while received < count:
+        message = await communicator.receive_json_from(REPLY_TIMEOUT)
+        received += message['type'] == 'element_added'
+    elapsed = time.perf_counter() - started
+    await communicator.disconnect()
+    return elapsed
+
+
+class Command(BaseCommand):
+    help = 'Measure the cost of permission checks on realtime messages and REST requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages', type=int, default=2000,
+            help='add_element messages sent per end-to-end run'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=100000,
+            help='Calls per micro-benchmark'
+        )
+
+    def handle(self, *args, **options):
+        # Never touch the configured database: run against a throwaway one
+        workdir = None
+        if connection.vendor == 'sqlite':
+            workdir = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if workdir is not None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def run(self, options):
+        owner = User.objects.create_user('bench_owner')
+        user = User.objects.create_user('bench_user')
+        room = Room.objects.create(name='bench', created_by=owner, is_public=False)
+        Permission.objects.create(room=room, user=user, granted_by=owner, permission_type='draw')
+        repeat = options['repeat']
+
+        def uncached():
+            permissions.forget(room.id)
+            permissions.room_permission(room, user)
+
+        permissions.room_permission(room, user)
+        self.stdout.write(f'{"check":<34}{"per call":>12}')
+        for name, func in (
+            ('message check (context)', lambda: permissions.allows('draw', 'edit')),
+            ('room_permission, cached', lambda: permissions.room_permission(room, user)),
+            ('room_permission, uncached', uncached),
+        ):
+            calls = repeat if name != 'room_permission, uncached' else max(1, repeat // 100)
+            self.stdout.write(f'{name:<34}{per_call(func, calls) * 1e6:>9.2f} us')
+
+        # End to end, with the checks and with MESSAGE_PERMISSIONS emptied
+        application = URLRouter(websocket_urlpatterns)
+        count = options['messages']
+        resolved = []
+        resolve = permissions.resolve
+
+        def counting_resolve(*args):
+            resolved.append(args)
+            return resolve(*args)
+
+        self.stdout.write(f'\n{"add_element messages":<34}{"msgs/s":>12}{"resolves":>10}')
+        for name, table in (('with checks', consumers.MESSAGE_PERMISSIONS), ('without checks', {})):
+            with mock.patch.object(consumers, 'MESSAGE_PERMISSIONS', table), \
+                    mock.patch.object(permissions, 'resolve', counting_resolve):
+                resolved.clear()
+                elapsed = asyncio.run(send_elements(application, room, user, count))
+            self.stdout.write(f'{name:<34}{count / elapsed:>12.0f}{len(resolved):>10}')
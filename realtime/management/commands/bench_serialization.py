@@ -0,0 +1,143 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+
+from realtime.state import element_chunks
+from whiteboard import codecs
+from whiteboard.models import DrawingElement, Room
+from whiteboard.renderers import ElementJSONRenderer
+from whiteboard.serializers import DrawingElementSerializer, serialize_elements
+
+
+def sample_elements(room, users, count, seed):
+    """Pen strokes, shapes and text, like a busy board"""
+    rng = random.Random(seed)
+    elements = []
+    for i in range(count):
+        kind = rng.choice(('pen', 'pen', 'pen', 'rectangle', 'circle', 'text'))
+        element = DrawingElement(
+            room=room, created_by=rng.choice(users), element_type=kind,
+            x=rng.uniform(0, 4000), y=rng.uniform(0, 3000),
+            width=rng.uniform(-200, 200), height=rng.uniform(-200, 200),
+            color=f'#{rng.randrange(1 << 24):06x}', z_index=i % 10,
+        )
+        if kind == 'pen':
+            x, y = element.x, element.y
+            element.path_data = json.dumps([
+                {'x': x + step * 2.5, 'y': y + rng.uniform(-3, 3)} for step in range(rng.randint(10, 60))
+            ])
+        elif kind == 'text':
+            element.text_content = 'note %d' % i
+        element.pack_path()
+        element.update_bounds()
+        elements.append(element)
+    DrawingElement.objects.bulk_create(elements, batch_size=500)
+
+
+class QueryCounter:
+    """connection.execute_wrapper counting queries, without keeping them"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def timed(function):
+    """Seconds one call takes, and what it returned"""
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF and values() based element serialization at several board sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000',
+            help='Comma separated element counts'
+        )
+        parser.add_argument(
+            '--per-row-limit', type=int, default=10000,
+            help='Largest size to time the serializer without select_related at (one query per element)'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        # Never touch the configured database: run against a throwaway one
+        workdir = None
+        if connection.vendor == 'sqlite':
+            workdir = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.run(sizes, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if workdir is not None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    def run(self, sizes, options):
+        users = [User.objects.create_user(f'bench_{i}', f'bench_{i}@example.com') for i in range(20)]
+        room = Room.objects.create(name='bench', created_by=users[0])
+        self.stdout.write(
+            f'{"elements":>9}  {"path":<36}{"ms":>10}{"queries":>9}{"MB JSON":>9}'
+        )
+        for size in sizes:
+            sample_elements(room, users, size - room.elements.count(), options['seed'] + size)
+            elements = DrawingElement.objects.filter(room=room, is_deleted=False).order_by('z_index', 'created_at')
+
+            results = {}
+            cases = [
+                ('serializer (per-row created_by)', lambda: DrawingElementSerializer(elements, many=True).data),
+                ('serializer + select_related', lambda: DrawingElementSerializer(
+                    elements.select_related('created_by'), many=True
+                ).data),
+                ('serialize_elements', lambda: serialize_elements(elements)),
+            ]
+            for name, function in cases:
+                if name.startswith('serializer (per-row') and size > options['per_row_limit']:
+                    continue
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries):
+                    seconds, data = timed(function)
+                results[name] = data
+                self.stdout.write(f'{size:>9}  {name:<36}{seconds * 1000:>10.1f}{queries.count:>9}')
+
+            # The fast path is only a fast path if nothing else changed
+            if [dict(element) for element in results['serializer + select_related']] != results['serialize_elements']:
+                raise CommandError('serialize_elements() output differs from DrawingElementSerializer')
+
+            data = results['serialize_elements']
+            for name, renderer in (('JSONRenderer', JSONRenderer()), ('ElementJSONRenderer', ElementJSONRenderer())):
+                seconds, body = timed(lambda: renderer.render(data))
+                self.stdout.write(f'{size:>9}  {"render, " + name:<36}{seconds * 1000:>10.1f}{"":>9}{len(body) / 1e6:>9.1f}')
+
+            # Initial state: every chunk read and encoded as a JSON frame
+            orjson = codecs.orjson
+            for name, encoder in (('json', None), ('orjson', orjson)):
+                if name == 'orjson' and orjson is None:
+                    continue
+                codecs.orjson = encoder
+                try:
+                    codec = codecs.JSONCodec()
+                    seconds, frames = timed(lambda: [
+                        codec.encode({'type': 'initial_state_chunk', 'elements': chunk})['text_data']
+                        for chunk in element_chunks(room.id)
+                    ])
+                finally:
+                    codecs.orjson = orjson
+                size_mb = sum(len(frame) for frame in frames) / 1e6
+                self.stdout.write(f'{size:>9}  {"initial state, " + name:<36}{seconds * 1000:>10.1f}{"":>9}{size_mb:>9.1f}')
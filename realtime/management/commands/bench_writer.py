@@ -0,0 +1,165 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+MODES = ('direct', 'writer')
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def add_element(room_id, user_id, x):
+    """One buffered create, written like ElementWriteBuffer.flush writes it"""
+    from whiteboard.models import DrawingElement
+    from realtime.buffers import ElementWriteBuffer
+
+    element = DrawingElement(
+        room_id=room_id, created_by_id=user_id, element_type='rectangle',
+        x=x, y=x, width=40, height=30,
+    )
+    ElementWriteBuffer(room_id).write([element], {})
+
+
+def recent_elements(room_id):
+    from whiteboard.models import DrawingElement
+
+    return list(
+        DrawingElement.objects.filter(room_id=room_id, is_deleted=False)
+        .order_by('-created_at').values_list('id', flat=True)[:100]
+    )
+
+
+async def run_client(write, read, room_id, user_id, deadline, read_ratio, stats):
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        is_read = rng.random() < read_ratio
+        started = time.perf_counter()
+        try:
+            if is_read:
+                await read(room_id)
+            else:
+                await write(room_id, user_id, rng.uniform(0, 1000))
+        except Exception as exc:
+            kind = 'locked' if 'locked' in str(exc) else 'failed'
+            stats[kind] += 1
+            continue
+        stats['reads' if is_read else 'writes'].append(time.perf_counter() - started)
+
+
+async def drive(mode, room_id, user_id, clients, duration, read_ratio):
+    from channels.db import database_sync_to_async
+    from realtime.writer import database_read, database_write
+
+    if mode == 'writer':
+        write, read = database_write(add_element), database_read(recent_elements)
+    else:
+        write, read = database_sync_to_async(add_element), database_sync_to_async(recent_elements)
+    stats = {'writes': [], 'reads': [], 'locked': 0, 'failed': 0}
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(
+        run_client(write, read, room_id, user_id, deadline, read_ratio, stats)
+        for _ in range(clients)
+    ))
+    return stats
+
+
+def run_process(path, mode, room_id, user_id, clients, duration, read_ratio):
+    """Entry point of a benchmark process: one server worker's consumers"""
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = path
+    settings.WHITEBOARD_DB_WRITER = {
+        **getattr(settings, 'WHITEBOARD_DB_WRITER', {}), 'ENABLED': mode == 'writer'
+    }
+    django.setup()
+    return asyncio.run(drive(mode, room_id, user_id, clients, duration, read_ratio))
+
+
+class Command(BaseCommand):
+    help = 'Compare consumer database writes with and without the single-writer pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=4,
+            help='Server processes writing to the database at once'
+        )
+        parser.add_argument(
+            '--clients', type=int, default=50,
+            help='Concurrent clients per process'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=10.0,
+            help='Seconds each mode runs for'
+        )
+        parser.add_argument(
+            '--read-ratio', type=float, default=0.5,
+            help='Fraction of operations that are reads'
+        )
+        parser.add_argument(
+            '--modes', default=','.join(MODES),
+            help=f'Comma separated modes to compare, from: {", ".join(MODES)}'
+        )
+
+    def handle(self, *args, **options):
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from whiteboard.models import Room
+
+        # Never touch the configured database. Every mode starts from a copy
+        # of the same file, since WAL mode sticks to a database once set.
+        workdir = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'template.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            user = User.objects.create_user('bench_writer')
+            room = Room.objects.create(name='bench_writer', created_by=user, is_public=True)
+            template = connection.settings_dict['NAME']
+            connection.close()
+
+            self.stdout.write(
+                f'{"mode":<8}{"writes/s":>10}{"reads/s":>10}{"write p50":>11}{"write p99":>11}'
+                f'{"read p50":>10}{"read p99":>10}{"locked":>8}{"failed":>8}'
+            )
+            for mode in options['modes'].split(','):
+                path = os.path.join(workdir, f'{mode}.sqlite3')
+                shutil.copyfile(template, path)
+                self.run_mode(mode, path, room.id, user.id, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def run_mode(self, mode, path, room_id, user_id, options):
+        processes = options['processes']
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(
+                    run_process, path, mode, str(room_id), user_id,
+                    options['clients'], options['duration'], options['read_ratio']
+                )
+                for _ in range(processes)
+            ]
+            results = [future.result() for future in futures]
+
+        writes = sorted(latency for stats in results for latency in stats['writes'])
+        reads = sorted(latency for stats in results for latency in stats['reads'])
+        locked = sum(stats['locked'] for stats in results)
+        failed = sum(stats['failed'] for stats in results)
+        duration = options['duration']
+
+        def timing(values, q):
+            return f'{percentile(values, q) * 1e3:.1f} ms' if values else '-'
+
+        self.stdout.write(
+            f'{mode:<8}{len(writes) / duration:>10.0f}{len(reads) / duration:>10.0f}'
+            f'{timing(writes, 0.5):>11}{timing(writes, 0.99):>11}'
+            f'{timing(reads, 0.5):>10}{timing(reads, 0.99):>10}{locked:>8}{failed:>8}'
+        )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from whiteboard.models import DrawingElement, Room
+from whiteboard.oplog import OP_FIELDS, checkpoint, op_data, rebuild
+
+
+def live_scene(room_id):
+    rows = DrawingElement.objects.filter(room_id=room_id, is_deleted=False).values('id', *OP_FIELDS)
+    return {str(row.pop('id')): op_data(row) for row in rows.iterator(chunk_size=2000)}
+
+
+class Command(BaseCommand):
+    help = "Checkpoint rooms' operation logs and optionally verify them against the elements"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', action='append', default=[], help='Room id (repeatable; default all)')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Check that replaying the log reproduces the current elements'
+        )
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by('created_at')
+        if options['room']:
+            rooms = rooms.filter(id__in=options['room'])
+
+        mismatched = 0
+        for room in rooms.only('id', 'name', 'revision'):
+            created = checkpoint(room.id)
+            status = f'checkpoint at {created.seq}' if created else 'already checkpointed'
+            self.stdout.write(f'{room.name}: revision {room.revision}, {status}')
+
+            if options['verify']:
+                scene, _ = rebuild(room.id)
+                live = live_scene(room.id)
+                if scene != live:
+                    mismatched += 1
+                    differing = set(scene) ^ set(live) | {
+                        element_id for element_id in set(scene) & set(live)
+                        if scene[element_id] != live[element_id]
+                    }
+                    self.stdout.write(self.style.ERROR(
+                        f'  log differs from elements for {len(differing)} element(s)'
+                    ))
+
+        if mismatched:
+            self.stdout.write(self.style.ERROR(f'{mismatched} room(s) failed verification'))
+        elif options['verify']:
+            self.stdout.write(self.style.SUCCESS('All rooms verified'))
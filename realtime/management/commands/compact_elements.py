@@ -0,0 +1,153 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+
+from realtime.state import element_chunks
+from whiteboard.compaction import compact, compaction_setting, run_forever, tombstones
+from whiteboard.models import DrawingElement, Room
+from whiteboard.snapshots import collect_blobs
+
+# Area timed for viewport queries
+VIEWPORT = (0, 0, 1920, 1080)
+
+
+def hot_queries(room_ids):
+    """The element queries the consumer and the viewsets run, by name"""
+    def initial_state():
+        for room_id in room_ids:
+            for _ in element_chunks(room_id):
+                pass
+
+    def viewport():
+        for room_id in room_ids:
+            for _ in element_chunks(room_id, VIEWPORT):
+                pass
+
+    def element_list():
+        for room_id in room_ids:
+            list(DrawingElement.objects.filter(room_id=room_id, is_deleted=False).order_by('z_index', 'created_at'))
+
+    return {'initial state': initial_state, 'viewport': viewport, 'element list': element_list}
+
+
+def time_queries(room_ids, repeat):
+    timings = {}
+    for name, query in hot_queries(room_ids).items():
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - started)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def element_counts(room_ids):
+    counts = DrawingElement.objects.filter(room_id__in=room_ids).aggregate(
+        live=Count('id', filter=Q(is_deleted=False)),
+        deleted=Count('id', filter=Q(is_deleted=True)),
+    )
+    return counts['live'], counts['deleted']
+
+
+def vacuum():
+    """Give the space of removed rows back to the database file"""
+    table = DrawingElement._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'VACUUM ANALYZE {connection.ops.quote_name(table)}')
+        else:
+            return False
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Remove deleted drawing elements and report how element queries change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', action='append', default=[], help='Room id (repeatable; default all)')
+        parser.add_argument(
+            '--min-age', type=float, default=None,
+            help='Only remove elements deleted at least this many seconds ago'
+        )
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows removed per transaction')
+        parser.add_argument('--archive', action='store_true', help='Keep removed rows in ElementArchive')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be removed')
+        parser.add_argument(
+            '--benchmark', type=int, default=0, metavar='REPEAT',
+            help='Time the hot element queries REPEAT times before and after'
+        )
+        parser.add_argument('--vacuum', action='store_true', help='Reclaim disk space afterwards')
+        parser.add_argument(
+            '--forever', action='store_true',
+            help='Keep compacting all rooms every WHITEBOARD_COMPACTION INTERVAL seconds'
+        )
+
+    def handle(self, *args, **options):
+        if options['forever']:
+            interval = compaction_setting('INTERVAL', 3600) or 3600
+            self.stdout.write(f'Compacting deleted elements every {interval} s')
+            run_forever(interval)
+            return
+
+        if options['room']:
+            room_ids = options['room']
+        else:
+            room_ids = list(Room.objects.values_list('id', flat=True))
+
+        live, deleted = element_counts(room_ids)
+        self.stdout.write(f'{len(room_ids)} rooms: {live} live and {deleted} deleted elements')
+        if options['verbosity'] > 1 and room_ids:
+            queryset = DrawingElement.objects.filter(room_id=room_ids[0], is_deleted=False)
+            self.stdout.write(queryset.order_by('z_index', 'created_at').explain())
+
+        due = sum(tombstones(room_id, options['min_age']).count() for room_id in room_ids)
+        if options['dry_run']:
+            self.stdout.write(f'{due} deleted elements are due for removal')
+            return
+
+        before = time_queries(room_ids, options['benchmark']) if options['benchmark'] else None
+
+        purged = archived = batches = 0
+        seconds = 0.0
+        for room_id in room_ids:
+            result = compact(
+                room_id,
+                min_age=options['min_age'],
+                batch_size=options['batch_size'],
+                archive_rows=options['archive'] or None,
+            )
+            purged += result['purged']
+            archived += result['archived']
+            batches += result['batches']
+            seconds += result['seconds']
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {purged} deleted elements ({archived} archived) '
+            f'in {batches} batches, {seconds:.2f} s'
+        ))
+
+        min_age = options['min_age']
+        unused = collect_blobs(compaction_setting('MIN_AGE', 3600) if min_age is None else min_age)
+        self.stdout.write(f'Deleted {unused} unused snapshot element blobs')
+
+        if options['vacuum']:
+            started = time.perf_counter()
+            if vacuum():
+                self.stdout.write(f'Vacuumed in {time.perf_counter() - started:.2f} s')
+            else:
+                self.stdout.write(f'Vacuum is not supported on {connection.vendor}')
+
+        if before is not None:
+            after = time_queries(room_ids, options['benchmark'])
+            self.stdout.write(f'\n{"query":<16}{"before ms":>12}{"after ms":>12}{"change":>10}')
+            for name, seconds_before in before.items():
+                seconds_after = after[name]
+                change = (seconds_after / seconds_before - 1) * 100 if seconds_before else 0
+                self.stdout.write(
+                    f'{name:<16}{seconds_before * 1000:>12.2f}{seconds_after * 1000:>12.2f}{change:>9.0f}%'
+                )
@@ -0,0 +1,73 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from whiteboard.imports import detect_format, run_job
+from whiteboard.models import ImportJob, Room
+
+
+class Command(BaseCommand):
+    help = 'Import elements into a room from an NDJSON or snapshot file, resumably'
+
+    def add_arguments(self, parser):
+        parser.add_argument('room', nargs='?', help='Room id')
+        parser.add_argument('path', nargs='?', help='NDJSON or snapshot (JSON array) file')
+        parser.add_argument('--user', help='Username the elements are created by (default: room creator)')
+        parser.add_argument('--format', choices=[name for name, _ in ImportJob.FORMATS], help='Default: detected')
+        parser.add_argument('--batch-size', type=int, default=None, help='Elements per transaction')
+        parser.add_argument('--resume', metavar='JOB', help='Continue an unfinished import job')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                job = ImportJob.objects.get(id=options['resume'])
+            except (ImportJob.DoesNotExist, ValueError):
+                raise CommandError(f'No import job {options["resume"]}')
+            if job.status == 'done':
+                raise CommandError(f'Import job {job.id} is already done')
+        else:
+            if not options['room'] or not options['path']:
+                raise CommandError('Give a room and a file, or --resume JOB')
+            try:
+                room = Room.objects.get(id=options['room'])
+            except (Room.DoesNotExist, ValueError):
+                raise CommandError(f'No room {options["room"]}')
+            user = room.created_by
+            if options['user']:
+                try:
+                    user = User.objects.get(username=options['user'])
+                except User.DoesNotExist:
+                    raise CommandError(f'No user {options["user"]}')
+            try:
+                with open(options['path'], 'rb') as file:
+                    file_format = options['format'] or detect_format(file)
+            except OSError as exc:
+                raise CommandError(str(exc))
+            job = ImportJob.objects.create(
+                room=room, created_by=user, path=options['path'], file_format=file_format
+            )
+            self.stdout.write(f'Import job {job.id} ({file_format})')
+
+        started = time.perf_counter()
+        first = job.imported
+
+        def report(job):
+            elapsed = time.perf_counter() - started
+            rate = (job.imported - first) / elapsed if elapsed else 0
+            self.stdout.write(
+                f'{job.progress:>6.1%}  {job.rows_read} rows, {job.imported} imported, '
+                f'{job.skipped} skipped, {rate:.0f} elements/s'
+            )
+
+        job = run_job(job.id, batch_size=options['batch_size'], report=report)
+        for error in job.errors[:10]:
+            self.stdout.write(f'Row {error["row"]}: {error["errors"]}')
+        if job.status == 'failed':
+            raise CommandError(f'{job.error}\nResume with --resume {job.id}')
+        if job.status != 'done':
+            raise CommandError(f'Import job {job.id} is {job.status} elsewhere')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {job.imported} elements ({job.skipped} rows skipped) '
+            f'in {time.perf_counter() - started:.1f} s'
+        ))
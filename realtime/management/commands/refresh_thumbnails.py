@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from whiteboard.thumbnails import ThumbnailRefresher, thumbnail_setting
+
+
+class Command(BaseCommand):
+    help = 'Keep re-rendering room thumbnails that are out of date'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delay', type=float, default=None,
+            help='Seconds a room must be unchanged before it is rendered (default WHITEBOARD_THUMBNAILS DELAY)'
+        )
+        parser.add_argument('--once', action='store_true', help='Render the rooms due now and exit')
+
+    def handle(self, *args, **options):
+        refresher = ThumbnailRefresher(options['delay'])
+        if options['once']:
+            rooms = refresher.due_rooms()
+            refresher.render_rooms(rooms)
+            self.stdout.write(f'Rendered thumbnails of {len(rooms)} rooms')
+            return
+        self.stdout.write(
+            f'Refreshing room thumbnails {refresher.delay} s after the last change, '
+            f'{thumbnail_setting("POOL_SIZE", 2)} at a time'
+        )
+        refresher.run_forever()
@@ -0,0 +1,30 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from realtime.broker import Broker
+
+
+def configured_path():
+    """Socket path of the default layer when it is a BrokerChannelLayer"""
+    layer = getattr(settings, 'CHANNEL_LAYERS', {}).get('default', {})
+    return layer.get('CONFIG', {}).get('path', '/tmp/whiteboard-broker.sock')
+
+
+class Command(BaseCommand):
+    help = 'Run the broker that connects BrokerChannelLayer workers on this host'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=None,
+            help='Unix socket to listen on (defaults to the channel layer config)'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or configured_path()
+        self.stdout.write(f'Channel layer broker listening on {path}')
+        try:
+            asyncio.run(Broker(path).serve())
+        except KeyboardInterrupt:
+            pass
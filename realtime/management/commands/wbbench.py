@@ -0,0 +1,389 @@
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from whiteboard.codecs import CODECS, JSONCodec
+from whiteboard.models import DrawingElement, Room
+
+DEFAULT_MIX = 'draw=40,cursor_move=40,add_element=12,elements=4,save_snapshot=1,rejoin=3'
+
+# Simulated clients all look at the same screen-sized area
+VIEWPORT = (0, 0, 1920, 1080)
+
+# Upper bound on waiting for one reply before it counts as an error
+REPLY_TIMEOUT = 10
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in Simulation.OPERATIONS:
+            raise CommandError(f'Unknown operation {name!r} in --mix')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class SimulatedClient:
+    """One browser: a WebSocket connection plus a session for REST calls"""
+
+    def __init__(self, simulation, user, cookie, room_id):
+        self.simulation = simulation
+        self.user = user
+        self.cookie = cookie
+        self.room_id = room_id
+        self.communicator = None
+        self.reader = None
+        self.waiting = None
+        self.cursor_seq = 0
+
+    async def connect(self):
+        simulation = self.simulation
+        viewport = ','.join(str(v) for v in VIEWPORT)
+        self.communicator = WebsocketCommunicator(
+            simulation.application,
+            f'/ws/whiteboard/{self.room_id}/?viewport={viewport}',
+            headers=simulation.headers(self.cookie),
+            subprotocols=[simulation.codec.subprotocol],
+        )
+        connected, _ = await self.communicator.connect(timeout=REPLY_TIMEOUT)
+        if not connected:
+            raise ConnectionError('WebSocket connection was rejected')
+        self.reader = asyncio.ensure_future(self.read())
+        await self.expect('initial_state_end')
+
+    async def disconnect(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect(timeout=REPLY_TIMEOUT)
+
+    async def read(self):
+        codec = self.simulation.codec
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output['type'] != 'websocket.send':
+                return
+            message = codec.decode(output.get('text'), output.get('bytes'))
+            self.simulation.observe(self, message)
+            if self.waiting is not None:
+                message_type, future = self.waiting
+                if message['type'] == message_type and not future.done() and (
+                        message.get('user') in (None, self.user.username)):
+                    future.set_result(message)
+
+    async def expect(self, message_type):
+        """Wait for the next message of a type sent by or to this client"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiting = (message_type, future)
+        try:
+            return await asyncio.wait_for(future, REPLY_TIMEOUT)
+        finally:
+            self.waiting = None
+
+    async def send(self, message):
+        await self.communicator.send_input({'type': 'websocket.receive', **self.frame(message)})
+
+    def frame(self, message):
+        # Communicator input uses the ASGI keys, not the consumer's send() ones
+        encoded = self.simulation.codec.encode(message)
+        if 'bytes_data' in encoded:
+            return {'bytes': encoded['bytes_data']}
+        return {'text': encoded['text_data']}
+
+    async def request(self, method, path, body=None):
+        headers = self.simulation.headers(self.cookie)
+        if body is not None:
+            headers += [
+                (b'content-type', b'application/json'),
+                (b'x-csrftoken', self.simulation.csrf_token.encode()),
+            ]
+        communicator = HttpCommunicator(
+            self.simulation.application, method, path,
+            body=json.dumps(body).encode() if body is not None else b'',
+            headers=headers,
+        )
+        response = await communicator.get_response(timeout=REPLY_TIMEOUT)
+        # Let the handler finish instead of leaving its tasks pending
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(timeout=REPLY_TIMEOUT)
+        if response['status'] >= 400:
+            raise RuntimeError(f'{method} {path} returned {response["status"]}')
+        return response
+
+
+class Simulation:
+    """Drives the ASGI application with simulated clients and records latencies.
+
+    Every client runs a closed loop: pick an operation from the mix, perform
+    it, wait for the result, then pause for the think time. WebSocket
+    operations are timed until the client receives its own broadcast back;
+    cursor moves are timed at every other client that sees them.
+    """
+
+    OPERATIONS = ('draw', 'cursor_move', 'add_element', 'elements', 'save_snapshot', 'rejoin')
+
+    def __init__(self, application, codec, mix, think_time):
+        self.application = application
+        self.codec = codec
+        self.mix = mix
+        self.think_time = think_time
+        self.csrf_token = get_random_string(CSRF_SECRET_LENGTH, CSRF_ALLOWED_CHARS)
+        # message type -> list of latencies in seconds
+        self.latencies = {}
+        self.sent = {}
+        self.errors = {}
+        # (username, cursor x) -> time the cursor_move was sent
+        self.cursor_sent = {}
+
+    def headers(self, cookie):
+        return [
+            (b'host', b'localhost'),
+            (b'origin', b'http://localhost'),
+            (b'cookie', f'sessionid={cookie}; csrftoken={self.csrf_token}'.encode()),
+        ]
+
+    def record(self, name, started):
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    def observe(self, client, message):
+        if message['type'] != 'cursors':
+            return
+        now = time.perf_counter()
+        for cursor in message['cursors']:
+            if cursor['user'] == client.user.username:
+                continue
+            sent = self.cursor_sent.get((cursor['user'], cursor['x']))
+            if sent is not None:
+                self.latencies.setdefault('cursor_move', []).append(now - sent)
+
+    async def run_client(self, client, deadline):
+        operations = list(self.mix)
+        weights = list(self.mix.values())
+        rng = random.Random(client.user.username)
+        while time.perf_counter() < deadline:
+            name = rng.choices(operations, weights)[0]
+            self.sent[name] = self.sent.get(name, 0) + 1
+            try:
+                await getattr(self, f'op_{name}')(client, rng)
+            except Exception:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            if self.think_time:
+                await asyncio.sleep(rng.expovariate(1 / self.think_time))
+
+    async def op_draw(self, client, rng):
+        x, y = rng.uniform(0, VIEWPORT[2]), rng.uniform(0, VIEWPORT[3])
+        path = [{'x': x + i * 2, 'y': y + rng.uniform(-2, 2)} for i in range(32)]
+        started = time.perf_counter()
+        await client.send({
+            'type': 'draw',
+            'path_data': json.dumps(path),
+            'color': '#000000',
+            'stroke_width': 2,
+        })
+        await client.expect('draw_update')
+        self.record('draw', started)
+
+    async def op_cursor_move(self, client, rng):
+        # x is unique per user so receivers can match what they see
+        client.cursor_seq += 1
+        self.cursor_sent[(client.user.username, client.cursor_seq)] = time.perf_counter()
+        await client.send({'type': 'cursor_move', 'x': client.cursor_seq, 'y': rng.randint(0, 1080)})
+
+    async def op_add_element(self, client, rng):
+        started = time.perf_counter()
+        await client.send({
+            'type': 'add_element',
+            'element_type': rng.choice(['rectangle', 'circle', 'line']),
+            'x': rng.uniform(0, VIEWPORT[2]),
+            'y': rng.uniform(0, VIEWPORT[3]),
+            'width': rng.uniform(10, 200),
+            'height': rng.uniform(10, 200),
+            'color': '#1e90ff',
+        })
+        await client.expect('element_added')
+        self.record('add_element', started)
+
+    async def op_elements(self, client, rng):
+        started = time.perf_counter()
+        await client.request('GET', f'/api/rooms/{client.room_id}/elements/')
+        self.record('elements', started)
+
+    async def op_save_snapshot(self, client, rng):
+        started = time.perf_counter()
+        await client.request('POST', f'/api/rooms/{client.room_id}/save_snapshot/', {'name': 'wbbench'})
+        self.record('save_snapshot', started)
+
+    async def op_rejoin(self, client, rng):
+        started = time.perf_counter()
+        await client.disconnect()
+        self.record('leave', started)
+        started = time.perf_counter()
+        await client.connect()
+        self.record('join', started)
+
+    async def run(self, sessions, duration):
+        clients = [SimulatedClient(self, *session) for session in sessions]
+        for client in clients:
+            started = time.perf_counter()
+            await client.connect()
+            self.record('join', started)
+
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(self.run_client(client, deadline) for client in clients))
+        elapsed = time.perf_counter() - started
+
+        for client in clients:
+            await client.disconnect()
+        return elapsed
+
+    def report(self, elapsed):
+        results = {}
+        for name in sorted(set(self.sent) | set(self.latencies)):
+            values = sorted(self.latencies.get(name, []))
+            results[name] = {
+                'sent': self.sent.get(name, 0),
+                'samples': len(values),
+                'errors': self.errors.get(name, 0),
+                'throughput': self.sent.get(name, len(values)) / elapsed,
+            }
+            if values:
+                results[name].update({
+                    'p50_ms': percentile(values, 0.50) * 1000,
+                    'p95_ms': percentile(values, 0.95) * 1000,
+                    'p99_ms': percentile(values, 0.99) * 1000,
+                    'max_ms': values[-1] * 1000,
+                })
+        return results
+
+
+class Command(BaseCommand):
+    help = 'Load test WebSocket and REST paths in-process with simulated clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20, help='Simulated clients')
+        parser.add_argument('--rooms', type=int, default=2, help='Rooms the clients are spread over')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to run the mix')
+        parser.add_argument(
+            '--think-time', type=float, default=0.05,
+            help='Mean pause between operations of one client in seconds (0 for none)'
+        )
+        parser.add_argument(
+            '--elements', type=int, default=500,
+            help='Elements each room starts with'
+        )
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help=f'Weighted operations, from: {", ".join(Simulation.OPERATIONS)}'
+        )
+        parser.add_argument(
+            '--protocol', choices=[codec.subprotocol for codec in CODECS],
+            default=JSONCodec.subprotocol, help='WebSocket subprotocol the clients use'
+        )
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        codec = next(codec for codec in CODECS if codec.subprotocol == options['protocol'])
+
+        # Never touch the configured database: run against a throwaway one.
+        # SQLite gets a file so that locking behaves as in production
+        # rather than like a shared-cache in-memory database.
+        workdir = None
+        if connection.vendor == 'sqlite':
+            workdir = tempfile.mkdtemp()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'wbbench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            from collaborative_whiteboard.asgi import application
+
+            sessions = self.setup(options)
+            simulation = Simulation(application, codec, mix, options['think_time'])
+            elapsed = asyncio.run(simulation.run(sessions, options['duration']))
+            results = simulation.report(elapsed)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if workdir is not None:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'config': {
+                name: options[name]
+                for name in ('clients', 'rooms', 'duration', 'think_time', 'elements', 'mix', 'protocol')
+            },
+            'elapsed': elapsed,
+            'results': results,
+        }
+        self.write_table(results, elapsed)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def setup(self, options):
+        """Create users, sessions, rooms and their initial elements"""
+        owner = User.objects.create_user('wbbench_owner')
+        rooms = [
+            Room.objects.create(
+                name=f'wbbench {i}', created_by=owner, is_public=True,
+                max_users=options['clients']
+            )
+            for i in range(options['rooms'])
+        ]
+        rng = random.Random(0)
+        for room in rooms:
+            elements = []
+            for _ in range(options['elements']):
+                element = DrawingElement(
+                    id=uuid.uuid4(), room=room, created_by=owner, element_type='rectangle',
+                    x=rng.uniform(-2000, 4000), y=rng.uniform(-2000, 3000),
+                    width=rng.uniform(10, 300), height=rng.uniform(10, 300),
+                )
+                element.update_bounds()
+                elements.append(element)
+            DrawingElement.objects.bulk_create(elements, batch_size=500)
+
+        sessions = []
+        for i in range(options['clients']):
+            user = User.objects.create_user(f'wbbench_{i}')
+            browser = Client()
+            browser.force_login(user)
+            sessions.append((user, browser.cookies['sessionid'].value, rooms[i % len(rooms)].id))
+        return sessions
+
+    def write_table(self, results, elapsed):
+        self.stdout.write(f'Ran for {elapsed:.1f} s')
+        self.stdout.write(
+            f'{"operation":<15}{"sent":>8}{"samples":>9}{"errors":>8}{"ops/s":>9}'
+            f'{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+        )
+        for name, result in results.items():
+            timings = ''.join(
+                f'{result[key]:>9.1f}' if key in result else f'{"-":>9}'
+                for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+            )
+            self.stdout.write(
+                f'{name:<15}{result["sent"]:>8}{result["samples"]:>9}{result["errors"]:>8}'
+                f'{result["throughput"]:>9.1f}{timings}'
+            )
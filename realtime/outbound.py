@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Queued broadcasts that survive a resync; the fresh state covers the rest
+RESYNC_KEEP = {'user_joined', 'user_left', 'cursors'}
+
+
+def outbound_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_OUTBOUND_QUEUE', {}).get(name, default)
+
+
+def merge_cursors(old, new):
+    """Cursor frames only carry users that moved, so keep the union"""
+    positions = {cursor['user']: cursor for cursor in old['cursors']}
+    positions.update((cursor['user'], cursor) for cursor in new['cursors'])
+    return {**new, 'cursors': list(positions.values())}
+
+
+def merge_element_update(old, new):
+    """element_updated carries partial data; later fields win"""
+    return {**new, 'data': {**old.get('data', {}), **new.get('data', {})}}
+
+
+class OutboundQueue:
+    """Bounded send queue of one WebSocket connection.
+
+    Broadcasts are queued here instead of being sent inline, so a client that
+    reads slowly never stalls its consumer and the channel layer does not
+    start dropping messages for it indiscriminately. A queued update that a
+    newer one supersedes (same key) is replaced in place, merged through
+    `merge` when the old one may carry fields the new one lacks. Nothing
+    else is ever dropped: once MAX_SIZE broadcasts are waiting, or the
+    oldest has waited MAX_LAG seconds, `on_lag` is called so the consumer
+    can resync or disconnect the client according to LAG_POLICY.
+    """
+
+    def __init__(self, send, codec, on_lag):
+        self.send = send
+        self.codec = codec
+        self.on_lag = on_lag
+        self.max_size = outbound_setting('MAX_SIZE', 256)
+        self.max_lag = outbound_setting('MAX_LAG', 5.0)
+        self.lag_policy = outbound_setting('LAG_POLICY', 'resync')
+
+        # key -> [event type, send kwargs, queued at, is broadcast]
+        self.entries = OrderedDict()
+        self.broadcasts = 0
+        self.lagging = False
+
+        # Metrics
+        self.merged = 0
+        self.lag_count = 0
+
+        self._ids = itertools.count()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, event_type, frame, key=None, merge=None):
+        """Queue a broadcast frame without waiting"""
+        entry = self.entries.get(key) if key is not None else None
+        if entry is not None:
+            if merge is not None:
+                merged = merge(self.codec.decode(**entry[1]), self.codec.decode(**frame))
+                frame = self.codec.encode(merged)
+            entry[1] = frame
+            self.merged += 1
+            return
+
+        self.entries[key if key is not None else next(self._ids)] = [
+            event_type, frame, time.monotonic(), True
+        ]
+        self.broadcasts += 1
+        self._ready.set()
+        if self.broadcasts > self.max_size or self.delay() > self.max_lag:
+            self._lagging()
+
+    async def put(self, frame):
+        """Queue a direct reply, waiting while the queue is full"""
+        while len(self.entries) >= self.max_size:
+            self._space.clear()
+            await self._space.wait()
+        self.entries[next(self._ids)] = ['direct', frame, time.monotonic(), False]
+        self._ready.set()
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        if entry[3]:
+            self.broadcasts -= 1
+        self._space.set()
+
+    def delay(self):
+        """Seconds the oldest queued frame has been waiting"""
+        for entry in self.entries.values():
+            return time.monotonic() - entry[2]
+        return 0.0
+
+    def reset(self, keep=()):
+        """Drop queued frames except broadcasts of the given types"""
+        for key, entry in list(self.entries.items()):
+            if not (entry[3] and entry[0] in keep):
+                self.discard(key)
+        self._space.set()
+
+    def stats(self):
+        return {
+            'queued': len(self.entries),
+            'delay': self.delay(),
+            'merged': self.merged,
+            'lag_count': self.lag_count,
+        }
+
+    def _lagging(self):
+        if self.lagging:
+            return
+        self.lagging = True
+        self.lag_count += 1
+        logger.info(
+            'Client lagging with %d queued broadcasts (%.1f s behind), applying %s',
+            self.broadcasts, self.delay(), self.lag_policy
+        )
+        # on_lag may queue replies itself, so it cannot run on the writer task
+        asyncio.ensure_future(self.on_lag())
+
+    async def _run(self):
+        while True:
+            if not self.entries:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            key, entry = self.entries.popitem(last=False)
+            if entry[3]:
+                self.broadcasts -= 1
+            self._space.set()
+            try:
+                await self.send(**entry[1])
+            except Exception:
+                logger.debug('Stopped sending to a closed connection', exc_info=True)
+                return
+
+    def close(self):
+        self._task.cancel()
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.utils import timezone
+
+from whiteboard.geometry import bbox_q
+from whiteboard.keyset import iter_rows
+from whiteboard.models import DrawingElement
+from whiteboard.serializers import ELEMENT_VALUES, element_representation
+
+
+def state_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_INITIAL_STATE', {}).get(name, default)
+
+
+def element_state(row, compact_paths=False, tz=None, image_url=None):
+    """Client representation of an element from a values(*ELEMENT_VALUES)
+    row, the same the element API returns.
+
+    With compact_paths, encoded paths are sent under 'path' as their bytes,
+    which binary frames carry as they are and JSON frames as base64.
+    """
+    state = element_representation(row, compact_paths, tz, image_url)
+    if 'path' in state:
+        state['path'] = bytes(row['path_blob'])
+    return state
+
+
+def element_chunks(room_id, viewport=None, chunk_size=None, compact_paths=False):
+    """Yield the live elements of a room in bounded chunks.
+
+    When a viewport is given, only elements whose bounding box intersects
+    it are produced; clients announce a margin around what is on screen.
+    """
+    chunk_size = chunk_size or state_setting('CHUNK_SIZE', 500)
+    elements = DrawingElement.objects.filter(room_id=room_id, is_deleted=False)
+    if viewport is not None:
+        elements = elements.filter(bbox_q(viewport))
+
+    tz = timezone.get_current_timezone()
+    image_url = DrawingElement.image.field.storage.url
+    for rows in iter_rows(elements, chunk_size, ELEMENT_VALUES):
+        yield [element_state(row, compact_paths, tz, image_url) for row in rows]
@@ -0,0 +1,114 @@
+import json
+import uuid
+
+from whiteboard.geometry import points_bounds
+from whiteboard.paths import MAX_COORDINATE, encodable, encode_path
+
+# Upper bounds for in-progress strokes held by one connection
+MAX_OPEN_STROKES = 16
+MAX_STROKE_POINTS = 20000
+
+# Client tools that are stored as pen strokes
+STROKE_ELEMENT_TYPES = {
+    'pen': 'pen',
+    'brush': 'pen',
+    'eraser': 'eraser',
+}
+
+
+def parse_points(points):
+    """Validate a flat [x0, y0, x1, y1, ...] list and return it as floats"""
+    if not isinstance(points, list) or len(points) % 2:
+        raise ValueError('points must be a flat list of x, y pairs')
+    points = [float(value) for value in points]
+    if not encodable(points):
+        raise ValueError(f'points must be finite numbers of at most {MAX_COORDINATE:g} in magnitude')
+    return points
+
+
+def parse_stroke_id(stroke_id):
+    return uuid.UUID(str(stroke_id))
+
+
+class Stroke:
+    """A pen stroke that is still being drawn.
+
+    Points arrive in small deltas and are appended here; the full path is
+    only serialized once, when the stroke is finished.
+    """
+
+    def __init__(self, stroke_id, user, data):
+        self.id = stroke_id
+        self.user = user
+        self.element_type = STROKE_ELEMENT_TYPES.get(data.get('tool'), 'pen')
+        self.color = data.get('color', '#000000')
+        self.stroke_width = data.get('stroke_width', 2)
+        self.opacity = data.get('opacity', 1.0)
+        self.points = []
+        self.bounds = None
+
+    def append(self, points):
+        """Append points and return the ones that were accepted"""
+        remaining = MAX_STROKE_POINTS * 2 - len(self.points)
+        accepted = points[:max(remaining, 0)]
+        self.points.extend(accepted)
+        if accepted:
+            self.extend_bounds(accepted)
+        return accepted
+
+    def extend_bounds(self, points):
+        try:
+            padding = float(self.stroke_width or 0) / 2
+        except (TypeError, ValueError):
+            padding = 0
+        x0, y0, x1, y1 = points_bounds(points, padding)
+        if self.bounds is not None:
+            x0 = min(x0, self.bounds[0])
+            y0 = min(y0, self.bounds[1])
+            x1 = max(x1, self.bounds[2])
+            y1 = max(y1, self.bounds[3])
+        self.bounds = (x0, y0, x1, y1)
+
+    @property
+    def style(self):
+        return {
+            'tool': self.element_type,
+            'color': self.color,
+            'stroke_width': self.stroke_width,
+            'opacity': self.opacity,
+        }
+
+    def path_data(self):
+        """Serialize the stroke in the DrawingElement.path_data format"""
+        return json.dumps([
+            {'x': self.points[i], 'y': self.points[i + 1]}
+            for i in range(0, len(self.points), 2)
+        ])
+
+    def element_message(self, fields):
+        """The finished stroke, given its element_fields(), as an element_added message"""
+        return {
+            'type': 'element_added',
+            'element_id': str(self.id),
+            'element_type': self.element_type,
+            'x': fields['x'],
+            'y': fields['y'],
+            'color': self.color,
+            'stroke_width': self.stroke_width,
+            'opacity': self.opacity,
+            'path_data': self.path_data(),
+            'user': self.user.username,
+        }
+
+    def element_fields(self):
+        return {
+            'id': self.id,
+            'created_by': self.user,
+            'element_type': self.element_type,
+            'x': self.points[0] if self.points else 0,
+            'y': self.points[1] if self.points else 0,
+            'color': self.color,
+            'stroke_width': self.stroke_width,
+            'opacity': self.opacity,
+            'path_blob': encode_path(self.points),
+        }
@@ -1,3 +1,623 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from whiteboard.codecs import (
+    FLOAT32_ARRAY, JSONCodec, MSGPACK_SUBPROTOCOL, MessagePackCodec, msgpack, pack_floats, select_codec,
+)
+from whiteboard.models import DrawingElement, Permission, Room, RoomOperation, RoomParticipant
+from whiteboard.paths import MAX_COORDINATE
+from .broker import Broker
+from .buffers import ElementWriteBuffer, clean_fields
+from .cursors import CursorAggregator
+from .layers import BrokerChannelLayer
+from .outbound import RESYNC_KEEP, OutboundQueue, merge_cursors, merge_element_update
+from .routing import websocket_urlpatterns
+from .strokes import parse_points
+from .writer import DatabaseWriter
+
+
+@override_settings(WHITEBOARD_WRITE_BUFFER={'FLUSH_INTERVAL': 0.05, 'MAX_BATCH': 200})
+class ConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='x')
+        self.member = User.objects.create_user('member', password='x')
+        self.room = Room.objects.create(name='Room', created_by=self.owner, is_public=True)
+        # A failing test must not leave its buffer to the next one
+        self.addCleanup(ElementWriteBuffer._buffers.clear)
+
+    async def open(self, user, query='', subprotocols=None):
+        """A connected client whose first messages are still to be received"""
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/whiteboard/{self.room.id}/{query}', subprotocols=subprotocols
+        )
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def connect(self, user):
+        communicator = await self.open(user)
+        await self.receive_all(communicator)
+        return communicator
+
+    async def receive_all(self, communicator, timeout=0.3):
+        """Messages sent to a client until it has been idle for timeout"""
+        messages = []
+        while not await communicator.receive_nothing(timeout):
+            messages.append(await communicator.receive_json_from())
+        return messages
+
+    def run_async(self, test):
+        asyncio.run(test())
+        self.assertEqual(ElementWriteBuffer._buffers, {})
+
+
+class WriteBufferTest(ConsumerTestCase):
+    def test_changes_are_flushed(self):
+        async def test():
+            sender = await self.connect(self.owner)
+            receiver = await self.connect(self.member)
+            await self.receive_all(sender)
+            for i in range(3):
+                await sender.send_json_to({'type': 'add_element', 'element_type': 'rectangle', 'x': i, 'y': i})
+            added = [
+                message['element_id'] for message in await self.receive_all(receiver)
+                if message['type'] == 'element_added'
+            ]
+            self.assertEqual(len(added), 3)
+
+            await sender.send_json_to({'type': 'update_element', 'element_id': added[0], 'x': 99})
+            await sender.send_json_to({'type': 'delete_element', 'element_id': added[1]})
+            await self.receive_all(receiver)
+            live = await sync_to_async(
+                lambda: dict(DrawingElement.objects.filter(room=self.room, is_deleted=False).values_list('id', 'x'))
+            )()
+            self.assertEqual(live, {uuid.UUID(added[0]): 99, uuid.UUID(added[2]): 2})
+            await sender.disconnect()
+            await receiver.disconnect()
+        self.run_async(test)
+        self.assertEqual(self.room.operations.count(), 5)
+
+    def test_elements_of_other_rooms_are_left_alone(self):
+        other = Room.objects.create(name='Other', created_by=self.member, is_public=True)
+        foreign = DrawingElement.objects.create(room=other, created_by=self.member, element_type='rectangle', x=1, y=1)
+
+        async def test():
+            sender = await self.connect(self.owner)
+            receiver = await self.connect(self.member)
+            await self.receive_all(sender)
+            await sender.send_json_to({'type': 'update_element', 'element_id': str(foreign.id), 'x': 500})
+            await sender.send_json_to({'type': 'delete_element', 'element_id': str(foreign.id)})
+            replies = await self.receive_all(sender)
+            self.assertEqual([message['type'] for message in replies], ['error', 'error'])
+            self.assertEqual(await self.receive_all(receiver), [])
+            await sender.disconnect()
+            await receiver.disconnect()
+        self.run_async(test)
+        foreign.refresh_from_db()
+        self.assertEqual((foreign.x, foreign.is_deleted), (1, False))
+
+        # Queued directly, the change is dropped when the batch is written
+        buffer = ElementWriteBuffer(self.room.id)
+        with self.assertLogs('realtime.buffers', 'WARNING'):
+            buffer.write([], {str(foreign.id): {'x': 500}})
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.x, 1)
+        self.assertFalse(RoomOperation.objects.exists())
+
+    def test_elements_being_written_can_be_changed(self):
+        buffer = ElementWriteBuffer(self.room.id)
+        started, proceed = threading.Event(), threading.Event()
+        write = buffer.write
+
+        def slow_write(*args):
+            started.set()
+            proceed.wait(5)
+            write(*args)
+        buffer.write = slow_write
+
+        async def test():
+            element_id = buffer.create(created_by=self.owner, element_type='rectangle', x=1, y=1)
+            flush = asyncio.ensure_future(buffer.flush())
+            await asyncio.to_thread(started.wait, 5)
+            # Not committed yet, but known to the buffer
+            self.assertTrue(await asyncio.wait_for(buffer.update(element_id, user=self.owner, x=5), 1))
+            proceed.set()
+            await flush
+            await buffer.flush()
+            return element_id
+        element_id = asyncio.run(test())
+        self.assertEqual(DrawingElement.objects.get(id=element_id).x, 5)
+        self.assertEqual(buffer.writing_ids, set())
+
+    def test_deleted_elements_cannot_be_changed(self):
+        deleted = DrawingElement.objects.create(
+            room=self.room, created_by=self.owner, element_type='rectangle', x=1, y=1, is_deleted=True
+        )
+        live = DrawingElement.objects.create(room=self.room, created_by=self.owner, element_type='rectangle', x=1, y=1)
+        buffer = ElementWriteBuffer(self.room.id)
+
+        async def test():
+            self.assertFalse(await buffer.update(deleted.id, x=5))
+            created = buffer.create(created_by=self.owner, element_type='rectangle', x=1, y=1)
+            self.assertTrue(await buffer.delete(created))
+            self.assertFalse(await buffer.update(created, x=5))
+
+            self.assertTrue(await buffer.update(live.id, x=5))
+            self.assertTrue(await buffer.delete(live.id))
+            self.assertFalse(await buffer.update(live.id, x=6))
+            await buffer.flush()
+            self.assertFalse(await buffer.update(live.id, x=6))
+        asyncio.run(test())
+        live.refresh_from_db()
+        self.assertEqual((live.x, live.is_deleted), (5, True))
+        self.assertEqual(DrawingElement.objects.get(id=deleted.id).x, 1)
+
+    def test_invalid_values_are_rejected(self):
+        async def test():
+            sender = await self.connect(self.owner)
+            await sender.send_json_to({'type': 'add_element', 'element_type': 'rectangle', 'x': 'abc', 'y': 1})
+            await sender.send_json_to({'type': 'add_element', 'element_type': 'rectangle', 'x': 3, 'y': 1})
+            replies = await self.receive_all(sender)
+            self.assertEqual(replies[0]['type'], 'error')
+            self.assertIn('x', replies[0]['message'])
+            await sender.disconnect()
+        self.run_async(test)
+        self.assertEqual(list(DrawingElement.objects.values_list('x', flat=True)), [3])
+
+        for fields in [{'x': float('nan')}, {'color': 'x' * 100}, {'x': None}, {'path_data': '[{"x": 1e999, "y": 0}]'}]:
+            with self.subTest(fields=fields), self.assertRaises(ValueError):
+                clean_fields(fields)
+        self.assertEqual(clean_fields({'x': '2.5', 'z_index': '3'}), {'x': 2.5, 'z_index': 3})
+
+    def test_failed_batch_is_written_one_change_at_a_time(self):
+        buffer = ElementWriteBuffer(self.room.id)
+        good, bad = (
+            DrawingElement(room_id=self.room.id, created_by=self.owner, element_type='rectangle', x=x, y=1)
+            for x in (1, 'abc')
+        )
+        buffer.pending_creates = {str(good.id): good, str(bad.id): bad}
+        with self.assertLogs('realtime.buffers', 'ERROR') as logs:
+            asyncio.run(buffer.flush())
+        self.assertIn(f'Dropped buffered change to element {bad.id}', logs.output[-1])
+        self.assertTrue(DrawingElement.objects.filter(id=good.id).exists())
+        self.assertFalse(DrawingElement.objects.filter(id=bad.id).exists())
+        self.assertEqual(buffer.pending, 0)
+
+    def test_stroke_ids_in_use_are_rejected(self):
+        existing = DrawingElement.objects.create(room=self.room, created_by=self.owner, element_type='rectangle', x=1, y=1)
+
+        async def test():
+            sender = await self.connect(self.owner)
+            await sender.send_json_to({'type': 'stroke_begin', 'stroke_id': str(existing.id), 'points': [0, 0]})
+            self.assertEqual([message['type'] for message in await self.receive_all(sender)], ['error'])
+            stroke_id = str(uuid.uuid4())
+            await sender.send_json_to({'type': 'stroke_begin', 'stroke_id': stroke_id, 'points': [0, 0]})
+            await sender.send_json_to({'type': 'stroke_end', 'stroke_id': stroke_id, 'points': [1, 1]})
+            await sender.send_json_to({'type': 'stroke_begin', 'stroke_id': stroke_id, 'points': [0, 0]})
+            self.assertEqual([message['type'] for message in await self.receive_all(sender)], ['error'])
+            await sender.disconnect()
+        self.run_async(test)
+        self.assertEqual(DrawingElement.objects.filter(room=self.room).count(), 2)
+
+    def test_stroke_points_must_be_encodable(self):
+        points = [1, 2.5, MAX_COORDINATE, -MAX_COORDINATE]
+        self.assertEqual(parse_points([str(value) for value in points]), points)
+        for points in ([1, 2, 3], [0, float('nan')], [0, 1e300], [0, MAX_COORDINATE * 2]):
+            with self.subTest(points=points), self.assertRaises(ValueError):
+                parse_points(points)
+
+
+@skipIf(msgpack is None, 'msgpack is not installed')
+class CodecTest(ConsumerTestCase):
+    async def receive_packed(self, communicator, timeout=0.3):
+        """Binary frames sent to a MessagePack client until it is idle"""
+        messages = []
+        while not await communicator.receive_nothing(timeout):
+            messages.append(MessagePackCodec().decode(bytes_data=await communicator.receive_from()))
+        return messages
+
+    def test_points_travel_as_float32(self):
+        async def test():
+            packed = await self.open(self.owner, subprotocols=[MSGPACK_SUBPROTOCOL, 'whiteboard.json'])
+            await self.receive_packed(packed)
+            plain = await self.connect(self.member)
+            await self.receive_packed(packed)
+
+            stroke_id = str(uuid.uuid4())
+            await plain.send_json_to({'type': 'stroke_begin', 'stroke_id': stroke_id, 'points': [0, 0, 1.5, 2.25]})
+            [message] = await self.receive_packed(packed)
+            self.assertEqual(message['type'], 'stroke_started')
+            self.assertEqual(message['points'], [0, 0, 1.5, 2.25])
+
+            frame = msgpack.packb({
+                'type': 'stroke_begin',
+                'stroke_id': str(uuid.uuid4()),
+                'points': msgpack.ExtType(FLOAT32_ARRAY, pack_floats([3, 4.5])),
+            })
+            await packed.send_to(bytes_data=frame)
+            [message] = await self.receive_all(plain)
+            self.assertEqual(message['points'], [3, 4.5])
+
+            # A truncated array is rejected, in the client's own encoding
+            frame = msgpack.packb({'type': 'stroke_points', 'points': msgpack.ExtType(FLOAT32_ARRAY, b'\0' * 6)})
+            await packed.send_to(bytes_data=frame)
+            [message] = await self.receive_packed(packed)
+            self.assertEqual(message['type'], 'error')
+            await packed.disconnect()
+            await plain.disconnect()
+        self.run_async(test)
+
+    def test_json_unless_asked_for(self):
+        self.assertEqual(select_codec([])[1], None)
+        self.assertEqual(select_codec(['whiteboard.json'])[1], 'whiteboard.json')
+        self.assertEqual(select_codec(['whiteboard.json', MSGPACK_SUBPROTOCOL])[1], MSGPACK_SUBPROTOCOL)
+        with self.assertRaises(ValueError):
+            MessagePackCodec().decode(bytes_data=msgpack.packb([1, 2]))
+
+
+@skipIf(msgpack is None, 'msgpack is not installed')
+class BrokerLayerTest(SimpleTestCase):
+    """Two worker processes' layers talking through one broker"""
+
+    def run_broker(self, test):
+        async def run():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'broker.sock')
+                broker = asyncio.ensure_future(Broker(path).serve())
+                layers = [BrokerChannelLayer(path, reconnect_delay=0.05) for _ in range(2)]
+                try:
+                    await test(*layers)
+                finally:
+                    for layer in layers:
+                        await layer.close()
+                    broker.cancel()
+        asyncio.run(run())
+
+    def test_messages_reach_other_workers(self):
+        async def test(first, second):
+            local = await first.new_channel()
+            remote = await second.new_channel()
+            await first.group_add('room', local)
+            await second.group_add('room', remote)
+
+            await first.group_send('room', {'type': 'hello', 'data': b'\x00'})
+            for layer, channel in ((first, local), (second, remote)):
+                message = await asyncio.wait_for(layer.receive(channel), 1)
+                self.assertEqual(message, {'type': 'hello', 'data': b'\x00'})
+
+            await first.send(remote, {'type': 'direct'})
+            self.assertEqual(await asyncio.wait_for(second.receive(remote), 1), {'type': 'direct'})
+
+            await second.group_discard('room', remote)
+            await first.group_send('room', {'type': 'again'})
+            self.assertEqual(await asyncio.wait_for(first.receive(local), 1), {'type': 'again'})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(second.receive(remote), 0.2)
+        self.run_broker(test)
+
+    def test_groups_survive_a_lost_connection(self):
+        async def test(first, second):
+            remote = await second.new_channel()
+            await second.group_add('room', remote)
+            await first.group_send('room', {'type': 'before'})
+            self.assertEqual(await asyncio.wait_for(second.receive(remote), 1), {'type': 'before'})
+
+            # The broker forgets the worker's groups when its link drops;
+            # they are registered again once it reconnects
+            with self.assertLogs('realtime.layers', 'WARNING'):
+                second._connection.writer.writer.transport.abort()
+                await asyncio.sleep(0.3)
+            await first.group_send('room', {'type': 'after'})
+            self.assertEqual(await asyncio.wait_for(second.receive(remote), 1), {'type': 'after'})
+        self.run_broker(test)
+
+
+@override_settings(WHITEBOARD_OUTBOUND_QUEUE={'MAX_SIZE': 4, 'MAX_LAG': 60})
+class OutboundQueueTest(SimpleTestCase):
+    def run_queue(self, test):
+        """Run test with a queue whose client reads nothing until released"""
+        async def run():
+            sent, released, lagged = [], asyncio.Event(), []
+
+            async def send(text_data):
+                await released.wait()
+                sent.append(json.loads(text_data))
+
+            async def on_lag():
+                lagged.append(True)
+            queue = OutboundQueue(send, JSONCodec(), on_lag)
+            # The first frame is taken by the blocked client
+            queue.push('direct', JSONCodec().encode({'type': 'first'}))
+            await asyncio.sleep(0)
+            try:
+                await test(queue)
+                released.set()
+                while queue.entries:
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.01)
+            finally:
+                queue.close()
+            return sent[1:], lagged
+        return asyncio.run(run())
+
+    def push(self, queue, event_type, key=None, merge=None, **fields):
+        queue.push(event_type, JSONCodec().encode({'type': event_type, **fields}), key, merge)
+
+    def test_superseded_updates_are_merged(self):
+        async def test(queue):
+            self.push(queue, 'element_updated', 'a', merge_element_update, data={'x': 1, 'y': 1})
+            self.push(queue, 'cursors', 'cursors', merge_cursors, cursors=[{'user': 'a', 'x': 1}])
+            self.push(queue, 'element_updated', 'a', merge_element_update, data={'x': 2})
+            self.push(queue, 'cursors', 'cursors', merge_cursors, cursors=[{'user': 'b', 'x': 2}])
+            self.push(queue, 'cursors', 'cursors', merge_cursors, cursors=[{'user': 'a', 'x': 3}])
+            self.assertEqual((len(queue), queue.merged), (2, 3))
+        sent, lagged = self.run_queue(test)
+        self.assertEqual(sent, [
+            {'type': 'element_updated', 'data': {'x': 2, 'y': 1}},
+            {'type': 'cursors', 'cursors': [{'user': 'a', 'x': 3}, {'user': 'b', 'x': 2}]},
+        ])
+        self.assertEqual(lagged, [])
+
+    def test_lagging_clients_are_resynced(self):
+        async def test(queue):
+            self.push(queue, 'user_joined', user='a')
+            for i in range(4):
+                self.push(queue, 'element_added', element_id=i)
+            await asyncio.sleep(0)
+            self.assertTrue(queue.lagging)
+            # Nothing was dropped to make room
+            self.assertEqual(len(queue), 5)
+            queue.reset(keep=RESYNC_KEEP)
+            await queue.put(JSONCodec().encode({'type': 'initial_state_begin'}))
+        sent, lagged = self.run_queue(test)
+        self.assertEqual(lagged, [True])
+        self.assertEqual([message['type'] for message in sent], ['user_joined', 'initial_state_begin'])
+
+    def test_replies_wait_for_space(self):
+        async def test(queue):
+            for i in range(4):
+                self.push(queue, 'element_added', element_id=i)
+            reply = asyncio.ensure_future(queue.put(JSONCodec().encode({'type': 'error'})))
+            await asyncio.sleep(0.05)
+            self.assertFalse(reply.done())
+            queue.discard(next(iter(queue.entries)))
+            await asyncio.wait_for(reply, 1)
+        sent, _ = self.run_queue(test)
+        self.assertEqual([message['type'] for message in sent][-1], 'error')
+
+
+class WriterTest(ConsumerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.writer = DatabaseWriter()
+        self.addCleanup(setattr, connection, 'transaction_mode', connection.transaction_mode)
+
+    def rename(self, name):
+        Room.objects.filter(id=self.room.id).update(name=name)
+        if name == 'fail':
+            raise ValueError(name)
+        return name
+
+    def test_failing_writes_only_undo_themselves(self):
+        batch = [(Future(), self.rename, (name,), {}) for name in ('one', 'fail', 'two')]
+        cancelled = Future()
+        cancelled.cancel()
+        batch.append((cancelled, self.rename, ('cancelled',), {}))
+        self.writer.execute(batch)
+
+        self.assertEqual([future.result() for future, *_ in batch[::2]], ['one', 'two'])
+        with self.assertRaises(ValueError):
+            batch[1][0].result()
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.name, 'two')
+        self.assertEqual((self.writer.batch_count, self.writer.total_written), (1, 3))
+
+    @override_settings(WHITEBOARD_DB_WRITER={'MAX_BATCH': 3, 'MAX_DELAY': 0})
+    def test_queued_writes_are_batched(self):
+        writer = DatabaseWriter()
+        futures = [writer.submit(self.rename, str(i)) for i in range(5)]
+        self.assertEqual(len(writer.take_batch()), 3)
+        self.assertEqual(len(writer.take_batch()), 2)
+        self.assertFalse(any(future.done() for future in futures))
+
+
+class InitialStateTest(ConsumerTestCase):
+    def test_elements_match_the_element_api(self):
+        RoomParticipant.objects.create(room=self.room, user=self.owner)
+        for fields in [
+            {'element_type': 'pen', 'path_data': '[{"x":1,"y":2},{"x":3.5,"y":4}]', 'z_index': 1},
+            {'element_type': 'text', 'x': 1, 'y': 2, 'text_content': 'a', 'font_family': 'Serif'},
+        ]:
+            DrawingElement.objects.create(room=self.room, created_by=self.owner, **{'x': 0, 'y': 0, **fields})
+        self.client.force_login(self.owner)
+        expected = self.client.get(f'/api/rooms/{self.room.id}/elements/').json()
+
+        async def test():
+            client = await self.open(self.owner)
+            messages = await self.receive_all(client)
+            await client.disconnect()
+            return messages
+        messages = asyncio.run(test())
+        self.assertEqual(
+            [message['elements'] for message in messages if message['type'] == 'initial_state_chunk'],
+            [expected]
+        )
+
+
+class ReplaceTest(ConsumerTestCase):
+    """Rooms cleared or replaced through the API while clients draw"""
+    
+    def draw(self, sender):
+        """An element the sender adds, still waiting in the write buffer"""
+        async def test():
+            await self.receive_all(sender)
+            await sender.send_json_to({'type': 'add_element', 'element_type': 'rectangle', 'x': 1, 'y': 1})
+            [reply] = await self.receive_all(sender)
+            self.assertEqual(reply['type'], 'element_added')
+            self.assertFalse(await sync_to_async(DrawingElement.objects.filter(id=reply['element_id']).exists)())
+            return reply['element_id']
+        return test()
+
+    @override_settings(WHITEBOARD_WRITE_BUFFER={'FLUSH_INTERVAL': 60, 'MAX_BATCH': 200})
+    def test_clear_writes_buffered_elements_first(self):
+        self.client.force_login(self.owner)
+
+        async def test():
+            sender = await self.connect(self.owner)
+            receiver = await self.connect(self.member)
+            element_id = await self.draw(sender)
+            await self.receive_all(receiver)
+            response = await sync_to_async(self.client.post)(f'/api/rooms/{self.room.id}/clear/')
+            self.assertEqual(response.status_code, 200)
+            element = await sync_to_async(DrawingElement.objects.get)(id=element_id)
+            self.assertTrue(element.is_deleted)
+            messages = await self.receive_all(receiver)
+            self.assertEqual(messages, [{'type': 'whiteboard_cleared', 'user': 'owner'}])
+            await sender.disconnect()
+            await receiver.disconnect()
+        self.run_async(test)
+        self.assertFalse(DrawingElement.objects.filter(room=self.room, is_deleted=False).exists())
+
+    @override_settings(WHITEBOARD_WRITE_BUFFER={'FLUSH_INTERVAL': 60, 'MAX_BATCH': 200})
+    def test_restore_writes_buffered_elements_first(self):
+        RoomParticipant.objects.create(room=self.room, user=self.owner)
+        kept = DrawingElement.objects.create(room=self.room, created_by=self.owner, element_type='rectangle', x=0, y=0)
+        self.client.force_login(self.owner)
+        response = self.client.post(f'/api/rooms/{self.room.id}/save_snapshot/', {'name': 'Snapshot'})
+        snapshot_id = response.json()['id']
+
+        async def test():
+            sender = await self.connect(self.owner)
+            receiver = await self.connect(self.member)
+            element_id = await self.draw(sender)
+            await self.receive_all(receiver)
+            response = await sync_to_async(self.client.post)(f'/api/snapshots/{snapshot_id}/restore/')
+            self.assertEqual(response.status_code, 200)
+            element = await sync_to_async(DrawingElement.objects.get)(id=element_id)
+            self.assertTrue(element.is_deleted)
+            messages = await self.receive_all(receiver)
+            self.assertEqual(messages[0], {'type': 'initial_state_begin', 'viewport': None, 'resync': True})
+            [chunk] = [message for message in messages if message['type'] == 'initial_state_chunk']
+            self.assertEqual([element['x'] for element in chunk['elements']], [kept.x])
+            await sender.disconnect()
+            await receiver.disconnect()
+        self.run_async(test)
+        self.assertEqual(DrawingElement.objects.filter(room=self.room, is_deleted=False).count(), 1)
+
+
+class CursorTest(ConsumerTestCase):
+    def test_moves_are_sent_once_per_tick(self):
+        participant = RoomParticipant.objects.create(room=self.room, user=self.owner)
+        layer = mock.AsyncMock()
+
+        async def test():
+            aggregator = CursorAggregator(self.room.id, layer, 'room')
+            aggregator.move('owner', 1.0, 2.0, participant.id)
+            aggregator.move('owner', 3.0, 4.0, participant.id)
+            aggregator.move('member', 5.0, 6.0)
+            await aggregator.emit()
+            # Nothing moved since
+            await aggregator.emit()
+            await aggregator.persist()
+        asyncio.run(test())
+
+        layer.group_send.assert_awaited_once()
+        group, event = layer.group_send.await_args.args
+        self.assertEqual((group, event['users']), ('room', ['member', 'owner']))
+        self.assertEqual(json.loads(event['payload']['whiteboard.json']['text_data'])['cursors'], [
+            {'user': 'member', 'x': 5.0, 'y': 6.0},
+            {'user': 'owner', 'x': 3.0, 'y': 4.0},
+        ])
+        participant.refresh_from_db()
+        self.assertEqual((participant.cursor_x, participant.cursor_y), (3.0, 4.0))
+
+    def test_invalid_positions_are_rejected(self):
+        async def test():
+            sender = await self.connect(self.owner)
+            receiver = await self.connect(self.member)
+            await self.receive_all(sender)
+            for x in ['abc', 'nan', float('inf'), None, [1]]:
+                await sender.send_json_to({'type': 'cursor_move', 'x': x, 'y': 1})
+            await sender.send_json_to({'type': 'cursor_move', 'x': '3', 'y': 4})
+            replies = await self.receive_all(sender)
+            self.assertEqual([reply['type'] for reply in replies], ['error'] * 5)
+            frames = await self.receive_all(receiver)
+            self.assertEqual(
+                [frame['cursors'] for frame in frames if frame['type'] == 'cursors'],
+                [[{'user': 'owner', 'x': 3.0, 'y': 4.0}]]
+            )
+            await sender.disconnect()
+            await receiver.disconnect()
+        self.run_async(test)
+        participant = RoomParticipant.objects.get(room=self.room, user=self.owner)
+        self.assertEqual((participant.cursor_x, participant.cursor_y), (3.0, 4.0))
+
+
+class MessagePermissionTest(ConsumerTestCase):
+    # One message of every type that needs more than view
+    MESSAGES = {
+        'draw': {'type': 'draw', 'path_data': '[{"x": 1, "y": 1}]'},
+        'add_element': {'type': 'add_element', 'element_type': 'rectangle', 'x': 1, 'y': 1},
+        'update_element': {'type': 'update_element', 'x': 5},
+        'delete_element': {'type': 'delete_element'},
+        'draw on an element': {'type': 'draw', 'path_data': '[{"x": 9, "y": 9}]'},
+        'erase on an element': {'type': 'erase', 'path_data': '[{"x": 9, "y": 9}]'},
+        'clear': {'type': 'clear'},
+    }
+    # Level each message needs
+    REQUIRED = {
+        'draw': 'draw',
+        'add_element': 'draw',
+        'update_element': 'edit',
+        'delete_element': 'edit',
+        'draw on an element': 'edit',
+        'erase on an element': 'edit',
+        'clear': 'admin',
+    }
+
+    def test_messages_by_level(self):
+        levels = ['view', 'draw', 'edit', 'admin']
+        permission = Permission.objects.create(
+            room=self.room, user=self.member, granted_by=self.owner, permission_type='view'
+        )
+        for level in levels:
+            permission.permission_type = level
+            permission.save()
+            for name, message in self.MESSAGES.items():
+                element = DrawingElement.objects.create(
+                    room=self.room, created_by=self.owner, element_type='pen', x=0, y=0,
+                    path_data='[{"x": 1, "y": 1}]'
+                )
+                if name not in ('draw', 'add_element', 'clear'):
+                    message = {**message, 'element_id': str(element.id)}
+                allowed = levels.index(level) >= levels.index(self.REQUIRED[name])
+                with self.subTest(level=level, message=name):
+                    self.assertEqual(self.send(message), allowed)
+
+    def send(self, message):
+        """Whether the member's message was accepted rather than refused"""
+        async def test():
+            client = await self.connect(self.member)
+            await client.send_json_to(message)
+            replies = await self.receive_all(client)
+            await client.disconnect()
+            return replies
+
+        replies = asyncio.run(test())
+        return not any(
+            reply['type'] == 'error' and 'permission' in reply['message'] for reply in replies
+        )
@@ -0,0 +1,179 @@
+"""Single-writer database access for SQLite deployments.
+
+SQLite lets one connection write at a time, so consumers writing from many
+threads or processes contend for the lock and fail with "database is
+locked" once one waits longer than its timeout. With
+WHITEBOARD_DB_WRITER['ENABLED'], functions wrapped with database_write are
+queued to one writer thread per process instead. It runs up to MAX_BATCH
+of them in one transaction, each in its own savepoint, so a failing write
+only undoes itself. Awaiting the wrapped call returns once the transaction
+committed.
+
+Functions wrapped with database_read run on a pool of READERS threads that
+keep their connections open. Connections are switched to WAL, where readers
+see the last commit without blocking the writer or each other.
+
+When disabled, both behave like channels' database_sync_to_async.
+"""
+import asyncio
+import functools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_writer = None
+_readers = None
+_lock = threading.Lock()
+
+
+def writer_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_DB_WRITER', {}).get(name, default)
+
+
+def enabled():
+    return writer_setting('ENABLED', False)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver applying the SQLite pragmas"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if writer_setting('WAL', True):
+            cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f"PRAGMA synchronous={writer_setting('SYNCHRONOUS', 'NORMAL')}")
+        cursor.execute(f"PRAGMA busy_timeout={int(writer_setting('BUSY_TIMEOUT', 5.0) * 1000)}")
+
+
+class DatabaseWriter(threading.Thread):
+    """Runs queued write functions in batched transactions"""
+
+    def __init__(self):
+        super().__init__(name='database-writer', daemon=True)
+        self.max_batch = writer_setting('MAX_BATCH', 200)
+        self.max_delay = writer_setting('MAX_DELAY', 0.002)
+        self.queue = queue.SimpleQueue()
+
+        # Batch metrics
+        self.batch_count = 0
+        self.total_written = 0
+        self.max_batch_size = 0
+
+    def submit(self, func, *args, **kwargs):
+        """Queue a write; the future resolves once its transaction committed"""
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def take_batch(self):
+        """Wait for a write, then collect more for up to MAX_DELAY seconds"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            try:
+                self.execute(batch)
+            except Exception as exc:
+                logger.exception('Database writer failed a batch of %d writes', len(batch))
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                connection.close()
+
+    def execute(self, batch):
+        connection.ensure_connection()
+        if connection.vendor == 'sqlite':
+            # Take the write lock when the transaction begins, so it waits
+            # for other processes instead of failing on its first write
+            connection.transaction_mode = 'IMMEDIATE'
+
+        results = []
+        with transaction.atomic():
+            for future, func, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with transaction.atomic():
+                        results.append((future, func(*args, **kwargs), None))
+                except Exception as exc:
+                    results.append((future, None, exc))
+
+        # Committed: report each write's own outcome
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+        self.batch_count += 1
+        self.total_written += len(results)
+        self.max_batch_size = max(self.max_batch_size, len(results))
+
+
+def writer():
+    """The writer thread of this process, started on first use"""
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = DatabaseWriter()
+            _writer.start()
+        return _writer
+
+
+def readers():
+    global _readers
+    with _lock:
+        if _readers is None:
+            _readers = ThreadPoolExecutor(
+                max_workers=writer_setting('READERS', 4), thread_name_prefix='database-reader'
+            )
+        return _readers
+
+
+def read(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except DatabaseError:
+        # Reconnect on the next read rather than reuse a broken connection
+        for conn in connections.all(initialized_only=True):
+            conn.close()
+        raise
+
+
+def database_write(func):
+    """Wrap a synchronous write function into a coroutine that returns its
+    result once the write committed"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not enabled():
+            return await database_sync_to_async(func)(*args, **kwargs)
+        return await asyncio.wrap_future(writer().submit(func, *args, **kwargs))
+    return wrapper
+
+
+def database_read(func):
+    """Wrap a synchronous read-only function into a coroutine run on the
+    reader pool"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not enabled():
+            return await database_sync_to_async(func)(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(readers(), read, func, args, kwargs)
+    return wrapper
@@ -1,8 +1,311 @@
+// MessagePack extension type carrying a packed little-endian float32 array
+const FLOAT32_ARRAY_EXT = 1;
+
+// Extra area requested around the visible canvas, as a fraction of its size
+const VIEWPORT_MARGIN = 0.5;
+
+class MessagePackCodec {
+    constructor() {
+        this.textEncoder = new TextEncoder();
+        this.textDecoder = new TextDecoder();
+    }
+    
+    // Encoding
+    encode(value) {
+        this.buffer = new Uint8Array(256);
+        this.view = new DataView(this.buffer.buffer);
+        this.offset = 0;
+        this.writeValue(value);
+        return this.buffer.slice(0, this.offset);
+    }
+    
+    ensure(size) {
+        if (this.offset + size <= this.buffer.length) return;
+        
+        let length = this.buffer.length * 2;
+        while (length < this.offset + size) {
+            length *= 2;
+        }
+        const grown = new Uint8Array(length);
+        grown.set(this.buffer);
+        this.buffer = grown;
+        this.view = new DataView(grown.buffer);
+    }
+    
+    writeByte(value) {
+        this.ensure(1);
+        this.view.setUint8(this.offset++, value);
+    }
+    
+    writeHeader(type, size, value) {
+        this.ensure(1 + size);
+        this.view.setUint8(this.offset++, type);
+        switch (size) {
+            case 1: this.view.setUint8(this.offset, value); break;
+            case 2: this.view.setUint16(this.offset, value); break;
+            case 4: this.view.setUint32(this.offset, value); break;
+        }
+        this.offset += size;
+    }
+    
+    writeValue(value) {
+        if (value === null || value === undefined) {
+            this.writeByte(0xc0);
+        } else if (typeof value === 'boolean') {
+            this.writeByte(value ? 0xc3 : 0xc2);
+        } else if (typeof value === 'number') {
+            this.writeNumber(value);
+        } else if (typeof value === 'string') {
+            this.writeString(value);
+        } else if (value instanceof Float32Array) {
+            this.writeFloat32Array(value);
+        } else if (Array.isArray(value)) {
+            this.writeLength(value.length, 0x90, 0xdc, 0xdd);
+            value.forEach(item => this.writeValue(item));
+        } else {
+            const keys = Object.keys(value).filter(key => value[key] !== undefined);
+            this.writeLength(keys.length, 0x80, 0xde, 0xdf);
+            keys.forEach(key => {
+                this.writeString(key);
+                this.writeValue(value[key]);
+            });
+        }
+    }
+    
+    writeLength(length, fixType, type16, type32) {
+        if (length < 16) {
+            this.writeByte(fixType | length);
+        } else if (length < 0x10000) {
+            this.writeHeader(type16, 2, length);
+        } else {
+            this.writeHeader(type32, 4, length);
+        }
+    }
+    
+    writeNumber(value) {
+        if (!Number.isInteger(value) || value < -0x80000000 || value > 0xffffffff) {
+            this.ensure(9);
+            this.view.setUint8(this.offset++, 0xcb);
+            this.view.setFloat64(this.offset, value);
+            this.offset += 8;
+        } else if (value >= 0) {
+            if (value < 0x80) {
+                this.writeByte(value);
+            } else if (value < 0x100) {
+                this.writeHeader(0xcc, 1, value);
+            } else if (value < 0x10000) {
+                this.writeHeader(0xcd, 2, value);
+            } else {
+                this.writeHeader(0xce, 4, value);
+            }
+        } else if (value >= -0x20) {
+            this.writeByte(value & 0xff);
+        } else {
+            this.ensure(5);
+            this.view.setUint8(this.offset++, 0xd2);
+            this.view.setInt32(this.offset, value);
+            this.offset += 4;
+        }
+    }
+    
+    writeString(value) {
+        const bytes = this.textEncoder.encode(value);
+        if (bytes.length < 32) {
+            this.writeByte(0xa0 | bytes.length);
+        } else if (bytes.length < 0x100) {
+            this.writeHeader(0xd9, 1, bytes.length);
+        } else if (bytes.length < 0x10000) {
+            this.writeHeader(0xda, 2, bytes.length);
+        } else {
+            this.writeHeader(0xdb, 4, bytes.length);
+        }
+        this.ensure(bytes.length);
+        this.buffer.set(bytes, this.offset);
+        this.offset += bytes.length;
+    }
+    
+    writeFloat32Array(values) {
+        const size = values.length * 4;
+        if (size < 0x100) {
+            this.writeHeader(0xc7, 1, size);
+        } else if (size < 0x10000) {
+            this.writeHeader(0xc8, 2, size);
+        } else {
+            this.writeHeader(0xc9, 4, size);
+        }
+        this.ensure(1 + size);
+        this.view.setInt8(this.offset++, FLOAT32_ARRAY_EXT);
+        for (let i = 0; i < values.length; i++) {
+            this.view.setFloat32(this.offset, values[i], true);
+            this.offset += 4;
+        }
+    }
+    
+    // Decoding
+    decode(buffer) {
+        this.bytes = new Uint8Array(buffer);
+        this.view = new DataView(this.bytes.buffer, this.bytes.byteOffset, this.bytes.byteLength);
+        this.offset = 0;
+        return this.readValue();
+    }
+    
+    readUint(size) {
+        let value;
+        switch (size) {
+            case 1: value = this.view.getUint8(this.offset); break;
+            case 2: value = this.view.getUint16(this.offset); break;
+            case 4: value = this.view.getUint32(this.offset); break;
+            case 8: value = Number(this.view.getBigUint64(this.offset)); break;
+        }
+        this.offset += size;
+        return value;
+    }
+    
+    readInt(size) {
+        let value;
+        switch (size) {
+            case 1: value = this.view.getInt8(this.offset); break;
+            case 2: value = this.view.getInt16(this.offset); break;
+            case 4: value = this.view.getInt32(this.offset); break;
+            case 8: value = Number(this.view.getBigInt64(this.offset)); break;
+        }
+        this.offset += size;
+        return value;
+    }
+    
+    readBytes(length) {
+        const bytes = this.bytes.subarray(this.offset, this.offset + length);
+        this.offset += length;
+        return bytes;
+    }
+    
+    readValue() {
+        const type = this.view.getUint8(this.offset++);
+        
+        if (type < 0x80) return type;
+        if (type < 0x90) return this.readMap(type & 0x0f);
+        if (type < 0xa0) return this.readArray(type & 0x0f);
+        if (type < 0xc0) return this.textDecoder.decode(this.readBytes(type & 0x1f));
+        if (type >= 0xe0) return type - 0x100;
+        
+        switch (type) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return this.readBytes(this.readUint(1));
+            case 0xc5: return this.readBytes(this.readUint(2));
+            case 0xc6: return this.readBytes(this.readUint(4));
+            case 0xc7: return this.readExt(this.readUint(1));
+            case 0xc8: return this.readExt(this.readUint(2));
+            case 0xc9: return this.readExt(this.readUint(4));
+            case 0xca: {
+                const value = this.view.getFloat32(this.offset);
+                this.offset += 4;
+                return value;
+            }
+            case 0xcb: {
+                const value = this.view.getFloat64(this.offset);
+                this.offset += 8;
+                return value;
+            }
+            case 0xcc: return this.readUint(1);
+            case 0xcd: return this.readUint(2);
+            case 0xce: return this.readUint(4);
+            case 0xcf: return this.readUint(8);
+            case 0xd0: return this.readInt(1);
+            case 0xd1: return this.readInt(2);
+            case 0xd2: return this.readInt(4);
+            case 0xd3: return this.readInt(8);
+            case 0xd4: return this.readExt(1);
+            case 0xd5: return this.readExt(2);
+            case 0xd6: return this.readExt(4);
+            case 0xd7: return this.readExt(8);
+            case 0xd8: return this.readExt(16);
+            case 0xd9: return this.textDecoder.decode(this.readBytes(this.readUint(1)));
+            case 0xda: return this.textDecoder.decode(this.readBytes(this.readUint(2)));
+            case 0xdb: return this.textDecoder.decode(this.readBytes(this.readUint(4)));
+            case 0xdc: return this.readArray(this.readUint(2));
+            case 0xdd: return this.readArray(this.readUint(4));
+            case 0xde: return this.readMap(this.readUint(2));
+            case 0xdf: return this.readMap(this.readUint(4));
+        }
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+    
+    readArray(length) {
+        const items = new Array(length);
+        for (let i = 0; i < length; i++) {
+            items[i] = this.readValue();
+        }
+        return items;
+    }
+    
+    readMap(length) {
+        const map = {};
+        for (let i = 0; i < length; i++) {
+            const key = this.readValue();
+            map[key] = this.readValue();
+        }
+        return map;
+    }
+    
+    readExt(length) {
+        const extType = this.view.getInt8(this.offset++);
+        const start = this.offset;
+        this.offset += length;
+        
+        if (extType !== FLOAT32_ARRAY_EXT) {
+            return this.bytes.subarray(start, start + length);
+        }
+        const values = new Float32Array(length / 4);
+        for (let i = 0; i < values.length; i++) {
+            values[i] = this.view.getFloat32(start + i * 4, true);
+        }
+        return values;
+    }
+}
+
+// Decode a compact stroke path (see whiteboard/paths.py) into {x, y} points.
+// JSON frames carry it as base64, MessagePack frames as raw bytes.
+function decodePath(data) {
+    const bytes = typeof data === 'string'
+        ? Uint8Array.from(atob(data), c => c.charCodeAt(0))
+        : data;
+    if (bytes.length < 2 || bytes[0] !== 1) {
+        return null;
+    }
+    const factor = Math.pow(10, bytes[1]);
+    const coords = [0, 0];
+    const points = [];
+    let value = 0;
+    let scale = 1;
+    let axis = 0;
+    for (let i = 2; i < bytes.length; i++) {
+        const byte = bytes[i];
+        // Varints can exceed 32 bits, so avoid bitwise operators here
+        value += (byte & 0x7f) * scale;
+        if (byte & 0x80) {
+            scale *= 128;
+            continue;
+        }
+        coords[axis] += value % 2 ? -(value + 1) / 2 : value / 2;
+        if (axis === 1) {
+            points.push({ x: coords[0] / factor, y: coords[1] / factor });
+        }
+        axis = 1 - axis;
+        value = 0;
+        scale = 1;
+    }
+    return points;
+}
+
 class CollaborativeWhiteboard {
     constructor() {
         this.canvas = document.getElementById('whiteboard');
         this.ctx = this.canvas.getContext('2d');
         this.socket = null;
+        this.msgpack = new MessagePackCodec();
+        this.binary = false;
         this.isDrawing = false;
         this.currentTool = 'pen';
         this.currentColor = '#000000';
@@ -13,12 +316,17 @@ class CollaborativeWhiteboard {
         this.isPanning = false;
         this.lastPanPoint = { x: 0, y: 0 };
         this.elements = [];
+        this.elementIds = new Set();
         this.history = [];
         this.historyStep = 0;
         this.participants = new Map();
         this.gridVisible = false;
+        this.announcedViewport = null;
         this.startPos = { x: 0, y: 0 };
         this.currentPath = [];
+        this.pendingCursor = null;
+        this.currentStroke = null;
+        this.remoteStrokes = new Map();
         
         this.init();
     }
@@ -43,17 +351,26 @@ class CollaborativeWhiteboard {
     
     setupWebSocket() {
         const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${wsProtocol}//${window.location.host}/ws/whiteboard/${window.ROOM_DATA.id}/`;
+        // Announce the viewport so the server only sends elements near it
+        this.announcedViewport = this.getViewport(VIEWPORT_MARGIN);
+        const viewport = this.announcedViewport.map(value => Math.round(value)).join(',');
+        const wsUrl = `${wsProtocol}//${window.location.host}/ws/whiteboard/${window.ROOM_DATA.id}/?viewport=${viewport}&paths=compact`;
         
-        this.socket = new WebSocket(wsUrl);
+        // Prefer MessagePack frames; the server falls back to JSON
+        this.socket = new WebSocket(wsUrl, ['whiteboard.msgpack', 'whiteboard.json']);
+        this.socket.binaryType = 'arraybuffer';
         
         this.socket.onopen = () => {
             console.log('WebSocket connected');
+            this.binary = this.socket.protocol === 'whiteboard.msgpack';
+            this.announceViewport();
             this.updateParticipants();
         };
         
         this.socket.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+            const data = event.data instanceof ArrayBuffer
+                ? this.msgpack.decode(event.data)
+                : JSON.parse(event.data);
             this.handleWebSocketMessage(data);
         };
         
@@ -170,6 +487,30 @@ class CollaborativeWhiteboard {
         this.canvas.height = rect.height;
         
         this.redrawCanvas();
+        this.announceViewport();
+    }
+    
+    getViewport(margin = 0) {
+        // Visible area in canvas coordinates as [x0, y0, x1, y1], grown by margin
+        const width = this.canvas.width / this.zoom;
+        const height = this.canvas.height / this.zoom;
+        const x0 = -this.panOffset.x - width * margin;
+        const y0 = -this.panOffset.y - height * margin;
+        return [x0, y0, x0 + width * (1 + 2 * margin), y0 + height * (1 + 2 * margin)];
+    }
+    
+    announceViewport() {
+        // Ask for elements again only once the screen leaves the announced area
+        if (!this.socket || this.socket.readyState !== WebSocket.OPEN) return;
+        
+        const visible = this.getViewport();
+        const known = this.announcedViewport;
+        if (known && visible[0] >= known[0] && visible[1] >= known[1] &&
+            visible[2] <= known[2] && visible[3] <= known[3]) {
+            return;
+        }
+        this.announcedViewport = this.getViewport(VIEWPORT_MARGIN);
+        this.sendMessage({ type: 'viewport', viewport: this.announcedViewport });
     }
     
     getMousePos(e) {
@@ -231,6 +572,10 @@ class CollaborativeWhiteboard {
         this.ctx.beginPath();
         this.ctx.moveTo(pos.x, pos.y);
         
+        if (this.currentTool === 'pen' || this.currentTool === 'brush') {
+            this.beginStroke(pos);
+        }
+        
         // Save state for undo/redo
         this.saveState();
     }
@@ -257,15 +602,8 @@ class CollaborativeWhiteboard {
             this.currentPath.push(pos);
             this.drawLine(this.currentPath[this.currentPath.length - 2], pos);
             
-            // Send drawing data to other users
-            this.sendDrawingData({
-                type: 'draw',
-                path: this.currentPath.slice(-2),
-                color: this.currentColor,
-                size: this.currentSize,
-                opacity: this.currentOpacity,
-                tool: this.currentTool
-            });
+            // Send the new point to other users
+            this.sendDrawingData(pos);
         } else if (this.currentTool === 'eraser') {
             this.erase(pos);
         } else {
@@ -279,7 +617,10 @@ class CollaborativeWhiteboard {
         if (!this.isDrawing) return;
         
         this.isDrawing = false;
-        this.isPanning = false;
+        if (this.isPanning) {
+            this.isPanning = false;
+            this.announceViewport();
+        }
         
         const pos = this.getMousePos(e);
         
@@ -289,8 +630,14 @@ class CollaborativeWhiteboard {
             this.sendShapeData(this.startPos, pos);
         }
         
+        const stroke = this.currentStroke;
+        if (stroke) {
+            this.endStroke();
+        }
+        
         if (this.currentPath.length > 0) {
             this.addElement({
+                id: stroke ? stroke.id : undefined,
                 type: this.currentTool,
                 path: this.currentPath,
                 color: this.currentColor,
@@ -474,6 +821,7 @@ class CollaborativeWhiteboard {
     drawElement(element) {
         this.ctx.globalAlpha = element.opacity || 1;
         this.ctx.strokeStyle = element.color;
+        this.ctx.fillStyle = element.color;
         this.ctx.lineWidth = element.size;
         
         if (element.path && element.path.length > 1) {
@@ -483,13 +831,64 @@ class CollaborativeWhiteboard {
                 this.ctx.lineTo(element.path[i].x, element.path[i].y);
             }
             this.ctx.stroke();
+        } else if (element.type === 'text' && element.text) {
+            this.ctx.font = `${element.fontSize || 16}px Arial`;
+            this.ctx.fillText(element.text, element.x, element.y);
+        } else if (element.type === 'line') {
+            this.ctx.beginPath();
+            this.ctx.moveTo(element.x, element.y);
+            this.ctx.lineTo(element.x + element.width, element.y + element.height);
+            this.ctx.stroke();
+        } else if (element.type === 'rectangle') {
+            this.ctx.strokeRect(element.x, element.y, element.width, element.height);
+        } else if (element.type === 'circle') {
+            const radius = Math.sqrt(element.width * element.width + element.height * element.height);
+            this.ctx.beginPath();
+            this.ctx.arc(element.x, element.y, radius, 0, 2 * Math.PI);
+            this.ctx.stroke();
         }
         
         this.ctx.globalAlpha = 1;
     }
     
     addElement(element) {
+        if (element.id) {
+            if (this.elementIds.has(element.id)) return false;
+            this.elementIds.add(element.id);
+        }
         this.elements.push(element);
+        return true;
+    }
+    
+    fromServerElement(data) {
+        // Convert the element API format, which initial state and batches
+        // also use, into the one used for drawing
+        let path = null;
+        if (data.path) {
+            path = decodePath(data.path);
+        } else if (data.path_data) {
+            try {
+                path = JSON.parse(data.path_data);
+            } catch (e) {
+                path = null;
+            }
+        }
+        return {
+            id: data.id,
+            type: data.element_type,
+            x: data.x,
+            y: data.y,
+            width: data.width,
+            height: data.height,
+            color: data.color,
+            size: data.stroke_width,
+            opacity: data.opacity,
+            path: path,
+            text: data.text_content,
+            fontSize: data.font_size,
+            z_index: data.z_index,
+            created_at: data.created_at
+        };
     }
     
     saveState() {
@@ -528,6 +927,7 @@ class CollaborativeWhiteboard {
         if (confirm('Are you sure you want to clear the entire whiteboard?')) {
             this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
             this.elements = [];
+            this.elementIds = new Set();
             this.sendMessage({ type: 'clear' });
             this.saveState();
         }
@@ -552,6 +952,7 @@ class CollaborativeWhiteboard {
     updateZoom() {
         this.canvas.style.transform = `scale(${this.zoom}) translate(${this.panOffset.x}px, ${this.panOffset.y}px)`;
         document.getElementById('zoom-display').textContent = `${Math.round(this.zoom * 100)}%`;
+        this.announceViewport();
     }
     
     saveSnapshot() {
@@ -603,12 +1004,75 @@ class CollaborativeWhiteboard {
     // WebSocket methods
     sendMessage(message) {
         if (this.socket && this.socket.readyState === WebSocket.OPEN) {
-            this.socket.send(JSON.stringify(message));
+            if (this.binary) {
+                if (Array.isArray(message.points)) {
+                    message = { ...message, points: Float32Array.from(message.points) };
+                }
+                this.socket.send(this.msgpack.encode(message));
+            } else {
+                this.socket.send(JSON.stringify(message));
+            }
+        }
+    }
+    
+    generateId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
         }
+        const bytes = crypto.getRandomValues(new Uint8Array(16));
+        bytes[6] = (bytes[6] & 0x0f) | 0x40;
+        bytes[8] = (bytes[8] & 0x3f) | 0x80;
+        const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+        return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
     }
     
-    sendDrawingData(data) {
-        this.sendMessage(data);
+    beginStroke(pos) {
+        this.currentStroke = { id: this.generateId(), pending: [], scheduled: false };
+        this.sendMessage({
+            type: 'stroke_begin',
+            stroke_id: this.currentStroke.id,
+            tool: this.currentTool,
+            color: this.currentColor,
+            stroke_width: this.currentSize,
+            opacity: this.currentOpacity,
+            points: [pos.x, pos.y]
+        });
+    }
+    
+    sendDrawingData(pos) {
+        // Only new points go over the wire, batched per animation frame
+        const stroke = this.currentStroke;
+        if (!stroke) return;
+        
+        stroke.pending.push(pos.x, pos.y);
+        if (stroke.scheduled) return;
+        
+        stroke.scheduled = true;
+        requestAnimationFrame(() => this.flushStrokePoints(stroke));
+    }
+    
+    flushStrokePoints(stroke) {
+        stroke.scheduled = false;
+        if (stroke.pending.length === 0) return;
+        
+        this.sendMessage({
+            type: 'stroke_points',
+            stroke_id: stroke.id,
+            points: stroke.pending
+        });
+        stroke.pending = [];
+    }
+    
+    endStroke() {
+        const stroke = this.currentStroke;
+        this.currentStroke = null;
+        
+        this.sendMessage({
+            type: 'stroke_end',
+            stroke_id: stroke.id,
+            points: stroke.pending
+        });
+        stroke.pending = [];
     }
     
     sendShapeData(start, end) {
@@ -638,40 +1102,100 @@ class CollaborativeWhiteboard {
     }
     
     sendCursorUpdate(pos) {
-        this.sendMessage({
-            type: 'cursor_move',
-            x: pos.x,
-            y: pos.y
+        // Send at most one cursor position per animation frame
+        const scheduled = this.pendingCursor !== null;
+        this.pendingCursor = pos;
+        if (scheduled) return;
+        
+        requestAnimationFrame(() => {
+            const latest = this.pendingCursor;
+            this.pendingCursor = null;
+            this.sendMessage({
+                type: 'cursor_move',
+                x: latest.x,
+                y: latest.y
+            });
         });
     }
     
     handleWebSocketMessage(data) {
         switch (data.type) {
-            case 'initial_state':
-                this.loadInitialState(data.elements);
+            case 'initial_state_begin':
+                this.beginInitialState(data.resync);
+                break;
+            case 'initial_state_chunk':
+                this.loadInitialStateChunk(data.elements);
+                break;
+            case 'initial_state_end':
+                this.endInitialState();
                 break;
             case 'draw_update':
                 this.handleRemoteDrawing(data);
                 break;
+            case 'stroke_started':
+                this.handleRemoteStrokeStart(data);
+                break;
+            case 'stroke_extended':
+                this.handleRemoteStrokePoints(data);
+                break;
+            case 'stroke_finished':
+                this.handleRemoteStrokeEnd(data);
+                break;
             case 'element_added':
                 this.handleRemoteElement(data);
                 break;
-            case 'cursor_update':
-                this.updateRemoteCursor(data);
+            case 'elements_batch':
+                this.handleRemoteBatch(data);
+                break;
+            case 'cursors':
+                data.cursors.forEach(cursor => {
+                    if (cursor.user !== window.ROOM_DATA.user) {
+                        this.updateRemoteCursor(cursor);
+                    }
+                });
                 break;
             case 'user_joined':
+                this.updateParticipants();
+                break;
             case 'user_left':
+                this.removeRemoteCursor(data.user);
                 this.updateParticipants();
                 break;
             case 'whiteboard_cleared':
                 this.ctx.clearRect(0, 0, this.canvas.width, this.canvas.height);
                 this.elements = [];
+                this.elementIds = new Set();
                 break;
         }
     }
     
-    loadInitialState(elements) {
-        this.elements = elements;
+    beginInitialState(resync) {
+        this.elements = [];
+        this.elementIds = new Set();
+        if (resync) {
+            // The server dropped updates we were behind on, including
+            // points of strokes still being drawn
+            this.remoteStrokes.clear();
+        }
+        this.redrawCanvas();
+    }
+    
+    loadInitialStateChunk(elements) {
+        // Draw each chunk as it arrives instead of waiting for the whole board
+        elements.forEach(data => {
+            const element = this.fromServerElement(data);
+            if (this.addElement(element)) {
+                this.drawElement(element);
+            }
+        });
+    }
+    
+    endInitialState() {
+        // Chunks arrive viewport first, so restore layer order once complete
+        this.elements.sort((a, b) =>
+            (a.z_index || 0) - (b.z_index || 0) ||
+            (a.created_at || '\uffff').localeCompare(b.created_at || '\uffff')
+        );
         this.redrawCanvas();
     }
     
@@ -692,9 +1216,74 @@ class CollaborativeWhiteboard {
         }
     }
     
+    handleRemoteStrokeStart(data) {
+        const stroke = {
+            type: data.tool,
+            color: data.color,
+            size: data.stroke_width,
+            opacity: data.opacity,
+            path: []
+        };
+        this.remoteStrokes.set(data.stroke_id, stroke);
+        this.extendRemoteStroke(stroke, data.points);
+    }
+    
+    handleRemoteStrokePoints(data) {
+        const stroke = this.remoteStrokes.get(data.stroke_id);
+        if (stroke) {
+            this.extendRemoteStroke(stroke, data.points);
+        }
+    }
+    
+    extendRemoteStroke(stroke, points) {
+        const start = stroke.path.length;
+        for (let i = 0; i + 1 < points.length; i += 2) {
+            stroke.path.push({ x: points[i], y: points[i + 1] });
+        }
+        
+        // Draw only the new segments, joined to the previous last point
+        const from = Math.max(start - 1, 0);
+        if (stroke.path.length - from < 2) return;
+        
+        this.ctx.globalAlpha = stroke.opacity || 1;
+        this.ctx.strokeStyle = stroke.color;
+        this.ctx.lineWidth = stroke.size;
+        
+        this.ctx.beginPath();
+        this.ctx.moveTo(stroke.path[from].x, stroke.path[from].y);
+        for (let i = from + 1; i < stroke.path.length; i++) {
+            this.ctx.lineTo(stroke.path[i].x, stroke.path[i].y);
+        }
+        this.ctx.stroke();
+        
+        this.ctx.globalAlpha = 1;
+    }
+    
+    handleRemoteStrokeEnd(data) {
+        const stroke = this.remoteStrokes.get(data.stroke_id);
+        if (!stroke) return;
+        
+        this.remoteStrokes.delete(data.stroke_id);
+        if (data.element_id) {
+            stroke.id = data.element_id;
+            this.addElement(stroke);
+        }
+    }
+    
     handleRemoteElement(data) {
         // Handle remote shapes, text, etc.
+        let path = null;
+        if (data.path_data) {
+            try {
+                path = JSON.parse(data.path_data);
+            } catch (e) {
+                path = null;
+            }
+        }
         this.addElement({
+            id: data.element_id,
+            path: path,
+            opacity: data.opacity,
             type: data.element_type,
             x: data.x,
             y: data.y,
@@ -702,11 +1291,27 @@ class CollaborativeWhiteboard {
             height: data.height,
             color: data.color,
             size: data.stroke_width,
-            text: data.text_content
+            text: data.text_content,
+            fontSize: data.font_size
         });
         this.redrawCanvas();
     }
     
+    handleRemoteBatch(data) {
+        // Many elements changed through the batch API
+        const replaced = new Set(data.deleted.concat(data.updated.map(element => element.id)));
+        this.elements = this.elements.filter(element => !replaced.has(element.id));
+        replaced.forEach(id => this.elementIds.delete(id));
+        data.updated.concat(data.added).forEach(element => {
+            this.addElement(this.fromServerElement(element));
+        });
+        this.elements.sort((a, b) =>
+            (a.z_index || 0) - (b.z_index || 0) ||
+            (a.created_at || '\uffff').localeCompare(b.created_at || '\uffff')
+        );
+        this.redrawCanvas();
+    }
+    
     updateRemoteCursor(data) {
         const cursors = document.querySelectorAll('.cursor');
         let cursor = document.querySelector(`[data-user="${data.user}"]`);
@@ -725,6 +1330,13 @@ class CollaborativeWhiteboard {
         cursor.style.color = data.color || '#007bff';
     }
     
+    removeRemoteCursor(user) {
+        const cursor = document.querySelector(`[data-user="${user}"]`);
+        if (cursor) {
+            cursor.remove();
+        }
+    }
+    
     updateParticipants() {
         // This would typically fetch from server
         // For now, just update the UI
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Room, RoomParticipant, DrawingElement, Snapshot, Permission
+from .models import Room, RoomParticipant, DrawingElement, RoomOperation, RoomCheckpoint, ElementArchive, ImportJob, Snapshot, Permission
 
 
 @admin.register(Room)
@@ -30,12 +30,48 @@ class DrawingElementAdmin(admin.ModelAdmin):
     readonly_fields = ['id', 'created_at', 'updated_at']
 
 
+@admin.register(RoomOperation)
+class RoomOperationAdmin(admin.ModelAdmin):
+    list_display = ['seq', 'room', 'op_type', 'element_id', 'user', 'created_at']
+    list_filter = ['op_type', 'created_at']
+    search_fields = ['room__name', 'user__username']
+    readonly_fields = ['room', 'seq', 'op_type', 'element_id', 'data', 'user', 'created_at']
+
+
+@admin.register(RoomCheckpoint)
+class RoomCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['seq', 'room', 'element_count', 'created_at']
+    search_fields = ['room__name']
+    exclude = ['data']
+    readonly_fields = ['room', 'seq', 'element_count', 'created_at']
+
+
+@admin.register(ElementArchive)
+class ElementArchiveAdmin(admin.ModelAdmin):
+    list_display = ['room', 'element_count', 'created_at']
+    search_fields = ['room__name']
+    exclude = ['data']
+    readonly_fields = ['room', 'element_count', 'created_at']
+
+
 @admin.register(Snapshot)
 class SnapshotAdmin(admin.ModelAdmin):
-    list_display = ['name', 'room', 'created_by', 'created_at']
+    list_display = ['name', 'room', 'created_by', 'element_count', 'created_at']
     list_filter = ['created_at']
     search_fields = ['name', 'description', 'room__name', 'created_by__username']
-    readonly_fields = ['id', 'created_at']
+    exclude = ['manifest']
+    readonly_fields = ['id', 'created_at', 'element_count', 'revision']
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'room', 'created_by', 'file_format', 'status', 'imported', 'skipped', 'created_at']
+    list_filter = ['status', 'file_format', 'created_at']
+    search_fields = ['room__name', 'created_by__username']
+    readonly_fields = [
+        'id', 'size', 'position', 'rows_read', 'imported', 'skipped', 'errors', 'error',
+        'created_at', 'updated_at', 'finished_at'
+    ]
 
 
 @admin.register(Permission)
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class WhiteboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'whiteboard'
+
+    def ready(self):
+        from .models import Permission, Room, RoomParticipant
+        from .permissions import participant_updated, permission_updated, room_updated
+
+        # Cached permission levels follow the rows they are resolved from
+        for signal in (post_save, post_delete):
+            signal.connect(room_updated, sender=Room)
+            signal.connect(permission_updated, sender=Permission)
+            signal.connect(participant_updated, sender=RoomParticipant)
@@ -0,0 +1,198 @@
+"""Many element changes to one room in one request.
+
+Every operation of a batch is validated before any is applied, with one
+query for the elements it updates or deletes. A valid batch is written in
+one transaction: creates with bulk_create, updates with bulk_update of
+the fields they change and deletes with one UPDATE for all, appended to
+the operation log together. Connected clients get a single elements_batch
+broadcast once it commits.
+"""
+import uuid
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.serializers import ValidationError, as_serializer_error
+
+from .broadcast import room_group
+from .codecs import encode_once
+from .geometry import BOUND_FIELDS, GEOMETRY_FIELDS
+from .models import DrawingElement
+from .oplog import Operation, append, element_data
+from .serializers import BatchElementSerializer, serialize_elements
+
+MAX_OPERATIONS = 1000
+BATCH_SIZE = 500
+
+# Level each kind of operation needs, see whiteboard.permissions
+OP_PERMISSIONS = {'create': 'draw', 'update': 'edit', 'delete': 'edit'}
+
+
+def parse_id(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def validate(room, operations):
+    """Validated operations as (kind, element, fields) and the errors of the
+    invalid ones by index.
+
+    element is the existing element for updates and deletes, fields the
+    validated data for creates and updates.
+    """
+    errors = {}
+    # operation index -> element id, for updates and deletes
+    ids = {}
+    seen = set()
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OP_PERMISSIONS:
+            errors[i] = {'op': [f'Must be one of: {", ".join(OP_PERMISSIONS)}']}
+        elif operation['op'] != 'create':
+            element_id = parse_id(operation.get('id'))
+            if element_id is None:
+                errors[i] = {'id': ['Must be an element id']}
+            elif element_id in seen:
+                errors[i] = {'id': ['Changed by another operation of this batch']}
+            else:
+                ids[i] = element_id
+                seen.add(element_id)
+
+    existing = {}
+    unique = list(seen)
+    for start in range(0, len(unique), BATCH_SIZE):
+        existing.update(
+            DrawingElement.objects.filter(room=room, is_deleted=False)
+            .select_related('created_by').in_bulk(unique[start:start + BATCH_SIZE])
+        )
+
+    # Building a serializer's fields costs more than validating with them,
+    # so one serializer per kind validates every operation
+    serializers = {
+        'create': BatchElementSerializer(),
+        'update': BatchElementSerializer(partial=True),
+    }
+    validated = []
+    for i, operation in enumerate(operations):
+        if i in errors:
+            continue
+        kind = operation['op']
+        element = existing.get(ids[i]) if kind != 'create' else None
+        if kind != 'create' and element is None:
+            errors[i] = {'id': ['No such element in this room']}
+            continue
+        if kind == 'delete':
+            validated.append((kind, element, None))
+            continue
+        try:
+            fields = serializers[kind].run_validation(operation.get('data') or {})
+        except ValidationError as exc:
+            errors[i] = as_serializer_error(exc)
+        else:
+            validated.append((kind, element, fields))
+    return validated, errors
+
+
+def apply(room, user, validated):
+    """Write validated operations; returns the element of each, the
+    serialized created and updated elements by id and the room revision
+    after them"""
+    now = timezone.now()
+    affected = []
+    created, updated, deleted = [], [], []
+    # Changed fields per element, for the update and the operation log
+    changes = {}
+    for kind, element, fields in validated:
+        if kind == 'create':
+            element = DrawingElement(room=room, created_by=user, **fields)
+            created.append(element)
+        elif kind == 'update':
+            for name, value in fields.items():
+                setattr(element, name, value)
+            # The same fields DrawingElement.save adds to update_fields
+            names = set(fields) | {'updated_at'}
+            if GEOMETRY_FIELDS.intersection(fields):
+                names.update(BOUND_FIELDS)
+            if 'path_data' in fields:
+                names.add('path_blob')
+            element.updated_at = now
+            changes[element.id] = names
+            updated.append(element)
+        else:
+            deleted.append(element)
+        affected.append(element)
+
+    for element in created + updated:
+        element.pack_path()
+        element.update_bounds()
+
+    with transaction.atomic():
+        DrawingElement.objects.bulk_create(created, batch_size=BATCH_SIZE)
+
+        # bulk_update needs one field list per call, so group by field set
+        by_fields = {}
+        for element in updated:
+            by_fields.setdefault(tuple(sorted(changes[element.id])), []).append(element)
+        for field_names, elements in by_fields.items():
+            DrawingElement.objects.bulk_update(elements, field_names, batch_size=BATCH_SIZE)
+
+        deleted_ids = [element.id for element in deleted]
+        for start in range(0, len(deleted_ids), BATCH_SIZE):
+            DrawingElement.objects.filter(id__in=deleted_ids[start:start + BATCH_SIZE]).update(
+                is_deleted=True, updated_at=now
+            )
+
+        revision = append(room.id, [
+            Operation('add', element.id, element_data(element), user.id) for element in created
+        ] + [
+            Operation('update', element.id, element_data(element, changes[element.id]), user.id)
+            for element in updated
+        ] + [
+            Operation('delete', element.id, user_id=user.id) for element in deleted
+        ])
+        # Serialized once for both the broadcast and the response, read back
+        # the way the element API returns them
+        element_ids = [element.id for element in created + updated]
+        serialized = {}
+        for start in range(0, len(element_ids), BATCH_SIZE):
+            elements = DrawingElement.objects.filter(id__in=element_ids[start:start + BATCH_SIZE])
+            serialized.update((uuid.UUID(item['id']), item) for item in serialize_elements(elements))
+        data = [serialized[element_id] for element_id in element_ids]
+        transaction.on_commit(partial(
+            notify_batch, room.id, user.username, data[:len(created)], data[len(created):],
+            [str(element.id) for element in deleted], bounds(created + updated + deleted)
+        ))
+    return affected, serialized, revision
+
+
+def bounds(elements):
+    """Box around the elements' bounds, or None without any"""
+    if not elements:
+        return None
+    return [
+        min(element.min_x for element in elements), min(element.min_y for element in elements),
+        max(element.max_x for element in elements), max(element.max_y for element in elements),
+    ]
+
+
+def notify_batch(room_id, username, added, updated, deleted, bbox):
+    """Send every change of a batch to the room's clients in one broadcast"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    message = {
+        'type': 'elements_batch',
+        'added': added,
+        'updated': updated,
+        'deleted': deleted,
+        'user': username,
+    }
+    async_to_sync(channel_layer.group_send)(room_group(room_id), {
+        'type': 'elements_batch',
+        'payload': encode_once(message),
+        'element_ids': deleted + [element['id'] for element in updated],
+        'bbox': bbox,
+    })
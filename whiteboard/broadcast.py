@@ -0,0 +1,30 @@
+"""Channel layer groups the realtime consumers of a room listen on, and
+the messages whiteboard sends them"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.dispatch import Signal
+
+from .codecs import encode_once
+
+# Sent with room_id before a room's elements are cleared or replaced other
+# than through its consumers. Receivers write the changes they still buffer
+# for the room first, so they are not applied on top of the new board. Only
+# receivers in the sending process are reached.
+elements_replacing = Signal()
+
+
+def room_group(room_id):
+    """Group every WhiteboardConsumer of a room joins"""
+    return f'whiteboard_{room_id}'
+
+
+def notify_cleared(room_id, username):
+    """Tell the room's clients that the board was cleared"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    message = {'type': 'whiteboard_cleared', 'user': username}
+    async_to_sync(channel_layer.group_send)(room_group(room_id), {
+        'type': 'whiteboard_cleared',
+        'payload': encode_once(message),
+    })
@@ -0,0 +1,143 @@
+import base64
+import json
+import sys
+import uuid
+from array import array
+
+try:
+    import msgpack
+except ImportError:  # MessagePack support is optional
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # JSON frames are encoded with the json module instead
+    orjson = None
+
+JSON_SUBPROTOCOL = 'whiteboard.json'
+MSGPACK_SUBPROTOCOL = 'whiteboard.msgpack'
+
+# MessagePack extension type carrying a packed little-endian float32 array
+FLOAT32_ARRAY = 1
+
+# Message keys holding flat [x0, y0, x1, y1, ...] coordinate lists
+POINT_KEYS = ('points',)
+
+
+def pack_floats(values):
+    packed = array('f', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_floats(data):
+    values = array('f')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tolist()
+
+
+class JSONCodec:
+    """Plain JSON text frames, the default and fallback encoding.
+
+    Binary values (e.g. compact paths) are sent as base64 strings and UUIDs
+    as strings, as the element API does. Frames are encoded with orjson
+    when it is installed, several times faster for large ones such as
+    initial state chunks.
+    """
+    subprotocol = JSON_SUBPROTOCOL
+
+    def encode(self, message):
+        if orjson is not None:
+            text = orjson.dumps(message, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+            return {'text_data': text}
+        return {'text_data': json.dumps(message, default=self.default)}
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return base64.b64encode(value).decode('ascii')
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    def decode(self, text_data=None, bytes_data=None):
+        data = json.loads(text_data if text_data is not None else bytes_data)
+        if not isinstance(data, dict):
+            raise ValueError('Message must be an object')
+        return data
+
+
+class MessagePackCodec(JSONCodec):
+    """MessagePack binary frames with coordinate lists packed as float32.
+
+    Text frames are still accepted and decoded as JSON.
+    """
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def encode(self, message):
+        return {'bytes_data': msgpack.packb(self.pack_points(message), use_bin_type=True, default=self.default)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return super().decode(text_data)
+        try:
+            data = msgpack.unpackb(bytes_data, raw=False, ext_hook=self.ext_hook)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ValueError(str(e))
+        if not isinstance(data, dict):
+            raise ValueError('Message must be a map')
+        return data
+
+    @staticmethod
+    def pack_points(message):
+        packed = None
+        for key in POINT_KEYS:
+            values = message.get(key)
+            if isinstance(values, list) and values:
+                if packed is None:
+                    packed = dict(message)
+                packed[key] = msgpack.ExtType(FLOAT32_ARRAY, pack_floats(values))
+        return packed if packed is not None else message
+
+    @staticmethod
+    def ext_hook(code, data):
+        if code == FLOAT32_ARRAY:
+            if len(data) % 4:
+                raise ValueError('Truncated float32 array')
+            return unpack_floats(data)
+        return msgpack.ExtType(code, data)
+
+
+def available_codecs():
+    """Codecs supported by this server, in order of preference"""
+    codecs = [JSONCodec()]
+    if msgpack is not None:
+        codecs.insert(0, MessagePackCodec())
+    return codecs
+
+
+CODECS = available_codecs()
+
+
+def encode_once(message):
+    """Encode a message for every available codec, keyed by subprotocol.
+
+    Group broadcasts carry this instead of the raw message so that each
+    recipient only picks the frame matching its own codec.
+    """
+    return {codec.subprotocol: codec.encode(message) for codec in CODECS}
+
+
+def select_codec(requested):
+    """Pick the preferred codec among the subprotocols offered by the client.
+
+    Returns (codec, subprotocol); subprotocol is None when the client did
+    not ask for one, in which case JSON is used.
+    """
+    for codec in CODECS:
+        if codec.subprotocol in requested:
+            return codec, codec.subprotocol
+    return JSONCodec(), None
@@ -0,0 +1,112 @@
+"""Garbage collection of deleted drawing elements.
+
+Deleting, clearing and restoring only mark DrawingElement rows
+is_deleted, so tombstones pile up in the table. Compaction removes the ones
+deleted more than MIN_AGE seconds ago in batches of BATCH_SIZE rows, each in
+its own short transaction with a PAUSE in between, so writers are never
+locked out for long. With ARCHIVE the rows are first stored compressed in
+ElementArchive; the operation log keeps the history either way. Snapshot
+element blobs no snapshot refers to any more are deleted alongside.
+
+`python manage.py compact_elements --forever` repeats this every INTERVAL
+seconds; run one per deployment, not one per server process.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import DrawingElement, ElementArchive
+from .oplog import OP_FIELDS, dump_scene, op_data
+from .snapshots import collect_blobs
+
+logger = logging.getLogger(__name__)
+
+
+def compaction_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_COMPACTION', {}).get(name, default)
+
+
+def tombstones(room_id=None, min_age=None):
+    """Deleted elements old enough to be compacted, oldest first"""
+    if min_age is None:
+        min_age = compaction_setting('MIN_AGE', 3600)
+    queryset = DrawingElement.objects.filter(
+        is_deleted=True,
+        updated_at__lt=timezone.now() - timedelta(seconds=min_age)
+    )
+    if room_id is not None:
+        queryset = queryset.filter(room_id=room_id)
+    return queryset.order_by('updated_at')
+
+
+def archive(element_ids):
+    """Store the given elements in ElementArchive, one row per room"""
+    rows = DrawingElement.objects.filter(id__in=element_ids).values('id', 'room_id', *OP_FIELDS)
+    rooms = {}
+    for row in rows:
+        room_id = row.pop('room_id')
+        rooms.setdefault(room_id, {})[str(row.pop('id'))] = op_data(row)
+    ElementArchive.objects.bulk_create([
+        ElementArchive(room_id=room_id, element_count=len(scene), data=dump_scene(scene))
+        for room_id, scene in rooms.items()
+    ])
+
+
+def compact(room_id=None, min_age=None, batch_size=None, pause=None, archive_rows=None):
+    """Remove old tombstones and return counts of what was done"""
+    batch_size = batch_size or compaction_setting('BATCH_SIZE', 500)
+    pause = compaction_setting('PAUSE', 0.05) if pause is None else pause
+    if archive_rows is None:
+        archive_rows = compaction_setting('ARCHIVE', False)
+
+    started = time.perf_counter()
+    purged = archived = batches = 0
+    queryset = tombstones(room_id, min_age)
+    while True:
+        with transaction.atomic():
+            element_ids = list(queryset.values_list('id', flat=True)[:batch_size])
+            if not element_ids:
+                break
+            if archive_rows:
+                archive(element_ids)
+                archived += len(element_ids)
+            # Only rows still deleted, in case one was changed meanwhile
+            deleted, _ = DrawingElement.objects.filter(id__in=element_ids, is_deleted=True).delete()
+        purged += deleted
+        batches += 1
+        if len(element_ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    return {
+        'purged': purged,
+        'archived': archived,
+        'batches': batches,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def run_forever(interval=None):
+    """Compact, and delete unused snapshot blobs, every INTERVAL seconds"""
+    interval = interval or compaction_setting('INTERVAL', 3600)
+    while True:
+        try:
+            result = compact()
+            if result['purged']:
+                logger.info(
+                    'Compacted %d deleted elements in %.1f s',
+                    result['purged'], result['seconds']
+                )
+            unused = collect_blobs(compaction_setting('MIN_AGE', 3600))
+            if unused:
+                logger.info('Deleted %d snapshot element blobs no longer used', unused)
+        except Exception:
+            logger.exception('Element compaction failed')
+        finally:
+            # Do not hold a connection while waiting for the next run
+            connections.close_all()
+        time.sleep(interval)
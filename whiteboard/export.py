@@ -0,0 +1,175 @@
+"""Streaming exports of a room's live elements.
+
+Elements are read in drawing order with whiteboard.keyset's
+pagination, CHUNK_SIZE at a time, and each chunk is encoded and handed to
+the response before the next one is read, so memory use does not grow with
+the board. NDJSON has one element per line, serialized like the element
+API returns it. SVG draws the elements the way static/js/whiteboard.js
+does, in a viewBox around all of them.
+"""
+import math
+from xml.sax.saxutils import escape, quoteattr
+
+from channels.db import database_sync_to_async
+from django.core.files.storage import default_storage
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .keyset import ELEMENT_ORDER, iter_rows
+from .models import DrawingElement
+from .render import MARGIN, element_points
+from .renderers import json_bytes
+from .serializers import ELEMENT_VALUES, element_representation
+
+CHUNK_SIZE = 1000
+
+# Element columns the SVG export reads
+SVG_FIELDS = ELEMENT_ORDER + (
+    'element_type', 'x', 'y', 'width', 'height', 'color', 'stroke_width',
+    'opacity', 'path_data', 'path_blob', 'text_content', 'font_size',
+    'font_family', 'image',
+)
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'svg': 'image/svg+xml',
+}
+
+
+def live_elements(room_id):
+    return DrawingElement.objects.filter(room_id=room_id, is_deleted=False)
+
+
+def ndjson_chunks(room_id, chunk_size=CHUNK_SIZE):
+    """NDJSON of a room's elements, a chunk of lines at a time"""
+    tz = timezone.get_current_timezone()
+    storage_url = DrawingElement.image.field.storage.url
+    for rows in iter_rows(live_elements(room_id), chunk_size, fields=ELEMENT_VALUES):
+        yield b''.join(
+            json_bytes(element_representation(row, tz=tz, image_url=storage_url)) + b'\n' for row in rows
+        )
+
+
+def number(value):
+    """Coordinate with at most two decimals, as SVG attribute text"""
+    return f'{value or 0:.2f}'.rstrip('0').rstrip('.')
+
+
+def image_url(name):
+    if name.startswith(('/', 'http://', 'https://')):
+        return name
+    return default_storage.url(name)
+
+
+def svg_stroke(element, color, attributes):
+    points = element_points(element)
+    if not points:
+        return ''
+    if len(points) == 2:
+        # A dot, like a one-point stroke on the canvas
+        return (
+            f'<circle cx="{number(points[0])}" cy="{number(points[1])}" '
+            f'r="{number((element["stroke_width"] or 1) / 2)}" fill={color}{attributes}/>'
+        )
+    line = ' '.join(f'{number(points[i])},{number(points[i + 1])}' for i in range(0, len(points), 2))
+    return (
+        f'<polyline points="{line}" fill="none" stroke={color} '
+        f'stroke-linecap="round" stroke-linejoin="round"{attributes}/>'
+    )
+
+
+def svg_element(element, background):
+    """SVG markup of one element row, or '' for one that draws nothing"""
+    element_type = element['element_type']
+    color = quoteattr(element['color'] or '#000000')
+    opacity = element['opacity']
+    attributes = f' stroke-width="{number(element["stroke_width"] or 1)}"'
+    if opacity is not None and opacity < 1:
+        attributes += f' opacity="{number(max(opacity, 0))}"'
+    x, y = element['x'] or 0, element['y'] or 0
+    width, height = element['width'] or 0, element['height'] or 0
+
+    if element_type == 'pen':
+        return svg_stroke(element, color, attributes)
+    if element_type == 'eraser':
+        # Erased pixels show the background on a flat board
+        return svg_stroke(element, quoteattr(background), attributes)
+    if element_type == 'text':
+        if not element['text_content']:
+            return ''
+        # Canvas text is positioned by its left end on the baseline, as in SVG
+        return (
+            f'<text x="{number(x)}" y="{number(y)}" font-size="{number(element["font_size"] or 16)}" '
+            f'font-family={quoteattr(element["font_family"] or "Arial")} fill={color}'
+            f'{attributes}>{escape(element["text_content"])}</text>'
+        )
+    if element_type == 'image':
+        if not element['image']:
+            return ''
+        return (
+            f'<image href={quoteattr(image_url(element["image"]))} x="{number(min(x, x + width))}" '
+            f'y="{number(min(y, y + height))}" width="{number(abs(width))}" height="{number(abs(height))}"/>'
+        )
+    if element_type == 'line':
+        return (
+            f'<line x1="{number(x)}" y1="{number(y)}" x2="{number(x + width)}" y2="{number(y + height)}" '
+            f'stroke={color} stroke-linecap="round"{attributes}/>'
+        )
+    if element_type == 'rectangle':
+        return (
+            f'<rect x="{number(min(x, x + width))}" y="{number(min(y, y + height))}" '
+            f'width="{number(abs(width))}" height="{number(abs(height))}" fill="none" stroke={color}{attributes}/>'
+        )
+    if element_type == 'circle':
+        # Drawn from its center, with the drag distance as radius
+        return (
+            f'<circle cx="{number(x)}" cy="{number(y)}" r="{number(math.hypot(width, height))}" '
+            f'fill="none" stroke={color}{attributes}/>'
+        )
+    return ''
+
+
+def svg_chunks(room, chunk_size=CHUNK_SIZE):
+    """SVG document of a room's elements, a chunk of markup at a time"""
+    box = live_elements(room.id).aggregate(
+        x0=Min('min_x'), y0=Min('min_y'), x1=Max('max_x'), y1=Max('max_y')
+    )
+    if box['x0'] is None:
+        x0, y0, x1, y1 = 0.0, 0.0, 1.0, 1.0
+    else:
+        x0, y0, x1, y1 = box['x0'], box['y0'], box['x1'], box['y1']
+    margin = max(x1 - x0, y1 - y0, 1) * MARGIN
+    x0, y0 = x0 - margin, y0 - margin
+    width, height = x1 + margin - x0, y1 + margin - y0
+    background = room.background_color or '#ffffff'
+
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="{number(x0)} {number(y0)} {number(width)} {number(height)}" '
+        f'width="{number(width)}" height="{number(height)}">\n'
+        f'<title>{escape(room.name)}</title>\n'
+        f'<rect x="{number(x0)}" y="{number(y0)}" width="{number(width)}" height="{number(height)}" '
+        f'fill={quoteattr(background)}/>\n'
+    ).encode()
+    for rows in iter_rows(live_elements(room.id), chunk_size, fields=SVG_FIELDS):
+        markup = []
+        for row in rows:
+            if row['path_blob'] is not None:
+                row['path_blob'] = bytes(row['path_blob'])
+            element = svg_element(row, background)
+            if element:
+                markup.append(element + '\n')
+        yield ''.join(markup).encode()
+    yield b'</svg>\n'
+
+
+async def aiterate(chunks):
+    """Iterate chunks that query the database from async code, reading each
+    in a worker thread, so that ASGI servers stream them instead of
+    collecting them all first"""
+    chunks = iter(chunks)
+    while True:
+        chunk = await database_sync_to_async(next)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
@@ -0,0 +1,96 @@
+import json
+import math
+
+from django.db.models import Q
+
+# Element fields that affect its bounding box
+GEOMETRY_FIELDS = {
+    'element_type', 'x', 'y', 'width', 'height', 'stroke_width',
+    'path_data', 'text_content', 'font_size',
+}
+
+BOUND_FIELDS = ['min_x', 'min_y', 'max_x', 'max_y']
+
+
+def parse_bbox(value):
+    """Parse 'x0,y0,x1,y1' (or a 4-item sequence) into a normalized box"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    try:
+        x0, y0, x1, y1 = (float(part) for part in value)
+    except (TypeError, ValueError):
+        return None
+    if not all(math.isfinite(v) for v in (x0, y0, x1, y1)):
+        return None
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def bbox_q(bbox):
+    """Elements whose bounding box intersects the given box.
+
+    element_live_bbox_idx narrows this down by min_x <= x1 only; the other
+    three conditions filter the rows that range yields.
+    """
+    x0, y0, x1, y1 = bbox
+    return Q(min_x__lte=x1, max_x__gte=x0, min_y__lte=y1, max_y__gte=y0)
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def path_points(path_data):
+    """Flat [x0, y0, x1, y1, ...] list from a path_data JSON string"""
+    try:
+        points = json.loads(path_data) if path_data else []
+    except ValueError:
+        return []
+    flat = []
+    for point in points if isinstance(points, list) else []:
+        try:
+            flat.extend((float(point['x']), float(point['y'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return flat
+
+
+def points_bounds(points, padding=0):
+    xs = points[0::2]
+    ys = points[1::2]
+    return min(xs) - padding, min(ys) - padding, max(xs) + padding, max(ys) + padding
+
+
+def element_bounds(element_type='pen', x=0, y=0, width=0, height=0, stroke_width=0,
+                   path_data='', text_content='', font_size=16, points=None):
+    """Bounding box (min_x, min_y, max_x, max_y) of an element as drawn by the client"""
+    x = float(x or 0)
+    y = float(y or 0)
+    width = float(width or 0)
+    height = float(height or 0)
+    padding = float(stroke_width or 0) / 2
+
+    if element_type in ('pen', 'eraser'):
+        if points is None:
+            points = path_points(path_data)
+        if points:
+            return points_bounds(points, padding)
+        return x - padding, y - padding, x + padding, y + padding
+
+    if element_type == 'circle':
+        # Drawn from its center, with the drag distance as radius
+        radius = math.hypot(width, height) + padding
+        return x - radius, y - radius, x + radius, y + radius
+
+    if element_type == 'text':
+        # Text is drawn from its baseline; estimate the extent from font size
+        size = float(font_size or 16)
+        length = len(text_content or '')
+        return x, y - size, x + 0.6 * size * length, y + 0.25 * size
+
+    # line, rectangle and image span x..x+width, y..y+height
+    return (
+        min(x, x + width) - padding, min(y, y + height) - padding,
+        max(x, x + width) + padding, max(y, y + height) + padding,
+    )
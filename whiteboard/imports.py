@@ -0,0 +1,279 @@
+"""Bulk import of elements into a room from a file.
+
+Files are NDJSON with one element per line, like the NDJSON export, or a
+snapshot file: a JSON array of elements, like Snapshot.elements_data. Both
+are read incrementally. Every element is validated like the element API
+validates it. Invalid rows are skipped; the first MAX_ERRORS are recorded
+with their row numbers. Elements get new ids, and the importing user as
+creator; created_at is kept, so drawing order is too.
+
+Valid elements are inserted BATCH_SIZE at a time with bulk_create. Each
+batch is committed in its own transaction together with the job's
+progress, so an interrupted job resumes after its last committed batch.
+The room is checkpointed and its clients reload the board once a job is
+done.
+"""
+import asyncio
+import codecs
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.serializers import ValidationError, as_serializer_error
+
+from .models import DrawingElement, ImportJob
+from .oplog import Operation, append, checkpoint, element_data
+from .restore import notify_reload
+from .serializers import BatchElementSerializer
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1 << 16
+
+# A running job whose progress has not moved for this long is taken to be
+# interrupted and may be resumed
+STALE_AFTER = timedelta(minutes=5)
+
+# ImportJob fields saved with every batch
+PROGRESS_FIELDS = ('size', 'position', 'rows_read', 'imported', 'skipped', 'errors')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def import_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_IMPORTS', {}).get(name, default)
+
+
+def detect_format(file):
+    """'snapshot' for a file starting with a JSON array, else 'ndjson'"""
+    start = file.read(READ_SIZE).lstrip()
+    file.seek(0)
+    return 'snapshot' if start.startswith(b'[') else 'ndjson'
+
+
+def ndjson_rows(file):
+    """(element, error) for every line of a binary NDJSON file; a blank line
+    is a row with neither"""
+    for line in file:
+        if not line.strip():
+            yield None, None
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as exc:
+            yield None, f'Invalid JSON: {exc}'
+
+
+def array_rows(file):
+    """(element, None) for every item of a JSON array in a binary file,
+    decoded a READ_SIZE chunk at a time.
+
+    Unlike a bad NDJSON line, malformed JSON here leaves no way to find the
+    next item, so it raises ValueError.
+    """
+    reader = codecs.getreader('utf-8')(file)
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    state = 'start'
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+        if pos == len(buffer) or state == 'item':
+            if pos == len(buffer) and eof:
+                raise ValueError('Unexpected end of file')
+            if state == 'item':
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                else:
+                    yield item, None
+                    pos, state = end, 'next'
+                    continue
+            chunk = reader.read(READ_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        char = buffer[pos]
+        if state == 'start':
+            if char != '[':
+                raise ValueError('A snapshot file must hold a JSON array')
+            pos, state = pos + 1, 'first'
+        elif char == ']' and state in ('first', 'next'):
+            return
+        elif state == 'first':
+            state = 'item'
+        elif char == ',':
+            pos, state = pos + 1, 'item'
+        else:
+            raise ValueError(f'Expected , or ] but found {char!r}')
+
+
+def rows(file, file_format):
+    if file_format == 'snapshot':
+        return array_rows(file)
+    return ndjson_rows(file)
+
+
+def element_fields(serializer, data):
+    """Model fields of an element from a serialized one; raises ValidationError"""
+    if not isinstance(data, dict):
+        raise ValidationError({'non_field_errors': ['Each row must be a JSON object']})
+    data = dict(data)
+    # Images are referenced by their stored name, not uploaded again
+    image = data.pop('image', None)
+    fields = dict(serializer.run_validation(data))
+    if isinstance(image, str) and image:
+        if image.startswith(settings.MEDIA_URL):
+            image = image[len(settings.MEDIA_URL):]
+        fields['image'] = image
+    # created_at is read-only in the API but keeps the drawing order here
+    created_at = parse_datetime(data['created_at']) if isinstance(data.get('created_at'), str) else None
+    if created_at is not None:
+        fields['created_at'] = created_at
+    return fields
+
+
+def open_source(job):
+    """The job's file, opened for binary reading, and its size"""
+    if job.upload:
+        return job.upload.open('rb'), job.upload.size
+    return open(job.path, 'rb'), os.path.getsize(job.path)
+
+
+def claim(job_id):
+    """Mark a job running unless it is done or running elsewhere; returns it or None"""
+    claimed = ImportJob.objects.filter(
+        Q(status__in=['pending', 'failed'])
+        | Q(status='running', updated_at__lt=timezone.now() - STALE_AFTER),
+        id=job_id,
+    ).update(status='running', error='', updated_at=timezone.now())
+    return ImportJob.objects.select_related('room', 'created_by').get(id=job_id) if claimed else None
+
+
+def save_batch(job, elements, *fields):
+    """Insert a batch of elements and commit it with the job's progress and
+    any other fields given"""
+    with transaction.atomic():
+        DrawingElement.objects.bulk_create(elements, batch_size=500)
+        append(job.room_id, [
+            Operation('add', element.id, element_data(element), job.created_by_id)
+            for element in elements
+        ], checkpoints=False)
+        ImportJob.objects.filter(id=job.id).update(
+            **{name: getattr(job, name) for name in PROGRESS_FIELDS + fields}, updated_at=timezone.now()
+        )
+
+
+def run_job(job_id, batch_size=None, report=None, loop=None):
+    """Import, or resume importing, the file of a job; returns the job.
+
+    report is called with the job after every committed batch. loop is the
+    server's event loop, for a job run in a background thread.
+    """
+    job = claim(job_id)
+    if job is None:
+        return ImportJob.objects.get(id=job_id)
+    batch_size = batch_size or import_setting('BATCH_SIZE', 1000)
+    max_errors = import_setting('MAX_ERRORS', 100)
+    # One serializer validates every row; building its fields costs more
+    # than validating with them
+    serializer = BatchElementSerializer()
+
+    try:
+        file, job.size = open_source(job)
+        with file:
+            batch = []
+            row_number = 0
+            for data, error in rows(file, job.file_format):
+                row_number += 1
+                # Rows before the job's progress were committed by an earlier run
+                if row_number <= job.rows_read:
+                    continue
+                if data is not None and error is None:
+                    try:
+                        fields = element_fields(serializer, data)
+                    except ValidationError as exc:
+                        error = as_serializer_error(exc)
+                    else:
+                        element = DrawingElement(room_id=job.room_id, created_by_id=job.created_by_id, **fields)
+                        element.pack_path()
+                        element.update_bounds()
+                        batch.append(element)
+                if error is not None:
+                    job.skipped += 1
+                    if len(job.errors) < max_errors:
+                        job.errors.append({'row': row_number, 'errors': error})
+
+                if len(batch) >= batch_size:
+                    job.rows_read, job.imported = row_number, job.imported + len(batch)
+                    job.position = file.tell()
+                    save_batch(job, batch)
+                    batch = []
+                    if report is not None:
+                        report(job)
+
+            job.rows_read, job.imported = row_number, job.imported + len(batch)
+            job.position, job.status, job.finished_at = job.size, 'done', timezone.now()
+            save_batch(job, batch, 'status', 'finished_at')
+    except Exception as exc:
+        # Committed batches stay; the job resumes after the last of them
+        logger.exception('Import %s failed', job.id)
+        ImportJob.objects.filter(id=job.id).update(status='failed', error=str(exc) or repr(exc))
+        job.refresh_from_db()
+        return job
+
+    if report is not None:
+        report(job)
+    if job.upload:
+        job.upload.delete(save=False)
+        ImportJob.objects.filter(id=job.id).update(upload='')
+    checkpoint(job.room_id)
+    notify_reload(job.room_id, job.created_by.username, loop)
+    return job
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=import_setting('WORKERS', 1), thread_name_prefix='element-import'
+            )
+        return _pool
+
+
+async def running_loop():
+    return asyncio.get_running_loop()
+
+
+def serving_loop():
+    """The event loop serving the current request under ASGI, else None"""
+    # From a sync view under ASGI, async_to_sync runs on the server's loop;
+    # elsewhere it runs on a new loop, closed once it returns
+    loop = async_to_sync(running_loop)()
+    return None if loop.is_closed() else loop
+
+
+def submit(job_id):
+    """Run a job in a background thread of this process"""
+    loop = serving_loop()
+
+    def run():
+        try:
+            run_job(job_id, loop=loop)
+        finally:
+            # Connections are per thread; do not keep this one open between jobs
+            connections.close_all()
+    return pool().submit(run)
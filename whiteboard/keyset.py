@@ -0,0 +1,34 @@
+"""Keyset pagination over a room's elements in drawing order.
+
+Each page is its own bounded query, filtered to the rows after the last
+one of the previous page, so no cursor stays open between pages and
+callers may hop threads or await in between.
+"""
+from django.db.models import Q
+
+# Keyset order; id breaks ties so pages never overlap or skip rows
+ELEMENT_ORDER = ('z_index', 'created_at', 'id')
+
+
+def after(row):
+    """Rows that sort after the given one in ELEMENT_ORDER"""
+    return (
+        Q(z_index__gt=row['z_index'])
+        | Q(z_index=row['z_index'], created_at__gt=row['created_at'])
+        | Q(z_index=row['z_index'], created_at=row['created_at'], id__gt=row['id'])
+    )
+
+
+def iter_rows(queryset, chunk_size, fields):
+    """Yield lists of values() rows using keyset pagination; fields must
+    include the ELEMENT_ORDER columns"""
+    queryset = queryset.order_by(*ELEMENT_ORDER).values(*fields)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(after(last))
+        rows = list(page[:chunk_size])
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:48
+
+import json
+import math
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Frozen copies of whiteboard.geometry as of this migration, so later changes
+# to the app do not change what it does
+
+def path_points(path_data):
+    try:
+        points = json.loads(path_data) if path_data else []
+    except ValueError:
+        return []
+    flat = []
+    for point in points if isinstance(points, list) else []:
+        try:
+            flat.extend((float(point['x']), float(point['y'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return flat
+
+
+def element_bounds(element_type='pen', x=0, y=0, width=0, height=0, stroke_width=0,
+                   path_data='', text_content='', font_size=16):
+    x = float(x or 0)
+    y = float(y or 0)
+    width = float(width or 0)
+    height = float(height or 0)
+    padding = float(stroke_width or 0) / 2
+
+    if element_type in ('pen', 'eraser'):
+        points = path_points(path_data)
+        if points:
+            xs = points[0::2]
+            ys = points[1::2]
+            return min(xs) - padding, min(ys) - padding, max(xs) + padding, max(ys) + padding
+        return x - padding, y - padding, x + padding, y + padding
+
+    if element_type == 'circle':
+        radius = math.hypot(width, height) + padding
+        return x - radius, y - radius, x + radius, y + radius
+
+    if element_type == 'text':
+        size = float(font_size or 16)
+        length = len(text_content or '')
+        return x, y - size, x + 0.6 * size * length, y + 0.25 * size
+
+    return (
+        min(x, x + width) - padding, min(y, y + height) - padding,
+        max(x, x + width) + padding, max(y, y + height) + padding,
+    )
+
+
+def compute_bounds(apps, schema_editor):
+    DrawingElement = apps.get_model('whiteboard', 'DrawingElement')
+    elements = DrawingElement.objects.order_by('pk')
+    batch = list(elements[:1000])
+    while batch:
+        for element in batch:
+            element.min_x, element.min_y, element.max_x, element.max_y = element_bounds(
+                element_type=element.element_type,
+                x=element.x,
+                y=element.y,
+                width=element.width,
+                height=element.height,
+                stroke_width=element.stroke_width,
+                path_data=element.path_data,
+                text_content=element.text_content,
+                font_size=element.font_size,
+            )
+        DrawingElement.objects.bulk_update(batch, ['min_x', 'min_y', 'max_x', 'max_y'])
+        batch = list(elements.filter(pk__gt=batch[-1].pk)[:1000])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whiteboard', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drawingelement',
+            name='max_x',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='drawingelement',
+            name='max_y',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='drawingelement',
+            name='min_x',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='drawingelement',
+            name='min_y',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='drawingelement',
+            index=models.Index(fields=['room', 'min_x', 'min_y'], name='element_bbox_idx'),
+        ),
+        migrations.RunPython(compute_bounds, migrations.RunPython.noop),
+    ]
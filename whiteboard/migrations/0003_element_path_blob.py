@@ -0,0 +1,110 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:20
+
+import json
+
+from django.db import migrations, models
+
+
+# Frozen copies of whiteboard.paths (version 1, pure Python) as of this
+# migration, so later changes to the app do not change what it does
+
+FORMAT_VERSION = 1
+SCALE = 2
+
+
+def path_points(path_data):
+    try:
+        points = json.loads(path_data) if path_data else []
+    except ValueError:
+        return []
+    flat = []
+    for point in points if isinstance(points, list) else []:
+        try:
+            flat.extend((float(point['x']), float(point['y'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return flat
+
+
+def pack_path_data(path_data):
+    points = path_points(path_data)
+    if not points:
+        return None
+    factor = 10 ** SCALE
+    out = bytearray((FORMAT_VERSION, SCALE))
+    previous = [0, 0]
+    for i, value in enumerate(points):
+        quantized = round(value * factor)
+        delta = quantized - previous[i % 2]
+        delta = (delta << 1) ^ (delta >> 63)
+        previous[i % 2] = quantized
+        while delta > 0x7f:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def path_json(data):
+    data = bytes(data)
+    if len(data) < 2 or data[0] != FORMAT_VERSION:
+        raise ValueError('Unsupported path encoding')
+    factor = 10 ** data[1]
+    values = []
+    previous = [0, 0]
+    value = shift = 0
+    for byte in data[2:]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        axis = len(values) % 2
+        previous[axis] += (value >> 1) ^ -(value & 1)
+        values.append(previous[axis] / factor)
+        value = shift = 0
+    return json.dumps([{'x': values[i], 'y': values[i + 1]} for i in range(0, len(values), 2)])
+
+
+def pack_paths(apps, schema_editor):
+    DrawingElement = apps.get_model('whiteboard', 'DrawingElement')
+    elements = DrawingElement.objects.exclude(path_data='').only('path_data').order_by('pk')
+    batch = list(elements[:1000])
+    while batch:
+        last = batch[-1].pk
+        packed = []
+        for element in batch:
+            element.path_blob = pack_path_data(element.path_data)
+            if element.path_blob is not None:
+                element.path_data = ''
+                packed.append(element)
+        DrawingElement.objects.bulk_update(packed, ['path_data', 'path_blob'])
+        batch = list(elements.filter(pk__gt=last)[:1000])
+
+
+def unpack_paths(apps, schema_editor):
+    DrawingElement = apps.get_model('whiteboard', 'DrawingElement')
+    elements = DrawingElement.objects.exclude(path_blob=None).only('path_blob').order_by('pk')
+    batch = list(elements[:1000])
+    while batch:
+        last = batch[-1].pk
+        for element in batch:
+            element.path_data = path_json(element.path_blob)
+            element.path_blob = None
+        DrawingElement.objects.bulk_update(batch, ['path_data', 'path_blob'])
+        batch = list(elements.filter(pk__gt=last)[:1000])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whiteboard', '0002_element_bounds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drawingelement',
+            name='path_blob',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(pack_paths, unpack_paths),
+    ]
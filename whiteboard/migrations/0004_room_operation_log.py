@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:05
+
+import base64
+import datetime
+import json
+import uuid
+import zlib
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Frozen copies of whiteboard.oplog as of this migration, so later changes
+# to the app do not change what it does
+
+OP_FIELDS = (
+    'element_type', 'x', 'y', 'width', 'height', 'color', 'stroke_width',
+    'opacity', 'path_data', 'path_blob', 'text_content', 'font_size',
+    'font_family', 'z_index', 'created_by_id', 'created_at',
+)
+
+
+def op_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def op_data(fields):
+    return {name: op_value(value) for name, value in fields.items() if name in OP_FIELDS}
+
+
+def dump_scene(scene):
+    return zlib.compress(json.dumps(scene, separators=(',', ':')).encode(), 6)
+
+
+def checkpoint_existing(apps, schema_editor):
+    # The log starts now, so seed each room with its current scene as seq 0
+    Room = apps.get_model('whiteboard', 'Room')
+    DrawingElement = apps.get_model('whiteboard', 'DrawingElement')
+    RoomCheckpoint = apps.get_model('whiteboard', 'RoomCheckpoint')
+    for room_id in Room.objects.values_list('id', flat=True).iterator():
+        rows = DrawingElement.objects.filter(room_id=room_id, is_deleted=False).values('id', *OP_FIELDS)
+        scene = {str(row.pop('id')): op_data(row) for row in rows.iterator(chunk_size=2000)}
+        RoomCheckpoint.objects.create(
+            room_id=room_id, seq=0, element_count=len(scene), data=dump_scene(scene)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whiteboard', '0003_element_path_blob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='revision',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='RoomCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('element_count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='whiteboard.room')),
+            ],
+            options={
+                'ordering': ['room', '-seq'],
+                'unique_together': {('room', 'seq')},
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('op_type', models.CharField(choices=[('add', 'Add'), ('update', 'Update'), ('delete', 'Delete'), ('clear', 'Clear')], max_length=10)),
+                ('element_id', models.UUIDField(blank=True, null=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operations', to='whiteboard.room')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['room', 'seq'],
+                'unique_together': {('room', 'seq')},
+            },
+        ),
+        migrations.RunPython(checkpoint_existing, migrations.RunPython.noop),
+    ]
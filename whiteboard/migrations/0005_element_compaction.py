@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:08
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whiteboard', '0004_room_operation_log'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElementArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('element_count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='drawingelement',
+            name='element_bbox_idx',
+        ),
+        migrations.AddIndex(
+            model_name='drawingelement',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['room', 'z_index', 'created_at', 'id'], name='element_live_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drawingelement',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['room', 'min_x', 'min_y'], name='element_live_bbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drawingelement',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['updated_at'], name='element_tombstone_idx'),
+        ),
+        migrations.AddField(
+            model_name='elementarchive',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='element_archives', to='whiteboard.room'),
+        ),
+    ]
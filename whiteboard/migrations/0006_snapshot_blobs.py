@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:18
+
+import hashlib
+import json
+import uuid
+import zlib
+
+import django.utils.timezone
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+
+# Frozen copies of whiteboard.snapshots as of this migration, so later
+# changes to the app do not change what it does
+
+DIGEST_SIZE = 20
+RECORD_SIZE = 16 + DIGEST_SIZE
+
+
+def element_json(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder).encode()
+
+
+def element_hash(payload):
+    return hashlib.blake2b(payload, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def pack_manifest(entries):
+    return b''.join(uuid.UUID(str(element_id)).bytes + bytes.fromhex(digest) for element_id, digest in entries)
+
+
+def unpack_manifest(data):
+    data = bytes(data)
+    return [
+        (str(uuid.UUID(bytes=data[i:i + 16])), data[i + 16:i + RECORD_SIZE].hex())
+        for i in range(0, len(data), RECORD_SIZE)
+    ]
+
+
+def split_snapshots(apps, schema_editor):
+    # Move each snapshot's elements into shared blobs behind a manifest
+    Snapshot = apps.get_model('whiteboard', 'Snapshot')
+    ElementBlob = apps.get_model('whiteboard', 'ElementBlob')
+    for snapshot in Snapshot.objects.filter(manifest=None).exclude(elements_data='').iterator():
+        entries = []
+        blobs = {}
+        for data in json.loads(snapshot.elements_data):
+            payload = element_json(data)
+            digest = element_hash(payload)
+            entries.append((data['id'], digest))
+            blobs[digest] = payload
+        ElementBlob.objects.bulk_create([
+            ElementBlob(hash=digest, data=zlib.compress(payload, 6), size=len(payload))
+            for digest, payload in blobs.items()
+        ], batch_size=500, ignore_conflicts=True)
+        snapshot.manifest = pack_manifest(entries)
+        snapshot.element_count = len(entries)
+        snapshot.elements_data = ''
+        snapshot.save(update_fields=['manifest', 'element_count', 'elements_data'])
+
+
+def join_snapshots(apps, schema_editor):
+    Snapshot = apps.get_model('whiteboard', 'Snapshot')
+    ElementBlob = apps.get_model('whiteboard', 'ElementBlob')
+    for snapshot in Snapshot.objects.exclude(manifest=None).iterator():
+        hashes = [digest for _, digest in unpack_manifest(snapshot.manifest)]
+        blobs = ElementBlob.objects.in_bulk(set(hashes))
+        snapshot.elements_data = '[' + ','.join(
+            zlib.decompress(bytes(blobs[digest].data)).decode() for digest in hashes if digest in blobs
+        ) + ']'
+        snapshot.manifest = None
+        snapshot.save(update_fields=['manifest', 'elements_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whiteboard', '0005_element_compaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElementBlob',
+            fields=[
+                ('hash', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='snapshot',
+            name='element_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='snapshot',
+            name='manifest',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='snapshot',
+            name='revision',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='snapshot',
+            name='elements_data',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(split_snapshots, join_snapshots),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whiteboard', '0006_snapshot_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='thumbnails/rooms/'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='thumbnail_revision',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -2,6 +2,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 import uuid
+from . import presence
+from .geometry import BOUND_FIELDS, GEOMETRY_FIELDS, element_bounds
+from .paths import decode_path, pack_path_data, path_json
 
 
 class Room(models.Model):
@@ -17,16 +20,28 @@ class Room(models.Model):
     max_users = models.IntegerField(default=50)
     background_color = models.CharField(max_length=7, default='#ffffff')
     grid_enabled = models.BooleanField(default=False)
+    # Sequence number of the latest RoomOperation
+    revision = models.BigIntegerField(default=0)
+    # Preview image and the revision it shows, see whiteboard.thumbnails
+    thumbnail = models.ImageField(upload_to='thumbnails/rooms/', blank=True, null=True)
+    thumbnail_revision = models.BigIntegerField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Room lists are ordered newest first; the anonymous one only
+            # shows public rooms
+            models.Index(fields=['-created_at'], name='room_created_idx'),
+            models.Index(fields=['is_public', '-created_at'], name='room_public_created_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
     @property
     def active_users_count(self):
-        return self.participants.filter(is_active=True).count()
+        # Kept by the realtime consumer, see whiteboard.presence
+        return presence.count(self.id)
 
 
 class RoomParticipant(models.Model):
@@ -70,6 +85,12 @@ class DrawingElement(models.Model):
     width = models.FloatField(default=0)
     height = models.FloatField(default=0)
     
+    # Bounding box, derived from the fields above on every save
+    min_x = models.FloatField(default=0)
+    min_y = models.FloatField(default=0)
+    max_x = models.FloatField(default=0)
+    max_y = models.FloatField(default=0)
+    
     # Style properties
     color = models.CharField(max_length=7, default='#000000')
     stroke_width = models.FloatField(default=2)
@@ -77,6 +98,9 @@ class DrawingElement(models.Model):
     
     # Path data for pen/brush strokes
     path_data = models.TextField(blank=True)  # JSON string of path points
+    # Same points in the compact encoding of whiteboard.paths; once set,
+    # path_data is left empty
+    path_blob = models.BinaryField(blank=True, null=True)
     
     # Text content
     text_content = models.TextField(blank=True)
@@ -94,9 +118,145 @@ class DrawingElement(models.Model):
     
     class Meta:
         ordering = ['z_index', 'created_at']
+        # Deleted rows linger until compaction (whiteboard.compaction), so the
+        # hot indexes only cover live ones
+        indexes = [
+            # Initial state and element lists, in keyset order
+            models.Index(
+                fields=['room', 'z_index', 'created_at', 'id'],
+                condition=models.Q(is_deleted=False),
+                name='element_live_order_idx',
+            ),
+            # Viewport queries: room equality plus a range on min_x. A B-tree
+            # can range-scan only its first range column, so min_y and the
+            # max_x/max_y bounds are checked on each row the min_x range
+            # yields; this is not a spatial index, and a room whose elements
+            # all lie left of the viewport's right edge is scanned in full
+            models.Index(
+                fields=['room', 'min_x', 'min_y'],
+                condition=models.Q(is_deleted=False),
+                name='element_live_bbox_idx',
+            ),
+            # Tombstones due for compaction
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(is_deleted=True),
+                name='element_tombstone_idx',
+            ),
+        ]
     
     def __str__(self):
         return f'{self.element_type} by {self.created_by.username} in {self.room.name}'
+    
+    def save(self, *args, **kwargs):
+        self.pack_path()
+        self.update_bounds()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and GEOMETRY_FIELDS.intersection(update_fields):
+            kwargs['update_fields'] = set(update_fields) | set(BOUND_FIELDS)
+            if 'path_data' in update_fields:
+                kwargs['update_fields'].add('path_blob')
+        super().save(*args, **kwargs)
+    
+    def pack_path(self):
+        """Move a JSON path_data into path_blob; bulk_create/bulk_update callers must call this"""
+        if self.path_data:
+            self.path_blob = pack_path_data(self.path_data)
+            if self.path_blob is not None:
+                self.path_data = ''
+    
+    def points(self):
+        """Flat [x0, y0, x1, y1, ...] list of an encoded path, or None"""
+        if self.path_blob:
+            return decode_path(self.path_blob)
+        return None
+    
+    def legacy_path_data(self):
+        """path_data in the JSON form clients have always received"""
+        if self.path_blob:
+            return path_json(self.path_blob)
+        return self.path_data
+    
+    def update_bounds(self):
+        """Recompute the bounding box; bulk_create/bulk_update callers must call this"""
+        self.min_x, self.min_y, self.max_x, self.max_y = element_bounds(
+            element_type=self.element_type,
+            x=self.x,
+            y=self.y,
+            width=self.width,
+            height=self.height,
+            stroke_width=self.stroke_width,
+            path_data=self.path_data,
+            text_content=self.text_content,
+            font_size=self.font_size,
+            points=self.points(),
+        )
+
+
+class RoomOperation(models.Model):
+    """Append-only log of changes to a room's elements"""
+    OPERATION_TYPES = [
+        ('add', 'Add'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+        ('clear', 'Clear'),
+    ]
+    
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='operations')
+    seq = models.BigIntegerField()  # Per-room sequence, see Room.revision
+    op_type = models.CharField(max_length=10, choices=OPERATION_TYPES)
+    element_id = models.UUIDField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)  # Element fields set by the operation
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['room', 'seq']
+        unique_together = ['room', 'seq']
+    
+    def __str__(self):
+        return f'#{self.seq} {self.op_type} in {self.room_id}'
+
+
+class RoomCheckpoint(models.Model):
+    """Compressed scene of a room after applying operations up to seq"""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='checkpoints')
+    seq = models.BigIntegerField()
+    element_count = models.IntegerField(default=0)
+    data = models.BinaryField()  # zlib compressed JSON, see whiteboard.oplog
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['room', '-seq']
+        unique_together = ['room', 'seq']
+    
+    def __str__(self):
+        return f'Checkpoint #{self.seq} of {self.room_id}'
+
+
+class ElementArchive(models.Model):
+    """Deleted elements removed from DrawingElement by compaction"""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='element_archives')
+    element_count = models.IntegerField(default=0)
+    data = models.BinaryField()  # zlib compressed JSON of element id -> fields
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f'{self.element_count} archived elements of {self.room_id}'
+
+
+class ElementBlob(models.Model):
+    """Serialized element, stored once for every snapshot it appears in"""
+    hash = models.CharField(max_length=40, primary_key=True)  # BLAKE2b of the JSON
+    data = models.BinaryField()  # zlib compressed JSON
+    size = models.IntegerField(default=0)  # Uncompressed bytes
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return self.hash
 
 
 class Snapshot(models.Model):
@@ -108,8 +268,14 @@ class Snapshot(models.Model):
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(default=timezone.now)
     
-    # Snapshot data
-    elements_data = models.TextField()  # JSON string of all elements
+    # Snapshot data, as a manifest of ElementBlob hashes in drawing order
+    # (see whiteboard.snapshots); snapshots saved before manifests existed
+    # may still have their elements as one JSON string in elements_data
+    elements_data = models.TextField(blank=True)
+    manifest = models.BinaryField(blank=True, null=True)
+    element_count = models.IntegerField(default=0)
+    # Room.revision the snapshot was taken at; None for converted ones
+    revision = models.BigIntegerField(null=True, blank=True)
     thumbnail = models.ImageField(upload_to='snapshots/', blank=True, null=True)
     
     class Meta:
@@ -119,6 +285,55 @@ class Snapshot(models.Model):
         return f'Snapshot: {self.name} - {self.room.name}'
 
 
+class ImportJob(models.Model):
+    """Bulk import of elements into a room from a file, see whiteboard.imports"""
+    FORMATS = [
+        ('ndjson', 'NDJSON'),
+        ('snapshot', 'Snapshot'),
+    ]
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='imports')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    # An uploaded file, or the path of a local one for the import command
+    upload = models.FileField(upload_to='imports/', blank=True)
+    path = models.CharField(max_length=500, blank=True)
+    file_format = models.CharField(max_length=10, choices=FORMATS)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    
+    # Progress, committed with every batch so a job resumes after the last one
+    size = models.BigIntegerField(default=0)  # Bytes
+    position = models.BigIntegerField(default=0)  # Bytes read, roughly
+    rows_read = models.BigIntegerField(default=0)
+    imported = models.BigIntegerField(default=0)
+    skipped = models.BigIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)  # The first invalid rows
+    error = models.TextField(blank=True)  # Why a failed job stopped
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f'Import {self.id} into {self.room_id} ({self.status})'
+    
+    @property
+    def progress(self):
+        """Fraction of the file read"""
+        if self.status == 'done':
+            return 1.0
+        return min(self.position / self.size, 1.0) if self.size else 0.0
+
+
 class Permission(models.Model):
     """Room permissions for users"""
     PERMISSION_TYPES = [
@@ -0,0 +1,234 @@
+"""Per-room operation log.
+
+DrawingElement rows remain the materialized current scene that queries
+run against. Every change to them is also appended to RoomOperation in the
+same transaction, numbered by Room.revision, so the scene at any revision
+can be rebuilt from the latest RoomCheckpoint before it plus the
+operations that follow, and clients can catch up from a known revision.
+
+Checkpoints are taken in a background thread of the process that crossed
+CHECKPOINT_INTERVAL, so rebuilding a large scene never holds up the write
+that triggered it. One lost at shutdown is only a longer replay; the next
+interval takes another.
+"""
+import base64
+import datetime
+import json
+import logging
+import threading
+import uuid
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+
+from .models import Room, RoomCheckpoint, RoomOperation
+from .paths import path_json
+
+# Element fields recorded by operations and checkpoints
+OP_FIELDS = (
+    'element_type', 'x', 'y', 'width', 'height', 'color', 'stroke_width',
+    'opacity', 'path_data', 'path_blob', 'text_content', 'font_size',
+    'font_family', 'z_index', 'created_by_id', 'created_at',
+)
+
+logger = logging.getLogger(__name__)
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+# Rooms with a checkpoint queued in this process and not started yet
+_queued = set()
+
+Operation = namedtuple('Operation', 'op_type element_id data user_id', defaults=(None, None, None))
+
+
+def oplog_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_OPLOG', {}).get(name, default)
+
+
+def op_value(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode('ascii')
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def op_data(fields):
+    """JSON-safe subset of element fields for an operation"""
+    if 'created_by' in fields and 'created_by_id' not in fields:
+        fields = {**fields, 'created_by_id': getattr(fields['created_by'], 'pk', fields['created_by'])}
+    return {name: op_value(value) for name, value in fields.items() if name in OP_FIELDS}
+
+
+def element_data(element, names=OP_FIELDS):
+    """Operation data of an element instance, optionally limited to some fields"""
+    names = set(names)
+    if 'path_data' in names:
+        # Saving moves path_data into path_blob
+        names.add('path_blob')
+    return op_data({name: getattr(element, name) for name in OP_FIELDS if name in names})
+
+
+def append(room_id, operations, checkpoints=True):
+    """Append operations to a room's log and return the last seq.
+
+    Must run inside the transaction that applies the changes; bumping
+    Room.revision first locks the room row, so concurrent writers get
+    consecutive, non-overlapping ranges. With checkpoints=False the caller
+    takes the checkpoint once it is done, instead of one being taken after
+    each commit that passes CHECKPOINT_INTERVAL.
+    """
+    if not operations:
+        return None
+    count = len(operations)
+    with transaction.atomic():
+        Room.objects.filter(id=room_id).update(revision=F('revision') + count)
+        last = Room.objects.filter(id=room_id).values_list('revision', flat=True).get()
+        first = last - count + 1
+        RoomOperation.objects.bulk_create([
+            RoomOperation(
+                room_id=room_id,
+                seq=first + i,
+                op_type=op.op_type,
+                element_id=op.element_id,
+                data=op.data or {},
+                user_id=op.user_id,
+            )
+            for i, op in enumerate(operations)
+        ], batch_size=500)
+
+    interval = oplog_setting('CHECKPOINT_INTERVAL', 1000)
+    if checkpoints and interval and (first - 1) // interval != last // interval:
+        transaction.on_commit(lambda: queue_checkpoint(room_id))
+    return last
+
+
+def apply(scene, op_type, element_id, data):
+    """Apply one operation to a scene dict of element id -> fields"""
+    if op_type == 'add':
+        scene[str(element_id)] = dict(data)
+    elif op_type == 'update':
+        fields = scene.get(str(element_id))
+        if fields is not None:
+            fields.update(data)
+    elif op_type == 'delete':
+        scene.pop(str(element_id), None)
+    elif op_type == 'clear':
+        scene.clear()
+
+
+def dump_scene(scene):
+    return zlib.compress(json.dumps(scene, separators=(',', ':')).encode(), 6)
+
+
+def load_scene(data):
+    return json.loads(zlib.decompress(bytes(data)))
+
+
+def rebuild(room_id, seq=None):
+    """Scene of a room at seq (default: latest) and the seq it reflects"""
+    checkpoints = RoomCheckpoint.objects.filter(room_id=room_id)
+    operations = RoomOperation.objects.filter(room_id=room_id)
+    if seq is not None:
+        checkpoints = checkpoints.filter(seq__lte=seq)
+        operations = operations.filter(seq__lte=seq)
+
+    latest = checkpoints.order_by('-seq').first()
+    scene = load_scene(latest.data) if latest else {}
+    last = latest.seq if latest else 0
+
+    rows = operations.filter(seq__gt=last).order_by('seq').values_list(
+        'seq', 'op_type', 'element_id', 'data'
+    )
+    for last, op_type, element_id, data in rows.iterator(chunk_size=2000):
+        apply(scene, op_type, element_id, data)
+    return scene, last
+
+
+def checkpoint(room_id):
+    """Store the current scene of a room, unless it is already checkpointed"""
+    with transaction.atomic():
+        scene, seq = rebuild(room_id)
+        if RoomCheckpoint.objects.filter(room_id=room_id, seq=seq).exists():
+            return None
+        return RoomCheckpoint.objects.create(
+            room_id=room_id, seq=seq, element_count=len(scene), data=dump_scene(scene)
+        )
+
+
+def checkpointer():
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            _checkpointer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint')
+        return _checkpointer
+
+
+def queue_checkpoint(room_id):
+    """Checkpoint a room in the background, unless that is already queued"""
+    room_id = str(room_id)
+    with _checkpointer_lock:
+        if room_id in _queued:
+            return
+        _queued.add(room_id)
+
+    def run():
+        # Operations appended from now on are covered by this checkpoint
+        with _checkpointer_lock:
+            _queued.discard(room_id)
+        try:
+            checkpoint(room_id)
+        except Exception:
+            logger.exception('Failed to checkpoint room %s', room_id)
+        finally:
+            # Connections are per thread; do not keep this one open between checkpoints
+            connections.close_all()
+
+    checkpointer().submit(run)
+
+
+def scene_element(element_id, data):
+    """Client representation of a rebuilt element, with legacy path_data"""
+    element = {'id': element_id, **data}
+    blob = element.pop('path_blob', None)
+    if blob:
+        element['path_data'] = path_json(base64.b64decode(blob))
+    return element
+
+
+def changed_since(room_id, since):
+    """Ids of elements touched by operations after seq `since`"""
+    return {
+        str(element_id)
+        for element_id in RoomOperation.objects.filter(
+            room_id=room_id, seq__gt=since, element_id__isnull=False
+        ).order_by().values_list('element_id', flat=True).distinct()
+    }
+
+
+def cleared_since(room_id, since):
+    return RoomOperation.objects.filter(room_id=room_id, seq__gt=since, op_type='clear').exists()
+
+
+def operations_since(room_id, since, limit=500):
+    """Operations after seq `since`, oldest first"""
+    rows = RoomOperation.objects.filter(room_id=room_id, seq__gt=since).order_by('seq').values(
+        'seq', 'op_type', 'element_id', 'data', 'user__username', 'created_at'
+    )[:limit]
+    return [
+        {
+            'seq': row['seq'],
+            'op': row['op_type'],
+            'element_id': op_value(row['element_id']),
+            'data': row['data'],
+            'user': row['user__username'],
+            'created_at': row['created_at'].isoformat(),
+        }
+        for row in rows
+    ]
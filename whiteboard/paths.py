@@ -0,0 +1,181 @@
+"""Compact binary encoding of stroke paths.
+
+A path is stored as:
+
+    version byte | scale byte | varint(zigzag(x0)) varint(zigzag(y0))
+                              | varint(zigzag(dx1)) varint(zigzag(dy1)) ...
+
+Coordinates are quantized to 1 / 10**scale pixels and each point is stored
+as the difference from the previous one. Consecutive points of a stroke are
+close together, so most deltas fit in one or two bytes instead of the ~30
+bytes a point takes in the legacy JSON form. Paths with a coordinate too
+large to quantize exactly are not encoded and stay JSON.
+"""
+import base64
+import json
+
+try:
+    import numpy as np
+except ImportError:  # Pure Python fallback below is used instead
+    np = None
+
+from .geometry import path_points
+
+FORMAT_VERSION = 1
+
+# Decimal digits kept after quantization; 2 means 0.01 px precision
+DEFAULT_SCALE = 2
+
+# Quantized coordinates stay within 2**52, so that they and the deltas
+# between them are exact in int64 and in the client's float64 decoder
+MAX_QUANTIZED = 2 ** 52
+
+# Largest coordinate magnitude encoded at DEFAULT_SCALE
+MAX_COORDINATE = MAX_QUANTIZED / 10 ** DEFAULT_SCALE
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def encodable(points, scale=DEFAULT_SCALE):
+    """Whether every coordinate is finite and small enough to encode exactly"""
+    limit = MAX_QUANTIZED / 10 ** scale
+    return all(abs(value) <= limit for value in points)
+
+
+def encode_path(points, scale=DEFAULT_SCALE):
+    """Encode a flat [x0, y0, x1, y1, ...] list into bytes"""
+    if len(points) % 2:
+        raise ValueError('points must be a flat list of x, y pairs')
+    if not encodable(points, scale):
+        raise ValueError('points must be finite and within the encodable range')
+    header = bytes((FORMAT_VERSION, scale))
+    if not len(points):
+        return header
+    if np is not None:
+        return header + _encode_numpy(points, scale)
+    return header + _encode_python(points, scale)
+
+
+def decode_path(data):
+    """Decode bytes from encode_path() back into a flat list of floats"""
+    data = bytes(data)
+    if len(data) < 2 or data[0] != FORMAT_VERSION:
+        raise ValueError('Unsupported path encoding')
+    scale = data[1]
+    body = data[2:]
+    if not body:
+        return []
+    if np is not None:
+        return _decode_numpy(body, scale).tolist()
+    return _decode_python(body, scale)
+
+
+def decode_path_array(data):
+    """Like decode_path(), as an (n, 2) float64 array; requires NumPy"""
+    data = bytes(data)
+    if len(data) < 2 or data[0] != FORMAT_VERSION:
+        raise ValueError('Unsupported path encoding')
+    if len(data) == 2:
+        return np.empty((0, 2))
+    return _decode_numpy(data[2:], data[1]).reshape(-1, 2)
+
+
+def _encode_python(points, scale):
+    factor = 10 ** scale
+    out = bytearray()
+    previous = [0, 0]
+    for i, value in enumerate(points):
+        quantized = round(value * factor)
+        delta = zigzag(quantized - previous[i % 2])
+        previous[i % 2] = quantized
+        while delta > 0x7f:
+            out.append(delta & 0x7f | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def _decode_python(body, scale):
+    factor = 10 ** scale
+    values = []
+    previous = [0, 0]
+    value = shift = 0
+    for byte in body:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        axis = len(values) % 2
+        previous[axis] += unzigzag(value)
+        values.append(previous[axis] / factor)
+        value = shift = 0
+    if shift or len(values) % 2:
+        raise ValueError('Truncated path data')
+    return values
+
+
+def _encode_numpy(points, scale):
+    quantized = np.rint(np.asarray(points, dtype=np.float64).reshape(-1, 2) * 10 ** scale)
+    quantized = quantized.astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = ((deltas << 1) ^ (deltas >> 63)).astype(np.uint64)
+
+    # Bytes per varint, then scatter each 7-bit group into place
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for group in range(int(lengths.max())):
+        present = lengths > group
+        chunk = (values[present] >> np.uint64(7 * group)) & np.uint64(0x7f)
+        more = (lengths[present] > group + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[present] + group] = (chunk | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def _decode_numpy(body, scale):
+    data = np.frombuffer(body, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if not len(ends) or ends[-1] != len(data) - 1 or len(ends) % 2:
+        raise ValueError('Truncated path data')
+
+    # Index of the varint each byte belongs to and its 7-bit group within it
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    owner = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    group = np.arange(len(data)) - starts[owner]
+    parts = (data & 0x7f).astype(np.uint64) << (group.astype(np.uint64) * np.uint64(7))
+    values = np.add.reduceat(parts, starts)
+
+    deltas = (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0).ravel() / 10 ** scale
+
+
+def path_json(data):
+    """Legacy path_data JSON string for an encoded path"""
+    points = decode_path(data)
+    return json.dumps([
+        {'x': points[i], 'y': points[i + 1]}
+        for i in range(0, len(points), 2)
+    ])
+
+
+def pack_path_data(path_data):
+    """Encode a legacy path_data string; None if it is not a point list or
+    cannot be encoded exactly"""
+    points = path_points(path_data)
+    if not points or not encodable(points):
+        return None
+    return encode_path(points)
+
+
+def path_base64(data):
+    return base64.b64encode(bytes(data)).decode('ascii')
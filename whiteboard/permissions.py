@@ -0,0 +1,137 @@
+"""What a user may do in a room.
+
+A room's creator is its admin. Other users get the level of their
+Permission row in the room, or DEFAULT when they have none but the room is
+public or they joined it; anyone else has no access. Levels are ordered,
+each including the ones before it: view, draw (add elements), edit (change
+or delete them) and admin (clear the board, restore snapshots, change or
+delete the room).
+
+Resolved levels are cached in this process per (room, user) for up to
+CACHE_TTL seconds, and dropped when the room, the user's permission or
+their participation changes here. Checks that hit the cache run no query.
+"""
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from rest_framework.permissions import BasePermission
+
+from .models import Permission, Room, RoomParticipant
+
+LEVELS = [level for level, _ in Permission.PERMISSION_TYPES]
+
+# room id -> user id -> (level or None, monotonic expiry)
+_cache = {}
+_cache_size = 0
+_lock = threading.Lock()
+
+MISSING = object()
+
+
+def permission_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_PERMISSIONS', {}).get(name, default)
+
+
+def allows(level, required):
+    """Whether a resolved level (None for no access) includes required"""
+    return level is not None and LEVELS.index(level) >= LEVELS.index(required)
+
+
+def resolve(room, user):
+    """Permission level of a user in a room, or None, from the database"""
+    if not user.is_authenticated:
+        return None
+    if room.created_by_id == user.id:
+        return 'admin'
+    explicit = Permission.objects.filter(room_id=room.id, user=user).values_list(
+        'permission_type', flat=True
+    ).first()
+    if explicit:
+        return explicit
+    if room.is_public or RoomParticipant.objects.filter(room_id=room.id, user=user).exists():
+        return permission_setting('DEFAULT', 'edit')
+    return None
+
+
+def cached(room_id, user_id):
+    entry = _cache.get(str(room_id), {}).get(user_id)
+    if entry is None or entry[1] < time.monotonic():
+        return MISSING
+    return entry[0]
+
+
+def remember(room_id, user_id, level):
+    global _cache_size
+    with _lock:
+        if _cache_size >= permission_setting('CACHE_SIZE', 10000):
+            _cache.clear()
+            _cache_size = 0
+        users = _cache.setdefault(str(room_id), {})
+        if user_id not in users:
+            _cache_size += 1
+        users[user_id] = (level, time.monotonic() + permission_setting('CACHE_TTL', 60))
+
+
+def room_permission(room, user):
+    """Permission level of a user in a room, or None without access"""
+    level = cached(room.id, user.id)
+    if level is MISSING:
+        level = resolve(room, user)
+        remember(room.id, user.id, level)
+    return level
+
+
+async def aroom_permission(room, user):
+    level = cached(room.id, user.id)
+    if level is MISSING:
+        level = await database_sync_to_async(resolve)(room, user)
+        remember(room.id, user.id, level)
+    return level
+
+
+def forget(room_id, user_id=None):
+    """Drop the cached levels of one user in a room, or of everyone in it"""
+    global _cache_size
+    with _lock:
+        if user_id is None:
+            _cache_size -= len(_cache.pop(str(room_id), {}))
+        elif _cache.get(str(room_id), {}).pop(user_id, None) is not None:
+            _cache_size -= 1
+
+
+# Signal receivers. Forgetting again after the commit keeps a level that
+# was resolved from the old rows in the meantime from staying cached.
+
+def room_updated(sender, instance, **kwargs):
+    forget(instance.id)
+    transaction.on_commit(lambda: forget(instance.id))
+
+
+def permission_updated(sender, instance, **kwargs):
+    forget(instance.room_id, instance.user_id)
+    transaction.on_commit(lambda: forget(instance.room_id, instance.user_id))
+
+
+def participant_updated(sender, instance, **kwargs):
+    # Saves of an existing participant only change activity and cursors
+    if kwargs.get('created', True):
+        forget(instance.room_id, instance.user_id)
+        transaction.on_commit(lambda: forget(instance.room_id, instance.user_id))
+
+
+class RoomPermission(BasePermission):
+    """Checks the room of an object against the level the view requires
+    for its action in required_permissions; actions default to view, None
+    skips the check"""
+
+    message = 'You do not have permission to do this in this room'
+
+    def has_object_permission(self, request, view, obj):
+        required = getattr(view, 'required_permissions', {}).get(view.action, 'view')
+        if required is None:
+            return True
+        room = obj if isinstance(obj, Room) else obj.room
+        return allows(room_permission(room, request.user), required)
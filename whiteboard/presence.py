@@ -0,0 +1,78 @@
+"""Who is connected to each room, kept by the realtime consumer.
+
+A room's count is the number of distinct users with an open WebSocket to
+it; a second tab of the same user does not count again. Each room has one
+cache entry mapping the channel name of every connection to its user and
+the time it expires. Connections renew theirs every TTL / 3 seconds and
+remove it when they close, and expired ones are not counted, so the
+connections of a process that died stop counting after TTL seconds.
+Entries are read and written back whole: of two updates made at the same
+time one can be lost, which the next heartbeat puts right.
+
+Counts cover every server process only with a shared cache, such as Redis
+or Memcached, in CACHES. The default local-memory cache sees the
+connections of its own process alone.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def presence_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_PRESENCE', {}).get(name, default)
+
+
+def room_key(room_id):
+    return f'whiteboard:presence:{room_id}'
+
+
+def live(members, now):
+    """Entries of a room's connections that have not expired"""
+    return {channel_name: entry for channel_name, entry in members.items() if entry[1] > now}
+
+
+async def update(room_id, channel_name, user_id=None):
+    """Renew a connection's entry, or remove it when user_id is None"""
+    ttl = presence_setting('TTL', 60)
+    now = time.time()
+    members = live(await cache.aget(room_key(room_id), {}), now)
+    if user_id is None:
+        members.pop(channel_name, None)
+    else:
+        members[channel_name] = (user_id, now + ttl)
+    if members:
+        await cache.aset(room_key(room_id), members, timeout=ttl)
+    else:
+        await cache.adelete(room_key(room_id))
+
+
+async def connected(room_id, channel_name, user_id):
+    """Count a new connection of a user to a room"""
+    await update(room_id, channel_name, user_id)
+
+
+async def disconnected(room_id, channel_name):
+    """Stop counting a closed connection"""
+    await update(room_id, channel_name)
+
+
+async def heartbeat(room_id, channel_name, user_id):
+    """Keep renewing a connection's entry until cancelled"""
+    interval = presence_setting('TTL', 60) / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await update(room_id, channel_name, user_id)
+        except Exception:
+            logger.exception('Failed to renew presence in room %s', room_id)
+
+
+def count(room_id):
+    """Users connected to a room"""
+    members = live(cache.get(room_key(room_id), {}), time.time())
+    return len({user_id for user_id, _ in members.values()})
@@ -0,0 +1,168 @@
+"""Rasterize a board into a PNG with Pillow.
+
+This runs in the worker processes of whiteboard.thumbnails, so it only
+works on plain element dicts and never touches models or the database.
+Elements are drawn the way static/js/whiteboard.js draws them, scaled to
+fit the board's extent into the requested size.
+"""
+import io
+import math
+import time
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from .geometry import path_points
+from .paths import decode_path
+
+# Margin around the board's extent, as a fraction of the image size
+MARGIN = 0.05
+
+# Elements drawn between checks of the time budget
+CHECK_EVERY = 256
+
+
+def rgba(color, opacity=1.0):
+    try:
+        red, green, blue = ImageColor.getrgb(color)[:3]
+    except (AttributeError, TypeError, ValueError):
+        red, green, blue = 0, 0, 0
+    alpha = 1.0 if opacity is None else max(0.0, min(1.0, float(opacity)))
+    return red, green, blue, round(alpha * 255)
+
+
+def extent(elements):
+    """Box around every element's bounds"""
+    boxes = [
+        (element['min_x'], element['min_y'], element['max_x'], element['max_y'])
+        for element in elements
+    ]
+    if not boxes:
+        return 0.0, 0.0, 1.0, 1.0
+    return (
+        min(box[0] for box in boxes), min(box[1] for box in boxes),
+        max(box[2] for box in boxes), max(box[3] for box in boxes),
+    )
+
+
+class Canvas:
+    """An image plus the transform from board to image coordinates"""
+
+    def __init__(self, size, background, box):
+        width, height = size
+        self.image = Image.new('RGBA', (width, height), rgba(background))
+        self.draw = ImageDraw.Draw(self.image, 'RGBA')
+        self.background = background
+
+        x0, y0, x1, y1 = box
+        usable = 1 - 2 * MARGIN
+        self.scale = min(
+            width * usable / max(x1 - x0, 1e-6),
+            height * usable / max(y1 - y0, 1e-6),
+        )
+        # Center the board's extent
+        self.dx = (width - (x1 - x0) * self.scale) / 2 - x0 * self.scale
+        self.dy = (height - (y1 - y0) * self.scale) / 2 - y0 * self.scale
+
+    def point(self, x, y):
+        return x * self.scale + self.dx, y * self.scale + self.dy
+
+    def width(self, stroke_width):
+        return max(1, round((stroke_width or 1) * self.scale))
+
+
+def element_points(element):
+    blob = element.get('path_blob')
+    if blob:
+        return decode_path(blob)
+    return path_points(element.get('path_data'))
+
+
+def draw_stroke(canvas, element, color):
+    points = element_points(element)
+    if not points:
+        return
+    line = [canvas.point(points[i], points[i + 1]) for i in range(0, len(points), 2)]
+    width = canvas.width(element['stroke_width'])
+    if len(line) == 1:
+        x, y = line[0]
+        radius = width / 2
+        canvas.draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    else:
+        canvas.draw.line(line, fill=color, width=width, joint='curve')
+
+
+def draw_text(canvas, element, color):
+    text = element.get('text_content')
+    if not text:
+        return
+    size = max(1, round((element.get('font_size') or 16) * canvas.scale))
+    font = ImageFont.load_default(size=size)
+    # Canvas text is positioned by its left end on the baseline
+    canvas.draw.text(canvas.point(element['x'], element['y']), text, fill=color, font=font, anchor='ls')
+
+
+def draw_image(canvas, element):
+    path = element.get('image')
+    if not path:
+        return
+    try:
+        with Image.open(path) as source:
+            picture = source.convert('RGBA')
+    except (OSError, ValueError):
+        return
+    x0, y0 = canvas.point(element['x'], element['y'])
+    width = element['width'] or picture.width
+    height = element['height'] or picture.height
+    size = (max(1, round(abs(width) * canvas.scale)), max(1, round(abs(height) * canvas.scale)))
+    picture = picture.resize(size)
+    canvas.image.alpha_composite(picture, (round(min(x0, x0 + width * canvas.scale)), round(min(y0, y0 + height * canvas.scale))))
+
+
+def draw_element(canvas, element):
+    element_type = element['element_type']
+    color = rgba(element['color'], element.get('opacity'))
+    width = canvas.width(element['stroke_width'])
+
+    if element_type == 'pen':
+        draw_stroke(canvas, element, color)
+    elif element_type == 'eraser':
+        # Erased pixels show the background on a flat board
+        draw_stroke(canvas, element, rgba(canvas.background))
+    elif element_type == 'text':
+        draw_text(canvas, element, color)
+    elif element_type == 'image':
+        draw_image(canvas, element)
+    elif element_type == 'line':
+        start = canvas.point(element['x'], element['y'])
+        end = canvas.point(element['x'] + element['width'], element['y'] + element['height'])
+        canvas.draw.line((start, end), fill=color, width=width)
+    elif element_type == 'rectangle':
+        x0, y0 = canvas.point(element['x'], element['y'])
+        x1, y1 = canvas.point(element['x'] + element['width'], element['y'] + element['height'])
+        canvas.draw.rectangle(
+            (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)), outline=color, width=width
+        )
+    elif element_type == 'circle':
+        # Drawn from its center, with the drag distance as radius
+        x, y = canvas.point(element['x'], element['y'])
+        radius = math.hypot(element['width'], element['height']) * canvas.scale
+        canvas.draw.ellipse((x - radius, y - radius, x + radius, y + radius), outline=color, width=width)
+
+
+def render_png(elements, size, background='#ffffff', budget=None):
+    """PNG bytes of the elements in drawing order, and whether all were drawn.
+
+    Drawing stops once budget seconds have passed, leaving a partial image.
+    """
+    started = time.monotonic()
+    canvas = Canvas(size, background, extent(elements))
+    complete = True
+    for i, element in enumerate(elements):
+        if budget and i % CHECK_EVERY == 0 and time.monotonic() - started > budget:
+            complete = False
+            break
+        draw_element(canvas, element)
+
+    output = io.BytesIO()
+    canvas.image.convert('RGB').save(output, 'PNG', optimize=True)
+    return output.getvalue(), complete
@@ -0,0 +1,33 @@
+"""JSON rendering of large element lists.
+
+orjson encodes the lists whiteboard.serializers.serialize_elements() builds
+several times faster than the json module; without it, or when a client
+asks for indented output, DRF's own JSONRenderer is used. Both produce the
+same values, orjson without escaping U+2028 and U+2029.
+"""
+try:
+    import orjson
+except ImportError:  # DRF's json based encoding is used instead
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Datetimes are passed to JSONEncoder.default, which formats them like DRF
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+
+def json_bytes(data):
+    """Compact JSON of data, as DRF's JSONRenderer would write it"""
+    if orjson is not None:
+        return orjson.dumps(data, default=JSONEncoder().default, option=ORJSON_OPTIONS)
+    return JSONRenderer().render(data)
+
+
+class ElementJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when it can"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return json_bytes(data)
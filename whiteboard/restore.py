@@ -0,0 +1,133 @@
+"""Bulk copying of elements into a room, for snapshot restores and forks.
+
+Elements are read from their source in batches, built into DrawingElement
+instances and inserted with bulk_create together with their operation log
+entries, all in one transaction: a failed restore leaves the room as it
+was. Clients connected to the room are told to reload once it commits.
+"""
+import asyncio
+import json
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from .broadcast import elements_replacing, room_group
+from .models import DrawingElement, Room
+from .oplog import OP_FIELDS, Operation, append, element_data
+from .snapshots import load_elements, unpack_manifest
+
+BATCH_SIZE = 1000
+
+# Seconds to wait for the server's event loop to send a reload notification
+NOTIFY_TIMEOUT = 10
+
+# Room settings a fork takes over; the password is not one of them
+FORK_FIELDS = ('description', 'is_public', 'max_users', 'background_color', 'grid_enabled')
+
+
+def snapshot_batches(snapshot, batch_size=BATCH_SIZE):
+    """Serialized elements of a snapshot, in drawing order, a batch at a time"""
+    if snapshot.manifest is None:
+        elements = json.loads(snapshot.elements_data or '[]')
+        for i in range(0, len(elements), batch_size):
+            yield elements[i:i + batch_size]
+        return
+    hashes = [digest for _, digest in unpack_manifest(snapshot.manifest)]
+    for i in range(0, len(hashes), batch_size):
+        yield load_elements(hashes[i:i + batch_size])
+
+
+def room_batches(room_id, batch_size=BATCH_SIZE):
+    """Fields of a room's live elements, in drawing order, a batch at a time"""
+    rows = DrawingElement.objects.filter(room_id=room_id, is_deleted=False).order_by(
+        'z_index', 'created_at'
+    ).values(*OP_FIELDS)
+    batch = []
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_element(room_id, user, data):
+    """Unsaved copy of an element; serialized extras such as the nested
+    created_by or the derived bounds are not model fields"""
+    element = DrawingElement(
+        room_id=room_id,
+        created_by=user,
+        **{name: data[name] for name in OP_FIELDS if name in data and name != 'created_by_id'}
+    )
+    element.pack_path()
+    element.update_bounds()
+    return element
+
+
+def copy_elements(room, user, batches, replace=False):
+    """Insert elements from batches into a room; returns how many.
+
+    With replace, changes the room's consumers still buffer are written,
+    the room's current elements deleted, and connected clients reload the
+    board after the commit.
+    """
+    count = 0
+    if replace:
+        # Changes consumers still buffer must not land on the new board
+        elements_replacing.send(sender=Room, room_id=room.id)
+    with transaction.atomic():
+        if replace:
+            DrawingElement.objects.filter(room=room, is_deleted=False).update(
+                is_deleted=True, updated_at=timezone.now()
+            )
+            append(room.id, [Operation('clear', user_id=user.id)])
+
+        for batch in batches:
+            elements = [build_element(room.id, user, data) for data in batch]
+            DrawingElement.objects.bulk_create(elements, batch_size=500)
+            append(room.id, [
+                Operation('add', element.id, element_data(element), user.id)
+                for element in elements
+            ])
+            count += len(elements)
+
+        if replace:
+            transaction.on_commit(partial(notify_reload, room.id, user.username))
+    return count
+
+
+def restore_snapshot(snapshot, user):
+    return copy_elements(snapshot.room, user, snapshot_batches(snapshot), replace=True)
+
+
+def fork_room(source, user, name, batches):
+    """New room with the settings of source, owned by user, holding the
+    elements from batches; returns the room and its element count"""
+    with transaction.atomic():
+        room = Room.objects.create(
+            name=name,
+            created_by=user,
+            **{field: getattr(source, field) for field in FORK_FIELDS}
+        )
+        count = copy_elements(room, user, batches)
+    return room, count
+
+
+def notify_reload(room_id, username, loop=None):
+    """Tell every consumer in the room to send its client the board again.
+
+    From a thread of its own, pass the server's event loop, which the
+    channel layer's queues belong to, to send from there.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    group, message = room_group(room_id), {'type': 'room_reload', 'user': username}
+    if loop is not None and loop.is_running():
+        asyncio.run_coroutine_threadsafe(channel_layer.group_send(group, message), loop).result(NOTIFY_TIMEOUT)
+    else:
+        async_to_sync(channel_layer.group_send)(group, message)
@@ -0,0 +1,186 @@
+"""Content-addressed snapshot storage.
+
+Each element of a snapshot is serialized like the element API returns it
+and stored once as a compressed ElementBlob keyed by the hash of its JSON.
+A snapshot only keeps a manifest: for every element in drawing order, its
+16-byte id followed by the DIGEST_SIZE-byte hash. Snapshots of a mostly
+unchanged board therefore share nearly all their blobs.
+
+A new snapshot starts from the manifest of the room's latest one and only
+serializes the elements that the operation log shows changed since.
+"""
+import hashlib
+import json
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DrawingElement, ElementBlob, Room, Snapshot
+from .oplog import changed_since
+from .serializers import serialize_elements
+
+DIGEST_SIZE = 20
+RECORD_SIZE = 16 + DIGEST_SIZE
+
+# Elements serialized and blobs fetched per query
+BATCH_SIZE = 500
+
+
+def element_json(data):
+    """Canonical JSON of a serialized element; equal elements give equal bytes"""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), cls=DjangoJSONEncoder).encode()
+
+
+def element_hash(payload):
+    return hashlib.blake2b(payload, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def pack_manifest(entries):
+    """Bytes of a manifest from (element id, hash) pairs"""
+    return b''.join(uuid.UUID(str(element_id)).bytes + bytes.fromhex(digest) for element_id, digest in entries)
+
+
+def unpack_manifest(data):
+    data = bytes(data)
+    return [
+        (str(uuid.UUID(bytes=data[i:i + 16])), data[i + 16:i + RECORD_SIZE].hex())
+        for i in range(0, len(data), RECORD_SIZE)
+    ]
+
+
+def store_elements(elements):
+    """Store serialized elements as blobs; returns their hashes and how many were new"""
+    payloads = {}
+    hashes = []
+    for data in elements:
+        payload = element_json(data)
+        digest = element_hash(payload)
+        payloads[digest] = payload
+        hashes.append(digest)
+
+    existing = set()
+    digests = list(payloads)
+    for i in range(0, len(digests), BATCH_SIZE):
+        existing.update(
+            ElementBlob.objects.filter(hash__in=digests[i:i + BATCH_SIZE]).values_list('hash', flat=True)
+        )
+    blobs = [
+        ElementBlob(hash=digest, data=zlib.compress(payload, 6), size=len(payload))
+        for digest, payload in payloads.items() if digest not in existing
+    ]
+    ElementBlob.objects.bulk_create(blobs, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return hashes, len(blobs)
+
+
+def capture(room_id):
+    """Manifest entries of a room's live elements, the revision they reflect
+    and the number of blobs written"""
+    # Read the revision first: a change made while the elements are read
+    # then has a later seq and is picked up again by the next snapshot
+    revision = Room.objects.values_list('revision', flat=True).get(id=room_id)
+    base = Snapshot.objects.filter(
+        room_id=room_id, revision__isnull=False, revision__lte=revision, manifest__isnull=False
+    ).order_by('-revision', '-created_at').first()
+    previous = dict(unpack_manifest(base.manifest)) if base else {}
+    changed = changed_since(room_id, base.revision) if base else set()
+
+    live = DrawingElement.objects.filter(room_id=room_id, is_deleted=False)
+    element_ids = [str(element_id) for element_id in live.order_by('z_index', 'created_at').values_list('id', flat=True)]
+    stale = [element_id for element_id in element_ids if element_id not in previous or element_id in changed]
+
+    hashes = {}
+    written = 0
+    for i in range(0, len(stale), BATCH_SIZE):
+        data = serialize_elements(live.filter(id__in=stale[i:i + BATCH_SIZE]))
+        digests, new = store_elements(data)
+        hashes.update((element['id'], digest) for element, digest in zip(data, digests))
+        written += new
+
+    entries = [
+        (element_id, hashes[element_id] if element_id in hashes else previous[element_id])
+        for element_id in element_ids if element_id in hashes or element_id in previous
+    ]
+    return entries, revision, written
+
+
+def create_snapshot(room, user, name, description=''):
+    entries, revision, written = capture(room.id)
+    snapshot = Snapshot.objects.create(
+        room=room,
+        name=name,
+        description=description,
+        created_by=user,
+        manifest=pack_manifest(entries),
+        element_count=len(entries),
+        revision=revision,
+    )
+    return snapshot, written
+
+
+def snapshot_manifest(snapshot):
+    """Manifest entries of a snapshot, computed in memory for legacy ones"""
+    if snapshot.manifest is not None:
+        return unpack_manifest(snapshot.manifest)
+    return [
+        (str(data['id']), element_hash(element_json(data)))
+        for data in json.loads(snapshot.elements_data or '[]')
+    ]
+
+
+def load_elements(hashes):
+    """Serialized elements for blob hashes, in the same order"""
+    blobs = {}
+    unique = list(set(hashes))
+    for i in range(0, len(unique), BATCH_SIZE):
+        for digest, data in ElementBlob.objects.filter(hash__in=unique[i:i + BATCH_SIZE]).values_list('hash', 'data'):
+            blobs[digest] = json.loads(zlib.decompress(bytes(data)))
+    return [blobs[digest] for digest in hashes if digest in blobs]
+
+
+def snapshot_elements(snapshot):
+    """Serialized elements of a snapshot in drawing order"""
+    if snapshot.manifest is None:
+        return json.loads(snapshot.elements_data or '[]')
+    return load_elements([digest for _, digest in unpack_manifest(snapshot.manifest)])
+
+
+def diff(old, new):
+    """Element ids added, removed and changed from one snapshot to another"""
+    before = dict(snapshot_manifest(old))
+    after = dict(snapshot_manifest(new))
+    return {
+        'added': [element_id for element_id in after if element_id not in before],
+        'removed': [element_id for element_id in before if element_id not in after],
+        'changed': [
+            element_id for element_id, digest in after.items()
+            if element_id in before and before[element_id] != digest
+        ],
+        'unchanged': sum(1 for element_id, digest in after.items() if before.get(element_id) == digest),
+    }
+
+
+def collect_blobs(min_age=3600):
+    """Delete blobs no snapshot references any more; returns how many.
+
+    Blobs younger than min_age seconds are kept, since a snapshot being
+    created writes its blobs before its manifest.
+    """
+    referenced = set()
+    for manifest in Snapshot.objects.exclude(manifest=None).values_list('manifest', flat=True).iterator():
+        data = bytes(manifest)
+        referenced.update(data[i + 16:i + RECORD_SIZE].hex() for i in range(0, len(data), RECORD_SIZE))
+
+    unused = [
+        digest for digest in ElementBlob.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=min_age)
+        ).values_list('hash', flat=True).iterator()
+        if digest not in referenced
+    ]
+    for i in range(0, len(unused), BATCH_SIZE):
+        with transaction.atomic():
+            ElementBlob.objects.filter(hash__in=unused[i:i + BATCH_SIZE]).delete()
+    return len(unused)
@@ -1,3 +1,682 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+
+from . import paths, presence, thumbnails
+from .compaction import compact, tombstones
+from .imports import run_job
+from .models import (
+    DrawingElement, ElementArchive, ElementBlob, ImportJob, Permission, Room, RoomOperation, RoomParticipant, Snapshot,
+)
+from .oplog import checkpoint, load_scene, rebuild
+from .paths import MAX_COORDINATE
+from .permissions import LEVELS, allows
+from .render import CHECK_EVERY, render_png
+from .serializers import DrawingElementSerializer, serialize_elements
+from .snapshots import collect_blobs, snapshot_elements
+from .thumbnails import ThumbnailRefresher
+
+# Fields an element keeps through an export and import
+COPIED_FIELDS = [
+    'element_type', 'x', 'y', 'width', 'height', 'color', 'stroke_width', 'opacity',
+    'path_data', 'text_content', 'font_size', 'font_family', 'z_index', 'created_at',
+]
+
+
+class WhiteboardTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='x')
+        self.member = User.objects.create_user('member', password='x')
+        self.room = Room.objects.create(name='Room', created_by=self.owner, is_public=True)
+        RoomParticipant.objects.create(room=self.room, user=self.owner)
+        self.client.force_login(self.owner)
+
+    def add(self, **fields):
+        """Create an element through the API, as clients do"""
+        data = {'room': str(self.room.id), 'element_type': 'rectangle', 'x': 0, 'y': 0, **fields}
+        response = self.client.post('/api/elements/', data)
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+
+class PathTest(WhiteboardTestCase):
+    POINTS = [0, 0, 1.25, -3.5, 1.25, -3.5, 63.99, 64, -8192, 8191.5, 1e9, -1e9, MAX_COORDINATE, -MAX_COORDINATE]
+
+    def test_round_trip(self):
+        for implementation in ('numpy', 'python'):
+            with self.subTest(implementation=implementation), \
+                    mock.patch.object(paths, 'np', paths.np if implementation == 'numpy' else None):
+                data = paths.encode_path(self.POINTS)
+                self.assertEqual(data, paths.encode_path(self.POINTS))
+                self.assertEqual(paths.decode_path(data), self.POINTS)
+                # 1/100 px precision
+                self.assertEqual(paths.decode_path(paths.encode_path([0.123, 4.567])), [0.12, 4.57])
+                self.assertEqual(paths.decode_path(paths.encode_path([])), [])
+                for broken in (data[:-1], b'\x02' + data[1:], b'\x01'):
+                    with self.assertRaises(ValueError):
+                        paths.decode_path(broken)
+
+    def test_both_implementations_agree(self):
+        with mock.patch.object(paths, 'np', None):
+            python = paths.encode_path(self.POINTS)
+        self.assertEqual(paths.encode_path(self.POINTS), python)
+
+    def test_paths_too_large_to_encode_stay_json(self):
+        for value in (MAX_COORDINATE * 2, 1e300):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                paths.encode_path([0, value])
+        path_data = '[{"x": 1, "y": 2}, {"x": 1e300, "y": -1e300}]'
+        element_id = self.add(element_type='pen', path_data=path_data)
+        element = DrawingElement.objects.get(id=element_id)
+        self.assertEqual((element.path_data, element.path_blob), (path_data, None))
+        self.assertEqual(element.max_x, 1e300 + element.stroke_width / 2)
+
+        element_id = self.add(element_type='pen', path_data='[{"x": 1, "y": 2}, {"x": 3, "y": -4}]')
+        element = DrawingElement.objects.get(id=element_id)
+        self.assertEqual(paths.decode_path(element.path_blob), [1, 2, 3, -4])
+
+
+class OperationLogTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.add(x=i, y=i) for i in range(3)]
+        self.client.patch(f'/api/elements/{self.ids[0]}/', {'x': 50}, content_type='application/json')
+        self.client.delete(f'/api/elements/{self.ids[1]}/')
+
+    def test_rebuild_replays_the_log(self):
+        scene, seq = rebuild(self.room.id)
+        self.assertEqual(seq, 5)
+        self.assertEqual(set(scene), {self.ids[0], self.ids[2]})
+        self.assertEqual(scene[self.ids[0]]['x'], 50)
+
+        elements = self.client.get(f'/api/rooms/{self.room.id}/history/', {'seq': 3}).json()['elements']
+        self.assertEqual({element['id']: element['x'] for element in elements}, dict(zip(self.ids, [0, 1, 2])))
+
+    def test_rebuild_starts_from_the_latest_checkpoint(self):
+        self.assertEqual(checkpoint(self.room.id).element_count, 2)
+        self.assertIsNone(checkpoint(self.room.id))
+        # Operations covered by the checkpoint are no longer read
+        RoomOperation.objects.filter(room=self.room).delete()
+        self.add(x=9, y=9)
+        scene, seq = rebuild(self.room.id)
+        self.assertEqual((len(scene), seq), (3, 6))
+        self.assertEqual(len(rebuild(self.room.id, 5)[0]), 2)
+
+    @override_settings(WHITEBOARD_OPLOG={'CHECKPOINT_INTERVAL': 4})
+    def test_checkpoint_is_queued_after_each_interval(self):
+        with mock.patch('whiteboard.oplog.queue_checkpoint') as queue:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add(x=0, y=0)
+            queue.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/elements/batch/', {
+                    'room': str(self.room.id),
+                    'operations': [{'op': 'create', 'data': {'element_type': 'circle', 'x': 1, 'y': 1}}] * 3,
+                }, content_type='application/json')
+        queue.assert_called_once_with(self.room.id)
+
+    def test_operations_page(self):
+        url = f'/api/rooms/{self.room.id}/operations/'
+        page = self.client.get(url, {'since': 1, 'limit': 2}).json()
+        self.assertEqual([operation['op'] for operation in page['operations']], ['add', 'add'])
+        self.assertEqual(page['next'], 3)
+        page = self.client.get(url, {'since': 3}).json()
+        self.assertEqual([operation['op'] for operation in page['operations']], ['update', 'delete'])
+        self.assertIsNone(page['next'])
+
+        # Out of range limits are clamped
+        for limit in (0, -1):
+            page = self.client.get(url, {'limit': limit}).json()
+            self.assertEqual((len(page['operations']), page['next']), (1, 1))
+        self.assertEqual(self.client.get(url, {'limit': 'x'}).status_code, 400)
+
+
+class CompactionTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.add(x=i, y=i) for i in range(5)]
+        # Deleted the way clients do, over the WebSocket; three are old
+        # enough to be compacted
+        DrawingElement.objects.filter(id__in=self.ids[:4]).update(is_deleted=True)
+        DrawingElement.objects.filter(id__in=self.ids[:3]).update(
+            updated_at=timezone.now() - timedelta(hours=2)
+        )
+
+    def test_old_tombstones_are_purged(self):
+        other = Room.objects.create(name='Other', created_by=self.owner)
+        DrawingElement.objects.create(
+            room=other, created_by=self.owner, element_type='rectangle', x=0, y=0, is_deleted=True,
+        )
+        DrawingElement.objects.filter(room=other).update(updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(tombstones(self.room.id).count(), 3)
+        self.assertEqual(tombstones().count(), 4)
+
+        result = compact(self.room.id, batch_size=2, pause=0)
+        self.assertEqual((result['purged'], result['archived'], result['batches']), (3, 0, 2))
+        self.assertEqual(
+            set(DrawingElement.objects.filter(room=self.room).values_list('id', flat=True)),
+            {uuid.UUID(element_id) for element_id in self.ids[3:]}
+        )
+        self.assertEqual(tombstones(other.id).count(), 1)
+
+    def test_archived_rows_keep_their_fields(self):
+        result = compact(self.room.id, archive_rows=True, pause=0)
+        self.assertEqual((result['purged'], result['archived']), (3, 3))
+        archived = ElementArchive.objects.get(room=self.room)
+        self.assertEqual(archived.element_count, 3)
+        scene = load_scene(archived.data)
+        self.assertEqual(set(scene), set(self.ids[:3]))
+        self.assertEqual(scene[self.ids[1]]['x'], 1)
+
+
+class SnapshotTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.add(x=i, y=i) for i in range(3)]
+
+    def save(self):
+        response = self.client.post(f'/api/rooms/{self.room.id}/save_snapshot/', {'name': 'Snapshot'})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def diff(self, old, new):
+        return self.client.get(f'/api/snapshots/{new["id"]}/diff/', {'against': old['id']}).json()
+
+    def test_snapshots_share_unchanged_elements(self):
+        first = self.save()
+        self.assertEqual((first['element_count'], first['stored_elements']), (3, 3))
+        # Nothing changed: every blob is reused
+        self.assertEqual(self.save()['stored_elements'], 0)
+
+        self.client.patch(f'/api/elements/{self.ids[0]}/', {'x': 50}, content_type='application/json')
+        self.client.delete(f'/api/elements/{self.ids[1]}/')
+        added = self.add(x=9, y=9)
+        second = self.save()
+        self.assertEqual((second['element_count'], second['stored_elements']), (3, 2))
+        self.assertEqual(ElementBlob.objects.count(), 5)
+
+        delta = self.diff(first, second)
+        self.assertEqual(
+            (delta['added'], delta['removed'], delta['changed'], delta['unchanged']),
+            ([added], [self.ids[1]], [self.ids[0]], 1)
+        )
+        elements = snapshot_elements(Snapshot.objects.get(id=second['id']))
+        self.assertEqual(elements, self.client.get(f'/api/rooms/{self.room.id}/elements/').json())
+
+    def test_legacy_snapshots(self):
+        current = self.client.get(f'/api/rooms/{self.room.id}/elements/').json()
+        legacy = Snapshot.objects.create(
+            room=self.room, created_by=self.owner, name='Legacy', elements_data=json.dumps(current)
+        )
+        self.assertEqual(snapshot_elements(legacy), current)
+        delta = self.diff({'id': legacy.id}, self.save())
+        self.assertEqual((delta['added'], delta['changed'], delta['unchanged']), ([], [], 3))
+
+    def test_unreferenced_blobs_are_collected(self):
+        first = self.save()
+        self.client.patch(f'/api/elements/{self.ids[0]}/', {'x': 50}, content_type='application/json')
+        self.save()
+        self.assertEqual(collect_blobs(min_age=0), 0)
+        Snapshot.objects.filter(id=first['id']).delete()
+        self.assertEqual(collect_blobs(min_age=0), 1)
+        self.assertEqual(ElementBlob.objects.count(), 3)
+
+
+class RestoreTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.add(x=i, y=i, color=f'#00000{i}') for i in range(2)]
+        response = self.client.post(f'/api/rooms/{self.room.id}/save_snapshot/', {'name': 'Snapshot'})
+        self.snapshot = response.json()
+
+    def board(self, room):
+        """(x, color) of each live element of a room, in drawing order"""
+        elements = self.client.get(f'/api/rooms/{room.id}/elements/').json()
+        return sorted((element['x'], element['color']) for element in elements)
+
+    def test_restore_replaces_the_board(self):
+        expected = self.board(self.room)
+        self.client.patch(f'/api/elements/{self.ids[0]}/', {'x': 50}, content_type='application/json')
+        self.add(x=9, y=9)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.client.post(f'/api/snapshots/{self.snapshot["id"]}/restore/')
+        self.assertEqual(response.json()['element_count'], 2)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.board(self.room), expected)
+        # The operation log agrees with the table
+        scene, _ = rebuild(self.room.id)
+        self.assertEqual(sorted((data['x'], data['color']) for data in scene.values()), expected)
+
+    def test_fork(self):
+        Room.objects.filter(id=self.room.id).update(password='secret')
+        self.add(x=9, y=9)
+        response = self.client.post(f'/api/rooms/{self.room.id}/fork/', {'name': 'Fork'})
+        self.assertEqual(response.status_code, 201)
+        fork = Room.objects.get(id=response.json()['id'])
+        self.assertEqual((fork.name, fork.created_by, fork.password), ('Fork', self.owner, None))
+        self.assertEqual(self.board(fork), self.board(self.room))
+
+        response = self.client.post(f'/api/snapshots/{self.snapshot["id"]}/fork/')
+        self.assertEqual(response.json()['element_count'], 2)
+
+        # The password guards the content of a public room
+        self.client.force_login(self.member)
+        response = self.client.post(f'/api/rooms/{self.room.id}/fork/')
+        self.assertEqual(response.status_code, 403)
+
+
+class ThumbnailTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.url = f'/api/rooms/{self.room.id}/thumbnail/'
+
+    def get(self):
+        """Thumbnail response and whether it queued a render"""
+        with mock.patch.object(thumbnails, 'queue_render') as queue_render:
+            response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        return response, queue_render.called
+
+    def render_room(self):
+        # In this process instead of the pool of worker processes
+        def render(elements, background):
+            return render_png(elements, (320, 180), background)[0]
+        with mock.patch.object(thumbnails, 'render', render):
+            thumbnails.render_room(self.room.id)
+
+    def test_thumbnails_follow_room_changes(self):
+        self.add(width=200, height=100, color='#ff0000', stroke_width=8)
+        response, queued = self.get()
+        self.assertEqual(response.content, thumbnails.placeholder(self.room.background_color))
+        self.assertTrue(queued)
+
+        self.render_room()
+        response, queued = self.get()
+        self.assertNotIn('Retry-After', response)
+        self.assertFalse(queued)
+        image = Image.open(io.BytesIO(response.content))
+        self.assertEqual(image.size, (320, 180))
+        self.assertIn((255, 0, 0), [color for _, color in image.getcolors(320 * 180)])
+
+        # Outdated once the room changes, and still shown until rendered again
+        self.add(x=500, y=500)
+        stale, queued = self.get()
+        self.assertEqual(stale.content, response.content)
+        self.assertIn('Retry-After', stale)
+        self.assertTrue(queued)
+
+    def test_refresh_waits_for_rooms_to_settle(self):
+        self.add()
+        refresher = ThumbnailRefresher(delay=60)
+        self.assertEqual(refresher.due_rooms(), [])
+        RoomOperation.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(refresher.due_rooms(), [self.room.id])
+        self.render_room()
+        self.assertEqual(refresher.due_rooms(), [])
+
+    def test_render_budget(self):
+        self.add(width=10, height=10)
+        elements = thumbnails.room_render_elements(self.room.id) * (CHECK_EVERY + 1)
+        self.assertTrue(render_png(elements, (32, 18))[1])
+        with mock.patch('whiteboard.render.time.monotonic', side_effect=itertools.count(0, 10)):
+            png, complete = render_png(elements, (32, 18), budget=5)
+        self.assertFalse(complete)
+        self.assertEqual(Image.open(io.BytesIO(png)).size, (32, 18))
+
+
+class ElementDeltaTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/rooms/{self.room.id}/elements/'
+        self.ids = [self.add(x=i, y=i, width=2, height=2) for i in range(3)]
+
+    def test_etag_is_the_room_revision(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"3"')
+        self.assertEqual(response['X-Room-Revision'], '3')
+        self.assertEqual(len(response.json()), 3)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"3"').status_code, 304)
+        self.add(x=5, y=5)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"3"').status_code, 200)
+
+    def test_since_returns_changed_and_removed_elements(self):
+        self.client.patch(f'/api/elements/{self.ids[0]}/', {'x': 500, 'y': 500}, content_type='application/json')
+        self.client.delete(f'/api/elements/{self.ids[1]}/')
+        added = self.add(x=1, y=1, width=2, height=2)
+
+        delta = self.client.get(self.url, {'since': 3}).json()
+        self.assertFalse(delta['reset'])
+        self.assertEqual(delta['revision'], 6)
+        self.assertEqual({element['id'] for element in delta['elements']}, {self.ids[0], added})
+        self.assertEqual(delta['removed'], [self.ids[1]])
+
+        # An element moved out of the box counts as removed
+        delta = self.client.get(self.url, {'since': 3, 'bbox': '0,0,100,100'}).json()
+        self.assertEqual([element['id'] for element in delta['elements']], [added])
+        self.assertEqual(set(delta['removed']), {self.ids[0], self.ids[1]})
+
+        self.assertEqual(self.client.get(self.url, {'since': 6}).json()['elements'], [])
+
+    def test_clear_resets_the_delta(self):
+        self.client.post(f'/api/rooms/{self.room.id}/clear/')
+        delta = self.client.get(self.url, {'since': 3}).json()
+        self.assertTrue(delta['reset'])
+        self.assertEqual(delta['elements'], [])
+
+    def test_invalid_since(self):
+        self.assertEqual(self.client.get(self.url, {'since': 'x'}).status_code, 400)
+
+
+class PermissionMatrixTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        RoomParticipant.objects.create(room=self.room, user=self.member)
+        self.element = DrawingElement.objects.create(
+            room=self.room, created_by=self.owner, element_type='rectangle', x=0, y=0
+        )
+
+    def test_levels_include_the_ones_before(self):
+        for level in LEVELS:
+            for required in LEVELS:
+                self.assertEqual(allows(level, required), LEVELS.index(level) >= LEVELS.index(required))
+            self.assertFalse(allows(None, level))
+
+    def test_rest_actions_by_level(self):
+        # level -> (draw, edit, admin) allowed
+        expected = {
+            'view': (False, False, False),
+            'draw': (True, False, False),
+            'edit': (True, True, False),
+            'admin': (True, True, True),
+        }
+        permission = Permission.objects.create(
+            room=self.room, user=self.member, granted_by=self.owner, permission_type='view'
+        )
+        self.client.force_login(self.member)
+        for level, (draw, edit, admin) in expected.items():
+            with self.subTest(level=level):
+                permission.permission_type = level
+                permission.save()
+                response = self.client.post(
+                    '/api/elements/', {'room': str(self.room.id), 'element_type': 'rectangle', 'x': 1, 'y': 1}
+                )
+                self.assertEqual(response.status_code, 201 if draw else 403)
+                response = self.client.post('/api/elements/batch/', {
+                    'room': str(self.room.id),
+                    'operations': [{'op': 'update', 'id': str(self.element.id), 'data': {'x': 2}}],
+                }, content_type='application/json')
+                self.assertEqual(response.status_code, 200 if edit else 403)
+                response = self.client.post(f'/api/rooms/{self.room.id}/clear/')
+                self.assertEqual(response.status_code, 200 if admin else 403)
+
+    def test_elements_stay_in_their_room(self):
+        private = Room.objects.create(name='Private', created_by=self.member)
+        url = f'/api/elements/{self.element.id}/'
+        response = self.client.patch(url, {'room': str(private.id), 'x': 5}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('room', response.json())
+        self.element.refresh_from_db()
+        self.assertEqual((self.element.room_id, self.element.x), (self.room.id, 0))
+
+        response = self.client.patch(url, {'room': str(self.room.id), 'x': 5}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_private_room_is_hidden_from_others(self):
+        private = Room.objects.create(name='Private', created_by=self.owner)
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(f'/api/rooms/{private.id}/elements/').status_code, 404)
+
+
+class PresenceTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_users_are_counted_once_until_they_expire(self):
+        async def connect():
+            await presence.connected(self.room.id, 'tab-1', self.owner.id)
+            await presence.connected(self.room.id, 'tab-2', self.owner.id)
+            await presence.connected(self.room.id, 'member', self.member.id)
+        asyncio.run(connect())
+        self.assertEqual(self.room.active_users_count, 2)
+        asyncio.run(presence.disconnected(self.room.id, 'member'))
+        self.assertEqual(self.room.active_users_count, 1)
+
+        # Entries of connections that stopped renewing them expire
+        with mock.patch('whiteboard.presence.time.time', return_value=time.time() + 61):
+            self.assertEqual(presence.count(self.room.id), 0)
+            asyncio.run(presence.connected(self.room.id, 'member', self.member.id))
+            self.assertEqual(presence.count(self.room.id), 1)
+
+    def test_room_list_queries_do_not_grow_with_rooms(self):
+        def list_rooms():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/rooms/')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+        asyncio.run(presence.connected(self.room.id, 'tab', self.owner.id))
+        expected = list_rooms()
+        for i in range(5):
+            Room.objects.create(name=f'Room {i}', created_by=self.member, is_public=True)
+        self.assertEqual(list_rooms(), expected)
+        rooms = self.client.get('/api/rooms/').json()
+        rooms = rooms.get('results', rooms)
+        counts = {room['id']: room['active_users_count'] for room in rooms}
+        self.assertEqual(counts[str(self.room.id)], 1)
+        self.assertEqual(sum(counts.values()), 1)
+
+
+class BatchTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.first, self.second = (
+            DrawingElement.objects.create(room=self.room, created_by=self.owner, element_type='rectangle', x=0, y=0)
+            for _ in range(2)
+        )
+
+    def batch(self, operations):
+        return self.client.post(
+            '/api/elements/batch/', {'room': str(self.room.id), 'operations': operations},
+            content_type='application/json'
+        )
+
+    def test_applies_every_operation(self):
+        response = self.batch([
+            {'op': 'create', 'data': {'element_type': 'circle', 'x': 1, 'y': 2, 'width': 3, 'height': 3}},
+            {'op': 'update', 'id': str(self.first.id), 'data': {'x': 50}},
+            {'op': 'update', 'id': str(self.second.id), 'data': {'color': '#ff0000'}},
+        ])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([result['op'] for result in response.json()['results']], ['create', 'update', 'update'])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        # Bounds follow the new position
+        self.assertEqual((self.first.x, self.first.min_x), (50, 50 - self.first.stroke_width / 2))
+        self.assertEqual(self.second.color, '#ff0000')
+        self.assertEqual(Room.objects.get(id=self.room.id).revision, 3)
+
+        response = self.batch([{'op': 'delete', 'id': str(self.first.id)}])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.first.refresh_from_db()
+        self.assertTrue(self.first.is_deleted)
+
+    def test_one_invalid_operation_applies_none(self):
+        response = self.batch([
+            {'op': 'create', 'data': {'element_type': 'circle', 'x': 1, 'y': 2}},
+            {'op': 'update', 'id': str(self.first.id), 'data': {'x': 50}},
+            {'op': 'update', 'id': str(self.second.id), 'data': {'x': 'abc'}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([('errors' in result) for result in results], [False, False, True])
+        self.assert_unchanged()
+
+    def test_failed_write_applies_none(self):
+        operations = [
+            {'op': 'create', 'data': {'element_type': 'circle', 'x': 1, 'y': 2}},
+            {'op': 'update', 'id': str(self.first.id), 'data': {'x': 50}},
+        ]
+        with mock.patch.object(DrawingElement.objects, 'bulk_update', side_effect=RuntimeError('failed')):
+            with self.assertRaises(RuntimeError):
+                self.batch(operations)
+        self.assert_unchanged()
+
+    def test_elements_of_other_rooms(self):
+        other = Room.objects.create(name='Other', created_by=self.owner, is_public=True)
+        foreign = DrawingElement.objects.create(room=other, created_by=self.owner, element_type='rectangle', x=0, y=0)
+        response = self.batch([{'op': 'delete', 'id': str(foreign.id)}])
+        self.assertEqual(response.status_code, 400)
+        foreign.refresh_from_db()
+        self.assertFalse(foreign.is_deleted)
+
+    def assert_unchanged(self):
+        self.assertEqual(DrawingElement.objects.filter(room=self.room).count(), 2)
+        self.assertEqual(DrawingElement.objects.get(id=self.first.id).x, 0)
+        self.assertEqual(Room.objects.get(id=self.room.id).revision, 0)
+
+
+class ExportTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pen = self.add(element_type='pen', path_data='[{"x":1,"y":2},{"x":3.5,"y":-4}]', color='#ff0000', z_index=2)
+        self.text = self.add(element_type='text', x=5, y=6, text_content='a < b & "c"', font_size=20)
+        self.rectangle = self.add(x=-3, y=4, width=10, height=-5, opacity=0.5, z_index=1)
+        self.client.delete(f'/api/elements/{self.add(x=9, y=9)}/')
+
+    def export(self, export_format):
+        response = self.client.get(f'/api/rooms/{self.room.id}/export/{export_format}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="room.{export_format}"')
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_matches_the_element_api(self):
+        lines = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual([line['id'] for line in lines], [self.text, self.rectangle, self.pen])
+        elements = {
+            element['id']: element for element in self.client.get(f'/api/rooms/{self.room.id}/elements/').json()
+        }
+        self.assertEqual(lines, [elements[line['id']] for line in lines])
+
+    def test_svg_draws_live_elements_in_order(self):
+        svg = ElementTree.fromstring(self.export('svg'))
+        self.assertEqual(
+            [child.tag.removeprefix('{http://www.w3.org/2000/svg}') for child in svg],
+            ['title', 'rect', 'text', 'rect', 'polyline'],
+        )
+        # Background, then the elements
+        self.assertEqual(svg[1].get('fill'), '#ffffff')
+        self.assertEqual(svg[2].text, 'a < b & "c"')
+        self.assertEqual((svg[3].get('y'), svg[3].get('height'), svg[3].get('opacity')), ('-1', '5', '0.5'))
+        self.assertEqual((svg[4].get('points'), svg[4].get('stroke')), ('1,2 3.5,-4', '#ff0000'))
+
+
+class ImportTest(WhiteboardTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add(element_type='pen', path_data='[{"x":1,"y":2},{"x":3.5,"y":-4}]', color='#ff0000', z_index=2)
+        self.add(element_type='text', x=5, y=6, text_content='a < b & "c"', font_size=20)
+        self.add(x=-3, y=4, width=10, height=-5, opacity=0.5, z_index=1)
+        self.add(element_type='circle', x=7, y=8, width=3, height=4)
+
+    def export(self, room):
+        response = self.client.get(f'/api/rooms/{room.id}/export/ndjson/')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def elements(self, room):
+        return list(
+            DrawingElement.objects.filter(room=room, is_deleted=False)
+            .order_by('z_index', 'created_at').values(*COPIED_FIELDS)
+        )
+
+    def test_round_trip(self):
+        data = self.export(self.room)
+        self.assertEqual(len(data.splitlines()), 4)
+
+        copy = Room.objects.create(name='Copy', created_by=self.member)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'room.ndjson')
+            with open(path, 'wb') as file:
+                file.write(data)
+            job = ImportJob.objects.create(room=copy, created_by=self.member, path=path, file_format='ndjson')
+            job = run_job(job.id, batch_size=3)
+
+        self.assertEqual((job.status, job.imported, job.skipped), ('done', 4, 0))
+        self.assertEqual(self.elements(copy), self.elements(self.room))
+        self.assertEqual(Room.objects.get(id=copy.id).revision, 4)
+        self.assertFalse(DrawingElement.objects.filter(room=copy).exclude(created_by=self.member).exists())
+
+        # The copy exports the same elements, apart from ids and creator
+        def comparable(data):
+            lines = [json.loads(line) for line in data.splitlines()]
+            return [
+                {name: value for name, value in line.items() if name not in ('id', 'room', 'created_by', 'updated_at')}
+                for line in lines
+            ]
+        self.client.force_login(self.member)
+        self.assertEqual(comparable(self.export(copy)), comparable(data))
+
+    def test_invalid_rows_are_skipped(self):
+        copy = Room.objects.create(name='Copy', created_by=self.owner)
+        lines = self.export(self.room).splitlines()
+        lines[1:1] = [b'{not json', b'{"element_type": "nope"}']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'room.ndjson')
+            with open(path, 'wb') as file:
+                file.write(b'\n'.join(lines))
+            job = ImportJob.objects.create(room=copy, created_by=self.owner, path=path, file_format='ndjson')
+            job = run_job(job.id)
+
+        self.assertEqual((job.status, job.imported, job.skipped), ('done', 4, 2))
+        self.assertEqual([error['row'] for error in job.errors], [2, 3])
+        self.assertEqual(self.elements(copy), self.elements(self.room))
+
+
+class SerializeElementsTest(WhiteboardTestCase):
+    def test_matches_the_serializer(self):
+        for fields in [
+            {'element_type': 'pen', 'path_data': '[{"x":1,"y":2},{"x":3.5,"y":4}]'},
+            {'element_type': 'pen', 'path_data': 'not json'},
+            {'element_type': 'text', 'x': 1, 'y': 2, 'text_content': 'héllo "q"', 'font_size': 20},
+            {'element_type': 'image', 'x': 1, 'y': 2, 'width': 3, 'height': 4, 'image': 'whiteboard_images/a b.png'},
+            {'element_type': 'rectangle', 'x': 5, 'y': 6, 'width': -3, 'height': 2, 'opacity': 0.5, 'z_index': 3},
+        ]:
+            DrawingElement.objects.create(room=self.room, created_by=self.member, **{'x': 0, 'y': 0, **fields})
+        elements = DrawingElement.objects.filter(room=self.room).order_by('z_index', 'created_at')
+
+        for compact_paths in (False, True):
+            with self.subTest(compact_paths=compact_paths):
+                expected = DrawingElementSerializer(
+                    elements, many=True, context={'compact_paths': compact_paths}
+                ).data
+                data = serialize_elements(elements, compact_paths)
+                self.assertEqual([dict(element) for element in expected], data)
+                for serialized, fast in zip(expected, data):
+                    self.assertEqual(list(serialized), list(fast))
+                    for name in serialized:
+                        self.assertIs(type(serialized[name]), type(fast[name]), name)
+                self.assertEqual(JSONRenderer().render(expected), JSONRenderer().render(data))
@@ -0,0 +1,270 @@
+"""Board previews rendered off the event loop.
+
+whiteboard.render draws elements in a pool of POOL_SIZE worker processes,
+stopping after TIME_BUDGET seconds. A room's thumbnail is stored with the
+Room.revision it shows and reused until the room changes; snapshots never
+change, so theirs is rendered once.
+
+Requests never wait for a render: they get the stored thumbnail, outdated
+or not, or a blank placeholder, and a missing or outdated one is queued to
+be rendered in a background thread of the process. `python manage.py
+refresh_thumbnails` also re-renders a room's thumbnail once DELAY seconds
+passed since its last change, so the room list rarely shows an old one.
+"""
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import DrawingElement, Room, RoomOperation, Snapshot
+from .render import render_png
+from .snapshots import snapshot_elements
+
+logger = logging.getLogger(__name__)
+
+# Element columns the renderer reads
+RENDER_FIELDS = (
+    'element_type', 'x', 'y', 'width', 'height', 'color', 'stroke_width',
+    'opacity', 'path_data', 'path_blob', 'text_content', 'font_size', 'image',
+    'min_x', 'min_y', 'max_x', 'max_y',
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+_renders = None
+# Keys of renders queued in this process and not finished yet
+_queued = set()
+
+
+def thumbnail_setting(name, default):
+    return getattr(settings, 'WHITEBOARD_THUMBNAILS', {}).get(name, default)
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a server process with running threads is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=thumbnail_setting('POOL_SIZE', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def renders():
+    global _renders
+    with _pool_lock:
+        if _renders is None:
+            _renders = ThreadPoolExecutor(
+                max_workers=thumbnail_setting('POOL_SIZE', 2), thread_name_prefix='thumbnail'
+            )
+        return _renders
+
+
+def retry_after():
+    """Seconds after which a queued render should be done"""
+    return math.ceil(thumbnail_setting('TIME_BUDGET', 5.0)) + 1
+
+
+@lru_cache(maxsize=32)
+def placeholder(background):
+    """PNG of an empty board, shown until the first thumbnail is rendered"""
+    png, _ = render_png([], tuple(thumbnail_setting('SIZE', (320, 180))), background or '#ffffff')
+    return png
+
+
+def queue_render(key, function, *args):
+    """Run a render in a background thread unless one for key is queued"""
+    with _pool_lock:
+        if key in _queued:
+            return
+        _queued.add(key)
+
+    def run():
+        try:
+            function(*args)
+        except Exception:
+            logger.exception('Failed to render thumbnail of %s %s', *key)
+        finally:
+            with _pool_lock:
+                _queued.discard(key)
+            # Connections are per thread; do not keep this one open between renders
+            connections.close_all()
+
+    renders().submit(run)
+
+
+def read_thumbnail(field):
+    if not field:
+        return None
+    try:
+        with field.open('rb') as thumbnail:
+            return thumbnail.read()
+    except OSError:
+        return None
+
+
+def image_path(name):
+    """Filesystem path of an uploaded image, given its name or media URL"""
+    if not name:
+        return None
+    if name.startswith(settings.MEDIA_URL):
+        name = name[len(settings.MEDIA_URL):]
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def room_render_elements(room_id):
+    rows = DrawingElement.objects.filter(room_id=room_id, is_deleted=False).order_by(
+        'z_index', 'created_at'
+    ).values(*RENDER_FIELDS)
+    elements = []
+    for row in rows.iterator(chunk_size=2000):
+        if row['path_blob'] is not None:
+            row['path_blob'] = bytes(row['path_blob'])
+        row['image'] = image_path(row['image'])
+        elements.append(row)
+    return elements
+
+
+def snapshot_render_elements(snapshot):
+    elements = snapshot_elements(snapshot)
+    for element in elements:
+        element['image'] = image_path(element.get('image'))
+    return elements
+
+
+def render(elements, background):
+    """PNG bytes of the elements, rendered in the process pool"""
+    budget = thumbnail_setting('TIME_BUDGET', 5.0)
+    future = pool().submit(
+        render_png, elements, tuple(thumbnail_setting('SIZE', (320, 180))), background, budget
+    )
+    # Allow for a worker that is still starting up
+    png, complete = future.result(timeout=budget + 30)
+    if not complete:
+        logger.info('Rendered %d elements partially within %.1f s', len(elements), budget)
+    return png
+
+
+def room_thumbnail(room):
+    """PNG bytes of a room's stored thumbnail and whether it is current.
+
+    Returns None for a room without one. A missing or outdated thumbnail
+    is queued to be rendered.
+    """
+    png = read_thumbnail(room.thumbnail)
+    current = png is not None and room.thumbnail_revision == room.revision
+    if not current:
+        queue_render(('room', room.id), render_room, room.id)
+    return png, current
+
+
+def render_room(room_id):
+    # Read the revision first, so a change made meanwhile is rendered again
+    revision, background, thumbnail_revision, previous = Room.objects.values_list(
+        'revision', 'background_color', 'thumbnail_revision', 'thumbnail'
+    ).get(id=room_id)
+    if thumbnail_revision == revision and previous:
+        return
+    png = render(room_render_elements(room_id), background)
+    save_room_thumbnail(room_id, revision, previous, png)
+
+
+def save_room_thumbnail(room_id, revision, previous, png):
+    name = default_storage.save(f'thumbnails/rooms/{room_id}-{revision}.png', ContentFile(png))
+    Room.objects.filter(id=room_id).update(thumbnail=name, thumbnail_revision=revision)
+    if previous and previous != name:
+        default_storage.delete(previous)
+
+
+def snapshot_thumbnail(snapshot):
+    """PNG bytes of a snapshot's thumbnail, or None while the first one is
+    queued to be rendered"""
+    png = read_thumbnail(snapshot.thumbnail)
+    if png is None:
+        queue_render(('snapshot', snapshot.id), render_snapshot, snapshot.id)
+    return png
+
+
+def render_snapshot(snapshot_id):
+    snapshot = Snapshot.objects.select_related('room').get(id=snapshot_id)
+    if snapshot.thumbnail:
+        return
+    png = render(snapshot_render_elements(snapshot), snapshot.room.background_color)
+    snapshot.thumbnail.save(f'{snapshot.id}.png', ContentFile(png))
+
+
+class ThumbnailRefresher:
+    """Re-renders outdated room thumbnails once their room has not changed
+    for DELAY seconds; run by `manage.py refresh_thumbnails`"""
+
+    def __init__(self, delay=None):
+        self.delay = delay or thumbnail_setting('DELAY', 10.0) or 10.0
+
+    def due_rooms(self):
+        """Rooms with an outdated thumbnail and no change for DELAY seconds"""
+        last_change = RoomOperation.objects.filter(room=OuterRef('pk')).order_by('-seq').values('created_at')[:1]
+        return list(
+            Room.objects.exclude(thumbnail_revision=F('revision'))
+            .annotate(changed_at=Subquery(last_change))
+            .filter(changed_at__lt=timezone.now() - timedelta(seconds=self.delay))
+            .values_list('id', flat=True)
+        )
+
+    def run_forever(self):
+        while True:
+            try:
+                self.render_rooms(self.due_rooms())
+            except Exception:
+                logger.exception('Failed to refresh room thumbnails')
+            finally:
+                connections.close_all()
+            time.sleep(self.delay)
+
+    def render_rooms(self, rooms):
+        """Render up to POOL_SIZE rooms at once, saving each as it completes"""
+        limit = thumbnail_setting('POOL_SIZE', 2)
+        budget = thumbnail_setting('TIME_BUDGET', 5.0)
+        size = tuple(thumbnail_setting('SIZE', (320, 180)))
+        pending = {}
+        rooms = list(rooms)
+        while rooms or pending:
+            while rooms and len(pending) < limit:
+                room_id = rooms.pop()
+                try:
+                    revision, background, thumbnail_revision, previous = Room.objects.values_list(
+                        'revision', 'background_color', 'thumbnail_revision', 'thumbnail'
+                    ).get(id=room_id)
+                except Room.DoesNotExist:
+                    continue
+                if thumbnail_revision == revision:
+                    continue
+                future = pool().submit(render_png, room_render_elements(room_id), size, background, budget)
+                pending[future] = (room_id, revision, previous)
+            if not pending:
+                continue
+
+            done, _ = wait(pending, timeout=budget + 30, return_when=FIRST_COMPLETED)
+            if not done:
+                logger.warning('Thumbnail rendering timed out for %d rooms', len(pending))
+                return
+            for future in done:
+                room_id, revision, previous = pending.pop(future)
+                png, _ = future.result()
+                save_room_thumbnail(room_id, revision, previous, png)
+
@@ -7,6 +7,7 @@ router = DefaultRouter()
 router.register(r'rooms', views.RoomViewSet, basename='room')
 router.register(r'elements', views.DrawingElementViewSet, basename='element')
 router.register(r'snapshots', views.SnapshotViewSet, basename='snapshot')
+router.register(r'imports', views.ImportJobViewSet, basename='import')
 
 app_name = 'whiteboard'
 
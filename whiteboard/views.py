@@ -1,29 +1,111 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import IsAuthenticated
-from .models import Room, RoomParticipant, DrawingElement, Snapshot, Permission
-from .serializers import RoomSerializer, DrawingElementSerializer, SnapshotSerializer
+from rest_framework.renderers import BrowsableAPIRenderer
+from .models import Room, RoomParticipant, DrawingElement, Snapshot, ImportJob
+from .serializers import (
+    RoomSerializer, DrawingElementSerializer, SnapshotSerializer, ImportJobSerializer, serialize_elements,
+)
+from .batch import MAX_OPERATIONS, OP_PERMISSIONS, apply, parse_id, validate
+from .broadcast import elements_replacing, notify_cleared
+from .export import CONTENT_TYPES, aiterate, ndjson_chunks, svg_chunks
+from .geometry import bbox_q, parse_bbox
+from .imports import detect_format, submit
+from .oplog import (
+    Operation, append, changed_since, cleared_since, element_data, operations_since, rebuild,
+    scene_element,
+)
+from .permissions import RoomPermission, allows, room_permission
+from .renderers import ElementJSONRenderer
+from .restore import fork_room, restore_snapshot, room_batches, snapshot_batches
+from .snapshots import create_snapshot, diff
+from .thumbnails import placeholder, retry_after, room_thumbnail, snapshot_thumbnail
+import hashlib
 import json
-from django.db.models import Q
+from functools import partial
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.text import slugify
+
+
+def element_delta(room, elements, since, compact_paths=False):
+    """Elements of a queryset changed after a revision, and the ids of the
+    ones that were deleted or no longer match it"""
+    if since > room.revision or since < 0 or cleared_since(room.id, since):
+        # Nothing to diff against: send everything
+        return {
+            'revision': room.revision,
+            'reset': True,
+            'elements': serialize_elements(elements, compact_paths),
+            'removed': [],
+        }
+    
+    changed = sorted(changed_since(room.id, since))
+    data = []
+    for i in range(0, len(changed), 500):
+        data.extend(serialize_elements(elements.filter(id__in=changed[i:i + 500]), compact_paths))
+    data.sort(key=lambda element: (element['z_index'], element['created_at']))
+    returned = {str(element['id']) for element in data}
+    return {
+        'revision': room.revision,
+        'reset': False,
+        'elements': data,
+        'removed': [element_id for element_id in changed if element_id not in returned],
+    }
+
+
+def thumbnail_placeholder(background):
+    """A blank board, answered while the first thumbnail is rendered"""
+    response = HttpResponse(placeholder(background), content_type='image/png')
+    response['Cache-Control'] = 'no-store'
+    response['Retry-After'] = str(retry_after())
+    return response
+
+
+def visible_rooms(user):
+    """Rooms a user can see: public ones, their own and the ones they joined.
+    
+    Membership is an EXISTS subquery rather than a join, so rooms are not
+    repeated and need no DISTINCT.
+    """
+    rooms = Room.objects.select_related('created_by')
+    if not user.is_authenticated:
+        return rooms.filter(is_public=True)
+    return rooms.alias(
+        joined=Exists(RoomParticipant.objects.filter(room=OuterRef('pk'), user=user))
+    ).filter(Q(is_public=True) | Q(created_by=user) | Q(joined=True))
 
 
 class RoomViewSet(viewsets.ModelViewSet):
     serializer_class = RoomSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RoomPermission]
+    # Level each action needs in the room, see whiteboard.permissions
+    required_permissions = {
+        'update': 'admin',
+        'partial_update': 'admin',
+        'destroy': 'admin',
+        'clear': 'admin',
+        'save_snapshot': 'edit',
+        'import_elements': 'draw',
+        # Joining is how users get access to a room
+        'join': None,
+        'leave': None,
+    }
     
     def get_queryset(self):
-        user = self.request.user
         # Return rooms that are public or user has access to
-        return Room.objects.filter(
-            Q(is_public=True) | 
-            Q(created_by=user) |
-            Q(participants__user=user)
-        ).distinct()
+        return visible_rooms(self.request.user)
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
@@ -40,7 +122,7 @@ class RoomViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Check room capacity
+        # Check room capacity against the users connected right now
         if room.active_users_count >= room.max_users:
             return Response(
                 {'error': 'Room is full'}, 
@@ -96,30 +178,79 @@ class RoomViewSet(viewsets.ModelViewSet):
             for p in participants
         ]
         
-        return Response(participants_data)
+        # Pollers get a 304 while nobody joined, left or moved
+        etag = quote_etag(hashlib.md5(
+            json.dumps(participants_data, cls=DjangoJSONEncoder).encode()
+        ).hexdigest())
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        
+        response = Response(participants_data)
+        response['ETag'] = etag
+        return response
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['get'], renderer_classes=[ElementJSONRenderer, BrowsableAPIRenderer])
     def elements(self, request, pk=None):
+        """Live elements; with ?since=<revision> only what changed after it.
+        
+        Responses carry the room revision they reflect as their ETag and in
+        X-Room-Revision, so clients can revalidate or ask for a delta.
+        """
         room = self.get_object()
+        # The revision is read before the elements, so a change made in
+        # between is included again in the next delta
+        etag = quote_etag(str(room.revision))
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        
         elements = DrawingElement.objects.filter(
             room=room,
             is_deleted=False
         ).order_by('z_index', 'created_at')
         
-        serializer = DrawingElementSerializer(elements, many=True)
-        return Response(serializer.data)
+        # Optional ?bbox=x0,y0,x1,y1 limits the result to one area
+        if 'bbox' in request.query_params:
+            bbox = parse_bbox(request.query_params['bbox'])
+            if bbox is None:
+                return Response(
+                    {'error': 'bbox must be x0,y0,x1,y1'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            elements = elements.filter(bbox_q(bbox))
+        
+        # ?paths=compact returns stroke paths in the binary encoding
+        compact_paths = request.query_params.get('paths') == 'compact'
+        
+        if 'since' in request.query_params:
+            try:
+                since = int(request.query_params['since'])
+            except ValueError:
+                return Response(
+                    {'error': 'since must be an integer'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            data = element_delta(room, elements, since, compact_paths)
+        else:
+            data = serialize_elements(elements, compact_paths)
+        
+        response = Response(data)
+        response['ETag'] = etag
+        response['X-Room-Revision'] = str(room.revision)
+        return response
     
     @action(detail=True, methods=['post'])
     def clear(self, request, pk=None):
         room = self.get_object()
-        # Check if user has permission to clear
-        if room.created_by != request.user:
-            return Response(
-                {'error': 'Only room creator can clear the whiteboard'}, 
-                status=status.HTTP_403_FORBIDDEN
+        # Elements drawn before the clear may still be buffered by consumers
+        elements_replacing.send(sender=Room, room_id=room.id)
+        with transaction.atomic():
+            DrawingElement.objects.filter(room=room, is_deleted=False).update(
+                is_deleted=True, updated_at=timezone.now()
             )
-        
-        DrawingElement.objects.filter(room=room).update(is_deleted=True)
+            append(room.id, [Operation('clear', user_id=request.user.id)])
+            transaction.on_commit(partial(notify_cleared, room.id, request.user.username))
         return Response({'message': 'Whiteboard cleared successfully'})
     
     @action(detail=True, methods=['post'])
@@ -127,32 +258,143 @@ class RoomViewSet(viewsets.ModelViewSet):
         room = self.get_object()
         name = request.data.get('name', f'Snapshot {room.snapshots.count() + 1}')
         
-        # Get all current elements
-        elements = DrawingElement.objects.filter(
-            room=room,
-            is_deleted=False
-        ).order_by('z_index', 'created_at')
-        
-        elements_data = DrawingElementSerializer(elements, many=True).data
-        
-        snapshot = Snapshot.objects.create(
-            room=room,
-            name=name,
-            description=request.data.get('description', ''),
-            created_by=request.user,
-            elements_data=json.dumps(elements_data)
+        # Only elements changed since the room's last snapshot are serialized
+        snapshot, written = create_snapshot(
+            room, request.user, name, request.data.get('description', '')
         )
         
         return Response({
             'id': snapshot.id,
             'name': snapshot.name,
-            'created_at': snapshot.created_at
+            'created_at': snapshot.created_at,
+            'element_count': snapshot.element_count,
+            'stored_elements': written
+        })
+    
+    @action(detail=True, methods=['post'])
+    def fork(self, request, pk=None):
+        """New room owned by the user, starting from this room's current board"""
+        room = self.get_object()
+        # A public room's password still guards its content
+        if room.password and room.created_by != request.user:
+            if not RoomParticipant.objects.filter(room=room, user=request.user).exists():
+                return Response(
+                    {'error': 'Join the room before forking it'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        
+        name = request.data.get('name') or f'{room.name} (copy)'
+        fork, count = fork_room(room, request.user, name, room_batches(room.id))
+        
+        return Response(
+            {**RoomSerializer(fork).data, 'element_count': count},
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=True, methods=['get'])
+    def thumbnail(self, request, pk=None):
+        """PNG preview of the board"""
+        room = self.get_object()
+        png, current = room_thumbnail(room)
+        if png is None:
+            return thumbnail_placeholder(room.background_color)
+        response = HttpResponse(png, content_type='image/png')
+        response['Cache-Control'] = 'private, max-age=60'
+        if not current:
+            # An outdated one while the new one renders
+            response['Retry-After'] = str(retry_after())
+        return response
+    
+    @action(detail=True, methods=['get'], url_path='export/(?P<export_format>ndjson|svg)')
+    def export(self, request, pk=None, export_format=None):
+        """The board as NDJSON, one element per line, or as an SVG drawing,
+        streamed as it is read"""
+        room = self.get_object()
+        if export_format == 'svg':
+            chunks = svg_chunks(room)
+        else:
+            chunks = ndjson_chunks(room.id)
+        # ASGI servers collect a synchronous iterator in full before sending it
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiterate(chunks)
+        
+        response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[export_format])
+        filename = f'{slugify(room.name) or "room"}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['X-Room-Revision'] = str(room.revision)
+        return response
+    
+    @action(detail=True, methods=['post'], url_path='import')
+    def import_elements(self, request, pk=None):
+        """Add the elements of an uploaded NDJSON or snapshot file to the
+        board; the import runs in the background, see /api/imports/<id>/"""
+        room = self.get_object()
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(
+                {'error': 'Upload the elements as file'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        file_format = request.data.get('format') or detect_format(upload)
+        if file_format not in dict(ImportJob.FORMATS):
+            return Response(
+                {'error': f'format must be one of: {", ".join(dict(ImportJob.FORMATS))}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job = ImportJob.objects.create(
+            room=room, created_by=request.user, upload=upload, file_format=file_format
+        )
+        transaction.on_commit(partial(submit, job.id))
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def operations(self, request, pk=None):
+        """Operation log after ?since=<seq>, for clients catching up"""
+        room = self.get_object()
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = min(max(int(request.query_params.get('limit', 500)), 1), 5000)
+        except ValueError:
+            return Response(
+                {'error': 'since and limit must be integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        operations = operations_since(room.id, since, limit)
+        return Response({
+            'revision': room.revision,
+            'operations': operations,
+            'next': operations[-1]['seq'] if len(operations) == limit else None
+        })
+    
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """Elements of the room as they were at ?seq=<seq>"""
+        room = self.get_object()
+        try:
+            seq = int(request.query_params['seq'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'seq must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        scene, seq = rebuild(room.id, seq)
+        return Response({
+            'seq': seq,
+            'elements': [scene_element(element_id, data) for element_id, data in scene.items()]
         })
 
 
 class DrawingElementViewSet(viewsets.ModelViewSet):
     serializer_class = DrawingElementSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RoomPermission]
+    required_permissions = {
+        'update': 'edit',
+        'partial_update': 'edit',
+        'destroy': 'edit',
+    }
     
     def get_queryset(self):
         return DrawingElement.objects.filter(
@@ -161,12 +403,112 @@ class DrawingElementViewSet(viewsets.ModelViewSet):
         )
     
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        if not allows(room_permission(serializer.validated_data['room'], self.request.user), 'draw'):
+            raise PermissionDenied(RoomPermission.message)
+        with transaction.atomic():
+            element = serializer.save(created_by=self.request.user)
+            append(element.room_id, [
+                Operation('add', element.id, element_data(element), self.request.user.id)
+            ])
+    
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            element = serializer.save()
+            append(element.room_id, [
+                Operation(
+                    'update', element.id,
+                    element_data(element, serializer.validated_data),
+                    self.request.user.id
+                )
+            ])
+    
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            append(instance.room_id, [
+                Operation('delete', instance.id, user_id=self.request.user.id)
+            ])
+            instance.delete()
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Create, update and delete many elements of one room at once.
+        
+        Takes {"room": id, "operations": [{"op": "create", "data": {...}},
+        {"op": "update", "id": id, "data": {...}}, {"op": "delete", "id": id}]}
+        and returns the result of each operation in the same order. Nothing
+        is applied unless every operation is valid.
+        """
+        room_id = parse_id(request.data.get('room'))
+        operations = request.data.get('operations')
+        if room_id is None or not isinstance(operations, list):
+            return Response(
+                {'error': 'room and a list of operations are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(operations) > MAX_OPERATIONS:
+            return Response(
+                {'error': f'At most {MAX_OPERATIONS} operations per batch'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        room = get_object_or_404(visible_rooms(request.user), id=room_id)
+        level = room_permission(room, request.user)
+        for operation in operations:
+            required = OP_PERMISSIONS.get(operation.get('op')) if isinstance(operation, dict) else None
+            if required is not None and not allows(level, required):
+                raise PermissionDenied(RoomPermission.message)
+        
+        validated, errors = validate(room, operations)
+        if errors:
+            return Response({
+                'results': [
+                    {'index': i, 'errors': errors[i]} if i in errors else {'index': i}
+                    for i in range(len(operations))
+                ]
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # One transaction and one broadcast for the whole batch
+        elements, serialized, revision = apply(room, request.user, validated)
+        results = []
+        for i, ((kind, _, _), element) in enumerate(zip(validated, elements)):
+            result = {'index': i, 'op': kind, 'id': element.id}
+            if kind != 'delete':
+                result['element'] = serialized[element.id]
+            results.append(result)
+        return Response({'revision': revision, 'results': results})
+
+
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Progress of the user's element imports"""
+    serializer_class = ImportJobSerializer
+    
+    def get_queryset(self):
+        return ImportJob.objects.filter(created_by=self.request.user)
+    
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """Continue a failed or interrupted import after its last committed batch"""
+        job = self.get_object()
+        if job.status == 'done' or not job.upload:
+            return Response(
+                {'error': 'Only unfinished uploads can be resumed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not allows(room_permission(job.room, request.user), 'draw'):
+            raise PermissionDenied(RoomPermission.message)
+        transaction.on_commit(partial(submit, job.id))
+        return Response(ImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
 
 class SnapshotViewSet(viewsets.ModelViewSet):
     serializer_class = SnapshotSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RoomPermission]
+    required_permissions = {
+        'update': 'admin',
+        'partial_update': 'admin',
+        'destroy': 'admin',
+        'restore': 'admin',
+    }
     
     def get_queryset(self):
         return Snapshot.objects.filter(
@@ -176,29 +518,57 @@ class SnapshotViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def restore(self, request, pk=None):
         snapshot = self.get_object()
-        room = snapshot.room
+        # One transaction; connected clients reload the board after it commits
+        count = restore_snapshot(snapshot, request.user)
         
-        # Check if user has permission to restore
-        if room.created_by != request.user:
+        return Response({'message': 'Snapshot restored successfully', 'element_count': count})
+    
+    @action(detail=True, methods=['post'])
+    def fork(self, request, pk=None):
+        """New room owned by the user, starting from this snapshot"""
+        snapshot = self.get_object()
+        name = request.data.get('name') or f'{snapshot.room.name} ({snapshot.name})'
+        room, count = fork_room(snapshot.room, request.user, name, snapshot_batches(snapshot))
+        
+        return Response(
+            {**RoomSerializer(room).data, 'element_count': count},
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=True, methods=['get'])
+    def thumbnail(self, request, pk=None):
+        """PNG preview of the snapshot"""
+        snapshot = self.get_object()
+        png = snapshot_thumbnail(snapshot)
+        if png is None:
+            return thumbnail_placeholder(snapshot.room.background_color)
+        response = HttpResponse(png, content_type='image/png')
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def diff(self, request, pk=None):
+        """Elements added, removed and changed since the ?against=<id> snapshot"""
+        snapshot = self.get_object()
+        against = request.query_params.get('against')
+        if not against:
             return Response(
-                {'error': 'Only room creator can restore snapshots'}, 
-                status=status.HTTP_403_FORBIDDEN
+                {'error': 'against must be a snapshot id'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-        
-        # Clear current elements
-        DrawingElement.objects.filter(room=room).update(is_deleted=True)
-        
-        # Restore elements from snapshot
-        elements_data = json.loads(snapshot.elements_data)
-        for element_data in elements_data:
-            element_data.pop('id', None)  # Remove ID to create new objects
-            DrawingElement.objects.create(
-                room=room,
-                created_by=request.user,
-                **element_data
+        try:
+            other = self.get_queryset().filter(room=snapshot.room).distinct().get(id=against)
+        except (Snapshot.DoesNotExist, ValidationError):
+            return Response(
+                {'error': 'Snapshot not found in this room'},
+                status=status.HTTP_404_NOT_FOUND
             )
         
-        return Response({'message': 'Snapshot restored successfully'})
+        return Response({
+            'from': other.id,
+            'to': snapshot.id,
+            **diff(other, snapshot)
+        })
 
 
 @login_required
@@ -207,9 +577,8 @@ def whiteboard_room(request, room_id):
     room = get_object_or_404(Room, id=room_id)
     
     # Check if user has access to the room
-    if not room.is_public and room.created_by != request.user:
-        if not RoomParticipant.objects.filter(room=room, user=request.user).exists():
-            return render(request, 'whiteboard/access_denied.html', {'room': room})
+    if not allows(room_permission(room, request.user), 'view'):
+        return render(request, 'whiteboard/access_denied.html', {'room': room})
     
     context = {
         'room': room,
@@ -223,14 +592,6 @@ def whiteboard_room(request, room_id):
 
 def room_list(request):
     """List of available rooms"""
-    if request.user.is_authenticated:
-        rooms = Room.objects.filter(
-            Q(is_public=True) | 
-            Q(created_by=request.user) |
-            Q(participants__user=request.user)
-        ).distinct().order_by('-created_at')
-    else:
-        rooms = Room.objects.filter(is_public=True).order_by('-created_at')
-    
+    rooms = visible_rooms(request.user).order_by('-created_at')
     context = {'rooms': rooms}
     return render(request, 'whiteboard/room_list.html', context)